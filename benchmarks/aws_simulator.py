@@ -0,0 +1,210 @@
+"""
+A latency-injecting AWS simulator for timing the toggle/idle flows end to end, offline.
+
+Moto answers instantly and reports instances "running" the moment they launch, so on its own it
+says nothing about how enable_vpn's readiness wait, the region fan-out or the idle checker behave
+against real-world timings. SimulatedAws wraps moto and, through botocore event hooks on the
+aws_helpers client pool's session, adds:
+
+  * per-region API latency (applied to every HTTP attempt, so retries pay it again);
+  * instance boot delays - DescribeInstances reports "pending" until an instance has been
+    visible for its boot time;
+  * stuck launches - a fraction of instances never leave "pending";
+  * throttling - a fraction of HTTP attempts get a 503, which botocore's standard retry mode
+    retries with backoff (and surfaces as a ClientError once attempts run out).
+
+All of this runs on a scaled clock: simulated durations are multiplied by `time_scale` before
+being slept for real, and aws_helpers' `time` is replaced so the readiness waiter's sleeps and
+deadline run on the same simulated clock. A 60s boot at time_scale=0.1 takes 6s of real time.
+Real processing time (moto, botocore) is amplified by 1/time_scale too, so very small scales
+inflate the results - 0.1 keeps that overhead to a few simulated seconds per toggle.
+(botocore's own retry backoff sleeps are not scaled.)
+"""
+
+import random
+import re
+import threading
+import time
+
+import boto3
+import botocore.session
+from botocore.awsrequest import AWSResponse
+from moto import mock_aws
+
+from vpn_toggle import aws_helpers
+
+# Rough round-trip times (ms) from eu-west-1, where the Lambdas run. Route53 is global
+# (endpoint in us-east-1).
+DEFAULT_REGION_LATENCY_MS = {
+    "eu-west-1": 5,
+    "eu-west-2": 12,
+    "eu-west-3": 20,
+    "eu-north-1": 40,
+    "us-east-1": 75,
+    "ca-central-1": 80,
+    "ap-southeast-2": 260,
+    None: 75,
+}
+
+_REGION_IN_HOST = re.compile(r"\.([a-z]{2}(?:-[a-z]+)+-\d)\.amazonaws\.com")
+
+
+class ScaledClock:
+    """Stands in for the time module: simulated seconds, slept for real at time_scale."""
+
+    def __init__(self, time_scale: float):
+        self.time_scale = time_scale
+        self._origin = time.monotonic()
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._origin) / self.time_scale
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(max(seconds, 0) * self.time_scale)
+
+
+class SimulatedAws:
+    """
+    Context manager: an active moto mock plus injected latency, boot delays, stuck launches
+    and throttling for everything aws_helpers calls. Create fixtures (ASGs etc.) inside it.
+    """
+
+    def __init__(
+        self,
+        region_latency_ms: dict | None = None,
+        boot_seconds: tuple[float, float] = (45.0, 75.0),
+        stuck_launch_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        time_scale: float = 0.1,
+        seed: int | None = None,
+    ):
+        """
+        @param region_latency_ms: region (None for global services) -> simulated RTT in ms
+        @param boot_seconds: (min, max) simulated boot time, drawn uniformly per instance
+        @param stuck_launch_rate: fraction of instances that never reach "running"
+        @param throttle_rate: fraction of HTTP attempts answered with a 503
+        """
+        self.region_latency_ms = {**DEFAULT_REGION_LATENCY_MS, **(region_latency_ms or {})}
+        self.boot_seconds = boot_seconds
+        self.stuck_launch_rate = stuck_launch_rate
+        self.throttle_rate = throttle_rate
+        self.clock = ScaledClock(time_scale)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # instance ID -> simulated time it becomes running (None if stuck)
+        self._ready_at: dict[str, float | None] = {}
+        self._mock = mock_aws()
+        self._saved = None
+        self.throttled = 0
+
+    def __enter__(self):
+        self._mock.start()
+        session = botocore.session.get_session()
+        # Must run before moto's own before-send handler, which would otherwise answer first.
+        session.get_component("event_emitter").register_first("before-send", self._before_send)
+        session.register("after-call.ec2.DescribeInstances", self._after_describe_instances)
+        self._saved = (aws_helpers._session, aws_helpers.time)
+        aws_helpers.reset_client_pool()
+        aws_helpers._hosted_zone_ids.clear()
+        aws_helpers._session = session
+        aws_helpers.time = self.clock
+        return self
+
+    def __exit__(self, *exc_info):
+        aws_helpers.reset_client_pool()
+        aws_helpers._hosted_zone_ids.clear()
+        aws_helpers._session, aws_helpers.time = self._saved
+        self._mock.stop()
+        return False
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _before_send(self, request, **kwargs):
+        match = _REGION_IN_HOST.search(request.url)
+        region = match.group(1) if match else None
+        latency_ms = self.region_latency_ms.get(region, self.region_latency_ms[None])
+        self.clock.sleep(latency_ms / 1000)
+        if self.throttle_rate and self._draw() < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            return AWSResponse(request.url, 503, {}, _EmptyBody())
+        return None
+
+    def _after_describe_instances(self, parsed, **kwargs):
+        now = self.clock.monotonic()
+        for reservation in parsed.get("Reservations", []):
+            for instance in reservation["Instances"]:
+                if instance["State"]["Name"] != "running":
+                    continue
+                instance_id = instance["InstanceId"]
+                with self._lock:
+                    if instance_id not in self._ready_at:
+                        if self._random.random() < self.stuck_launch_rate:
+                            self._ready_at[instance_id] = None
+                        else:
+                            self._ready_at[instance_id] = now + self._random.uniform(*self.boot_seconds)
+                    ready_at = self._ready_at[instance_id]
+                if ready_at is None or now < ready_at:
+                    instance["State"] = {"Code": 0, "Name": "pending"}
+
+
+def create_vpn_region(region: str, desired_capacity: int = 0) -> str:
+    """
+    Creates a tagged wireguard ASG (with its VPC, security group and launch template) in the
+    region, mirroring lib/vpn-vm-deploy-stack.ts. Uses a plain boto3 client, so fixture setup
+    pays no simulated latency. Call inside an active SimulatedAws.
+    @return: the ASG name
+    """
+    ec2 = boto3.client("ec2", region_name=region)
+    vpc_id = ec2.create_vpc(CidrBlock="172.32.0.0/16")["Vpc"]["VpcId"]
+    subnet_id = ec2.create_subnet(VpcId=vpc_id, CidrBlock="172.32.0.0/28")["Subnet"]["SubnetId"]
+    ec2.modify_subnet_attribute(SubnetId=subnet_id, MapPublicIpOnLaunch={"Value": True})
+    security_group_id = ec2.create_security_group(
+        GroupName=f"wireguard-sg-{region}", Description="wireguard", VpcId=vpc_id
+    )["GroupId"]
+    ec2.authorize_security_group_ingress(
+        GroupId=security_group_id,
+        IpPermissions=[
+            {"IpProtocol": "udp", "FromPort": 51820, "ToPort": 51820, "IpRanges": [{"CidrIp": "0.0.0.0/0"}]},
+            {"IpProtocol": "tcp", "FromPort": 22, "ToPort": 22, "IpRanges": [{"CidrIp": "1.2.3.4/32"}]},
+        ],
+    )
+    ec2.create_launch_template(
+        LaunchTemplateName=f"wireguard-lt-{region}",
+        LaunchTemplateData={
+            "ImageId": "ami-12345678",
+            "InstanceType": "t3.micro",
+            "SecurityGroupIds": [security_group_id],
+        },
+    )
+    asg_name = f"wireguard-asg-{region}"
+    boto3.client("autoscaling", region_name=region).create_auto_scaling_group(
+        AutoScalingGroupName=asg_name,
+        LaunchTemplate={"LaunchTemplateName": f"wireguard-lt-{region}", "Version": "$Latest"},
+        MinSize=0,
+        MaxSize=1,
+        DesiredCapacity=desired_capacity,
+        VPCZoneIdentifier=subnet_id,
+        Tags=[
+            {
+                "Key": aws_helpers.APPLICATION_NAME_KEY,
+                "Value": aws_helpers.APPLICATION_NAME_VALUE,
+                "PropagateAtLaunch": True,
+                "ResourceId": asg_name,
+                "ResourceType": "auto-scaling-group",
+            }
+        ],
+    )
+    return asg_name
+
+
+class _EmptyBody:
+    """Minimal raw-response stand-in for AWSResponse."""
+
+    def stream(self, **kwargs):
+        yield b""
+
+    def read(self, *args, **kwargs):
+        return b""
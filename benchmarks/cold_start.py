@@ -0,0 +1,183 @@
+"""
+Cold-start benchmark for the Python Lambdas.
+
+Measures, each in a fresh interpreter so nothing is already imported or cached:
+  * import time of each handler module, via `python -X importtime` (median of --runs), plus
+    the modules contributing most to it;
+  * handler first-call and second-call latency against moto, i.e. the cost of building the
+    pooled clients on a cold container versus reusing them on a warm one.
+
+Moto itself imports botocore, so the first-call figure excludes botocore's import cost -
+that's what the import-time figure is for.
+
+Usage (from the repo root):
+    python benchmarks/cold_start.py [--runs 5] [--top 10] [--json]
+        [--max-import-ms vpn_toggle.vpn_toggle=250 ...]
+
+With --max-import-ms, exits non-zero if a module's median import time exceeds its budget,
+so the benchmark can gate regressions in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Same list as vpn_toggle.aws_helpers.VALID_ZONES - not imported from there, so this process
+# never warms anything the measured subprocesses import.
+REGIONS = ["eu-west-1", "us-east-1", "eu-north-1", "eu-west-2", "ap-southeast-2", "ca-central-1", "eu-west-3"]
+HANDLER_MODULES = ["vpn_toggle.vpn_toggle", "vpn_toggle.idle_shutdown"]
+
+# Run in a subprocess: sets up a moto account with a stopped VPN ASG in every region, then
+# times the first (cold) and second (warm) handler calls. Each handler takes a path that
+# needs no instance boot - "none" for the toggler, nothing-to-stop for the idle checker.
+FIRST_CALL_SCRIPT = """
+import json, os, time
+os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing",
+                  AWS_DEFAULT_REGION="eu-west-1", A_RECORD_NAME="vpn.example.com",
+                  DOMAIN_NAME="example.com",
+                  NOTIFICATION_TOPIC_ARN="arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+import boto3
+from moto import mock_aws
+
+with mock_aws():
+    for region in __REGIONS__:
+        ec2 = boto3.client("ec2", region_name=region)
+        vpc_id = ec2.create_vpc(CidrBlock="172.32.0.0/16")["Vpc"]["VpcId"]
+        subnet_id = ec2.create_subnet(VpcId=vpc_id, CidrBlock="172.32.0.0/28")["Subnet"]["SubnetId"]
+        ec2.create_launch_template(LaunchTemplateName="wireguard-lt",
+                                   LaunchTemplateData={"ImageId": "ami-12345678", "InstanceType": "t3.micro"})
+        boto3.client("autoscaling", region_name=region).create_auto_scaling_group(
+            AutoScalingGroupName="wireguard-asg",
+            LaunchTemplate={"LaunchTemplateName": "wireguard-lt", "Version": "$Latest"},
+            MinSize=0, MaxSize=1, DesiredCapacity=0, VPCZoneIdentifier=subnet_id,
+            Tags=[{"Key": "application-name", "Value": "wireguard-vpn", "PropagateAtLaunch": True,
+                   "ResourceId": "wireguard-asg", "ResourceType": "auto-scaling-group"}])
+
+    started = time.perf_counter()
+    import __MODULE__ as handler_module
+    imported = time.perf_counter()
+    handler_module.handler(__EVENT__)
+    first = time.perf_counter()
+    handler_module.handler(__EVENT__)
+    second = time.perf_counter()
+    print(json.dumps({"import_ms": (imported - started) * 1000,
+                      "first_call_ms": (first - imported) * 1000,
+                      "second_call_ms": (second - first) * 1000}))
+"""
+
+HANDLER_EVENTS = {
+    "vpn_toggle.vpn_toggle": {"region": "none", "whitelist_ip": "1.2.3.4"},
+    "vpn_toggle.idle_shutdown": {},
+}
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(REPO_ROOT, "src"), env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_import(module: str) -> tuple[float, list[tuple[str, float, float]]]:
+    """
+    Imports the module in a fresh interpreter under -X importtime.
+    @return: (cumulative_ms, [(imported_module, self_ms, cumulative_ms), ...])
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    total = next(cumulative for name, _, cumulative in reversed(rows) if name == module)
+    return total, rows
+
+
+def measure_first_call(module: str) -> dict:
+    """Times the handler's import, first call and second call in a fresh interpreter under moto."""
+    script = (
+        FIRST_CALL_SCRIPT.replace("__MODULE__", module)
+        .replace("__EVENT__", repr(HANDLER_EVENTS[module]))
+        .replace("__REGIONS__", repr(REGIONS))
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], env=_env(), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(runs: int, top: int) -> dict:
+    report = {}
+    for module in HANDLER_MODULES:
+        import_times = []
+        rows = []
+        for _ in range(runs):
+            total, rows = measure_import(module)
+            import_times.append(total)
+        calls = [measure_first_call(module) for _ in range(runs)]
+        report[module] = {
+            "import_ms_median": statistics.median(import_times),
+            "import_ms_min": min(import_times),
+            "top_self_imports": [
+                {"module": name, "self_ms": self_ms, "cumulative_ms": cumulative}
+                for name, self_ms, cumulative in sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+            ],
+            "first_call_ms_median": statistics.median(c["first_call_ms"] for c in calls),
+            "second_call_ms_median": statistics.median(c["second_call_ms"] for c in calls),
+        }
+    return report
+
+
+def _print_report(report: dict) -> None:
+    for module, result in report.items():
+        print(f"{module}")
+        print(f"  import (median / min):   {result['import_ms_median']:8.1f} / {result['import_ms_min']:.1f} ms")
+        print(f"  first handler call:      {result['first_call_ms_median']:8.1f} ms")
+        print(f"  second handler call:     {result['second_call_ms_median']:8.1f} ms")
+        print("  heaviest imports (self ms, cumulative ms):")
+        for row in result["top_self_imports"]:
+            print(f"    {row['self_ms']:8.1f} {row['cumulative_ms']:9.1f}  {row['module']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument(
+        "--max-import-ms",
+        action="append",
+        default=[],
+        metavar="MODULE=MS",
+        help="fail if MODULE's median import time exceeds MS (repeatable)",
+    )
+    args = parser.parse_args()
+
+    report = run(args.runs, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+    failed = False
+    for budget in args.max_import_ms:
+        module, limit = budget.split("=")
+        measured = report[module]["import_ms_median"]
+        if measured > float(limit):
+            print(f"FAIL: {module} imports in {measured:.1f} ms, over its {limit} ms budget", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
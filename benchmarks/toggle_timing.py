@@ -0,0 +1,114 @@
+"""
+Time-to-ready distributions for manage_vpn against the latency-injecting AWS simulator.
+
+Each trial builds a fresh simulated account (every VPN region deployed, one of them running),
+switches the VPN to a target region with manage_vpn, and records how long that took on the
+simulated clock, along with the target region's outcome (enabled / timed-out / launch-failed /
+error). Percentiles are reported per target region.
+
+Usage (from the repo root):
+    python benchmarks/toggle_timing.py [--trials 20] [--targets ap-southeast-2 us-east-1]
+        [--boot-seconds 45 75] [--stuck-rate 0.05] [--throttle-rate 0.02]
+        [--ready-timeout 90] [--time-scale 0.1] [--seed 1] [--json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import boto3  # noqa: E402
+from aws_simulator import SimulatedAws, create_vpn_region  # noqa: E402
+
+from vpn_toggle import idempotency, region_state, vpn_toggle  # noqa: E402
+from vpn_toggle.aws_helpers import VALID_ZONES  # noqa: E402
+
+A_RECORD = "vpn.example.com"
+ZONE = "example.com"
+
+
+def run_trial(target: str, start_region: str, simulator_options: dict, ready_timeout: float) -> tuple[float, str]:
+    """@return: (simulated seconds manage_vpn took, the target region's outcome)"""
+    with SimulatedAws(**simulator_options) as sim:
+        for region in VALID_ZONES:
+            create_vpn_region(region, desired_capacity=1 if region == start_region else 0)
+        boto3.client("route53").create_hosted_zone(Name=ZONE, CallerReference="toggle-timing")
+        # SimulatedAws resets the client pool and zone ID cache; the rest of the state is ours.
+        region_state.reset_ledger()
+        idempotency.clear()
+        os.environ["READY_TIMEOUT_SECONDS"] = str(ready_timeout)
+
+        started = sim.clock.monotonic()
+        results = vpn_toggle.manage_vpn(target, A_RECORD, ZONE, "9.9.9.9")
+        elapsed = sim.clock.monotonic() - started
+    return elapsed, results[target]
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--targets", nargs="+", default=["eu-west-2", "us-east-1", "ap-southeast-2"])
+    parser.add_argument("--start-region", default="eu-west-1")
+    parser.add_argument("--boot-seconds", type=float, nargs=2, default=(45.0, 75.0), metavar=("MIN", "MAX"))
+    parser.add_argument("--stuck-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--ready-timeout", type=float, default=vpn_toggle.DEFAULT_READY_TIMEOUT_SECONDS)
+    parser.add_argument("--time-scale", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    # The toggler logs every readiness poll; only the report matters here.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = {}
+    for target in args.targets:
+        durations, outcomes = [], Counter()
+        for trial in range(args.trials):
+            options = {
+                "boot_seconds": tuple(args.boot_seconds),
+                "stuck_launch_rate": args.stuck_rate,
+                "throttle_rate": args.throttle_rate,
+                "time_scale": args.time_scale,
+                "seed": None if args.seed is None else args.seed + trial,
+            }
+            elapsed, outcome = run_trial(target, args.start_region, options, args.ready_timeout)
+            outcomes[outcome] += 1
+            if outcome == "enabled":
+                durations.append(elapsed)
+        report[target] = {
+            "outcomes": dict(outcomes),
+            "time_to_ready_seconds": {
+                "p50": _percentile(durations, 50),
+                "p90": _percentile(durations, 90),
+                "p99": _percentile(durations, 99),
+                "max": max(durations),
+                "mean": statistics.mean(durations),
+            }
+            if durations
+            else None,
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for target, result in report.items():
+            print(f"{target}: outcomes {result['outcomes']}")
+            stats = result["time_to_ready_seconds"]
+            if stats:
+                print("  time-to-ready (s): " + "  ".join(f"{name} {value:6.1f}" for name, value in stats.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,7 @@ import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as logs from 'aws-cdk-lib/aws-logs';
 import * as apigateway from 'aws-cdk-lib/aws-apigateway';
 import * as ssm from 'aws-cdk-lib/aws-ssm';
+import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as events from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 
@@ -17,6 +18,12 @@ export class VPNLambdaDeployStack extends cdk.Stack {
 
     const a_record_name = process.env.RECORD_NAME || '';
     const domain_name = process.env.ZONE_NAME || '';    
+    // Instances per started region; must match VPNVMDeployStack's instanceCount.
+    const instanceCount = process.env.VPN_INSTANCE_COUNT || '1';
+    // Opt-in X-Ray active tracing for the starter proxy and toggle Lambdas. Requests are
+    // always correlated by the proxy's trace ID (see src/vpn_toggle/tracing.py); this adds
+    // X-Ray segments on top.
+    const lambdaTracing = process.env.ENABLE_XRAY_TRACING === 'true' ? lambda.Tracing.ACTIVE : lambda.Tracing.DISABLED;
     const receive_topic = new sns.Topic(this, process.env.CDK_DEFAULT_REGION || '');
     const MyTopicPolicy = new sns.TopicPolicy(this, 'VPNTopicSNSPolicy', {
         topics: [receive_topic],
@@ -39,6 +46,14 @@ export class VPNLambdaDeployStack extends cdk.Stack {
         }
       ));
 
+      // Region-state ledger (see src/vpn_toggle/region_state.py): lets the toggle and
+      // idle-shutdown Lambdas skip regions already known to be off.
+      const regionStateParameter = new ssm.StringParameter(this, 'VPNRegionStateParameter', {
+        parameterName: '/vpn-wireguard/REGION_STATE',
+        stringValue: '{}',
+        description: 'Last known desired capacity/instance per VPN region, maintained by the VPN Lambdas',
+      });
+
       const role = new iam.Role(this, 'VPNLambdaRole', {
         assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
         managedPolicies: [
@@ -57,7 +72,8 @@ export class VPNLambdaDeployStack extends cdk.Stack {
               }),
               new iam.PolicyStatement({
                 effect: iam.Effect.ALLOW,
-                actions: ['autoscaling:DescribeAutoScalingGroups', 'autoscaling:DescribeAutoScalingInstances', 'ec2:DescribeInstances', 'ec2:DescribeSecurityGroups'],
+                actions: ['autoscaling:DescribeAutoScalingGroups', 'autoscaling:DescribeAutoScalingInstances', 'ec2:DescribeInstances', 'ec2:DescribeSecurityGroups',
+                  'ec2:DescribeManagedPrefixLists', 'ec2:GetManagedPrefixListEntries'],
                 resources: ['*'],
               }),
               new iam.PolicyStatement({
@@ -69,6 +85,12 @@ export class VPNLambdaDeployStack extends cdk.Stack {
           })
       }});
 
+      // Layers are mounted read-only, so anything not in the zip (or not precompiled) costs
+      // every cold start. The handlers only use botocore (not boto3/s3transfer) and a handful
+      // of service models, so everything else is stripped from the layer. (s3 is only for
+      // uploading on-demand profiles - see profileBucket below.)
+      const layerSitePackages = '/asset-output/python/lib/python3.11/site-packages';
+      const layerBotocoreServices = ['autoscaling', 'cloudwatch', 'ec2', 'route53', 's3', 'sns', 'ssm', 'sts'];
       const layer = new lambda.LayerVersion(this, 'VPNLibsLayer', {
         code: lambda.Code.fromAsset('.', {
           exclude: ['*.pyc'],
@@ -77,8 +99,15 @@ export class VPNLambdaDeployStack extends cdk.Stack {
             user: "root",
             command: [
               'bash', '-c',
-              'cd /asset-input && pip install poetry && poetry self add poetry-plugin-export && poetry export -f requirements.txt --without-hashes > layer_requirements.txt && \
-              mkdir -p /asset-output/python/lib/python3.11/site-packages/ && pip install -r layer_requirements.txt --no-cache-dir --no-deps -t /asset-output/python/lib/python3.11/site-packages/ . && rm -r /asset-output/python/lib/python3.11/site-packages/vpn_toggle*'
+              'cd /asset-input && pip install poetry && poetry self add poetry-plugin-export && ' +
+              'poetry export -f requirements.txt --without-hashes > layer_requirements.txt && ' +
+              `mkdir -p ${layerSitePackages}/ && ` +
+              `pip install -r layer_requirements.txt --no-cache-dir --no-deps -t ${layerSitePackages}/ . && ` +
+              `rm -r ${layerSitePackages}/vpn_toggle* ${layerSitePackages}/boto3* ${layerSitePackages}/s3transfer* && ` +
+              `cd ${layerSitePackages}/botocore/data && ` +
+              `for d in */; do case " ${layerBotocoreServices.join(' ')} " in *" \${d%/} "*) ;; *) rm -r "$d" ;; esac; done && ` +
+              `find ${layerSitePackages} -name 'examples-1.json' -delete && ` +
+              `python -m compileall -q ${layerSitePackages}`
             ]
           }
         })
@@ -90,13 +119,27 @@ export class VPNLambdaDeployStack extends cdk.Stack {
         runtime: lambda.Runtime.PYTHON_3_11,
         environment: {
           A_RECORD_NAME: a_record_name,
-          DOMAIN_NAME: domain_name
+          DOMAIN_NAME: domain_name,
+          REGION_STATE_PARAMETER: regionStateParameter.parameterName,
+          // Request capacity and return; VPNFinalizeFunction does DNS + security group.
+          FINALIZE_ON_EVENT: 'true',
+          // Push the whitelist to every region's prefix lists up front (VPNVMDeployStack).
+          WHITELIST_PREFIX_LISTS: 'true',
+          VPN_INSTANCE_COUNT: instanceCount,
         },
         role: role,
         layers: [layer],
-        timeout: cdk.Duration.seconds(180)
+        timeout: cdk.Duration.seconds(180),
+        tracing: lambdaTracing,
+        // SNS invokes once per message, so a burst of requests (a double-tapped shortcut,
+        // retries) would otherwise run as concurrent toggles racing each other. With one at a
+        // time, the throttled deliveries are retried by Lambda's async queue and the repeats
+        // among them are answered by the repeat-request check.
+        reservedConcurrentExecutions: 1,
       });
       VPNToggleFunction.addEventSource(new SnsEventSource(receive_topic));
+      regionStateParameter.grantRead(VPNToggleFunction);
+      regionStateParameter.grantWrite(VPNToggleFunction);
 
       const vpnToggleLogGroup = new logs.LogGroup(this, 'vpnToggleLogGroup', {
         logGroupName: `/aws/lambda/${VPNToggleFunction.functionName}`,
@@ -104,6 +147,44 @@ export class VPNLambdaDeployStack extends cdk.Stack {
         removalPolicy: cdk.RemovalPolicy.DESTROY
       });
 
+      // VPN Finalize Lambda Function
+      // Completes the toggle's pending start (DNS + security group) the moment EC2 reports
+      // the new instance running. Each VPN region's stack forwards its EC2 state-change
+      // events to this region's default event bus (see VPNVMDeployStack).
+      const finalizeFunction = new lambda.Function(this, 'VPNFinalizeFunction', {
+        code: new lambda.AssetCode('src'),
+        handler: 'vpn_toggle.finalize.handler',
+        runtime: lambda.Runtime.PYTHON_3_11,
+        environment: {
+          A_RECORD_NAME: a_record_name,
+          DOMAIN_NAME: domain_name,
+          REGION_STATE_PARAMETER: regionStateParameter.parameterName,
+          WHITELIST_PREFIX_LISTS: 'true',
+        },
+        role: role,
+        layers: [layer],
+        timeout: cdk.Duration.seconds(60),
+        tracing: lambdaTracing,
+      });
+      regionStateParameter.grantRead(finalizeFunction);
+      regionStateParameter.grantWrite(finalizeFunction);
+
+      const finalizeLogGroup = new logs.LogGroup(this, 'VPNFinalizeLogGroup', {
+        logGroupName: `/aws/lambda/${finalizeFunction.functionName}`,
+        retention: logs.RetentionDays.ONE_MONTH,
+        removalPolicy: cdk.RemovalPolicy.DESTROY
+      });
+
+      const finalizeRule = new events.Rule(this, 'VPNFinalizeRule', {
+        eventPattern: {
+          source: ['aws.ec2'],
+          detailType: ['EC2 Instance State-change Notification'],
+          detail: { state: ['running'] },
+        },
+        description: 'Finalizes a pending VPN start when its instance reaches running.',
+      });
+      finalizeRule.addTarget(new targets.LambdaFunction(finalizeFunction));
+
       // VPN Idle Shutdown Lambda Function
       // Runs on a schedule; auto-stops any region's VPN that has been idle or has
       // exceeded a hard runtime cap, so a forgotten VPN doesn't rack up compute costs.
@@ -125,7 +206,8 @@ export class VPNLambdaDeployStack extends cdk.Stack {
             statements: [
               new iam.PolicyStatement({
                 effect: iam.Effect.ALLOW,
-                actions: ['autoscaling:UpdateAutoScalingGroup'],
+                // Terminate: one idle instance of several is taken out on its own.
+                actions: ['autoscaling:UpdateAutoScalingGroup', 'autoscaling:TerminateInstanceInAutoScalingGroup'],
                 conditions: {
                   "StringEquals": {"aws:ResourceTag/application-name": "wireguard-vpn"}
                 },
@@ -136,6 +218,12 @@ export class VPNLambdaDeployStack extends cdk.Stack {
                 actions: ['autoscaling:DescribeAutoScalingGroups', 'autoscaling:DescribeAutoScalingInstances', 'ec2:DescribeInstances'],
                 resources: ['*'],
               }),
+              new iam.PolicyStatement({
+                effect: iam.Effect.ALLOW,
+                // The A record then lists only the instances left running.
+                actions: ['route53:listHostedZonesByName', 'route53:changeResourceRecordSets', 'route53:listResourceRecordSets'],
+                resources: ['*'],
+              }),
               new iam.PolicyStatement({
                 effect: iam.Effect.ALLOW,
                 actions: ['cloudwatch:GetMetricData'],
@@ -160,12 +248,18 @@ export class VPNLambdaDeployStack extends cdk.Stack {
           GRACE_PERIOD_MINUTES: '15',
           IDLE_WINDOW_MINUTES: '30',
           IDLE_BYTE_THRESHOLD_BYTES: `${5 * 1024 * 1024}`,
+          REGION_STATE_PARAMETER: regionStateParameter.parameterName,
+          A_RECORD_NAME: a_record_name,
+          DOMAIN_NAME: domain_name,
         },
         role: idleShutdownRole,
         layers: [layer],
         timeout: cdk.Duration.seconds(180)
       });
 
+      regionStateParameter.grantRead(idleShutdownFunction);
+      regionStateParameter.grantWrite(idleShutdownFunction);
+
       const idleShutdownLogGroup = new logs.LogGroup(this, 'VPNIdleShutdownLogGroup', {
         logGroupName: `/aws/lambda/${idleShutdownFunction.functionName}`,
         retention: logs.RetentionDays.ONE_MONTH,
@@ -178,6 +272,77 @@ export class VPNLambdaDeployStack extends cdk.Stack {
       });
       idleShutdownSchedule.addTarget(new targets.LambdaFunction(idleShutdownFunction));
 
+      // VPN Pre-warm Lambda Function
+      // Runs on a schedule; starts the region the start history (recorded by the toggle
+      // Lambda in the region-state parameter) predicts will be wanted shortly. Its look-ahead
+      // is capped at the idle shutdown's grace period, so a wrong guess is stopped quickly.
+      const prewarmRole = new iam.Role(this, 'VPNPrewarmRole', {
+        assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
+        managedPolicies: [
+          iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole'),
+        ],
+        inlinePolicies: {
+          'policy': new iam.PolicyDocument({
+            statements: [
+              new iam.PolicyStatement({
+                effect: iam.Effect.ALLOW,
+                actions: ['autoscaling:UpdateAutoScalingGroup'],
+                conditions: {
+                  "StringEquals": {"aws:ResourceTag/application-name": "wireguard-vpn"}
+                },
+                resources: ['*'],
+              }),
+              new iam.PolicyStatement({
+                effect: iam.Effect.ALLOW,
+                actions: ['autoscaling:DescribeAutoScalingGroups'],
+                resources: ['*'],
+              }),
+            ]
+          })
+      }});
+
+      const prewarmFunction = new lambda.Function(this, 'VPNPrewarmFunction', {
+        code: new lambda.AssetCode('src'),
+        handler: 'vpn_toggle.prewarm.handler',
+        runtime: lambda.Runtime.PYTHON_3_11,
+        environment: {
+          GRACE_PERIOD_MINUTES: '15',
+          PREWARM_LEAD_MINUTES: '15',
+          REGION_STATE_PARAMETER: regionStateParameter.parameterName,
+          VPN_INSTANCE_COUNT: instanceCount,
+        },
+        role: prewarmRole,
+        layers: [layer],
+        timeout: cdk.Duration.seconds(60)
+      });
+
+      regionStateParameter.grantRead(prewarmFunction);
+      regionStateParameter.grantWrite(prewarmFunction);
+
+      const prewarmLogGroup = new logs.LogGroup(this, 'VPNPrewarmLogGroup', {
+        logGroupName: `/aws/lambda/${prewarmFunction.functionName}`,
+        retention: logs.RetentionDays.ONE_MONTH,
+        removalPolicy: cdk.RemovalPolicy.DESTROY
+      });
+
+      const prewarmSchedule = new events.Rule(this, 'VPNPrewarmSchedule', {
+        schedule: events.Schedule.rate(cdk.Duration.minutes(15)),
+        description: 'Pre-starts the VPN region the start history predicts will be wanted in the next 15 minutes.',
+      });
+      prewarmSchedule.addTarget(new targets.LambdaFunction(prewarmFunction));
+
+      // Optional upload target for on-demand profiles (see src/vpn_toggle/profiling.py): deploy
+      // with PROFILE_S3_BUCKET=<existing bucket> and every profiled handler may write to its
+      // profiles/ prefix. Without it, profiles only go to /tmp and the logs.
+      const profileBucketName = process.env.PROFILE_S3_BUCKET;
+      if (profileBucketName) {
+        const profileBucket = s3.Bucket.fromBucketName(this, 'VPNProfileBucket', profileBucketName);
+        for (const profiledFunction of [VPNToggleFunction, finalizeFunction, idleShutdownFunction, prewarmFunction]) {
+          profiledFunction.addEnvironment('PROFILE_S3_BUCKET', profileBucketName);
+          profileBucket.grantPut(profiledFunction, 'profiles/*');
+        }
+      }
+
       // VPN Starter Proxy Lambda Function
       // Retrieve API key from SSM Parameter Store (SecureString)
       // Note: Initial value must be set manually or via AWS CLI after first deployment if not already present.
@@ -233,6 +398,7 @@ export class VPNLambdaDeployStack extends cdk.Stack {
         role: starterProxyRole,
         timeout: cdk.Duration.seconds(30),
         memorySize: 256,
+        tracing: lambdaTracing,
       });
 
       // Log group for VPN Starter Proxy Lambda
@@ -258,7 +424,7 @@ export class VPNLambdaDeployStack extends cdk.Stack {
         defaultCorsPreflightOptions: {
           allowOrigins: apigateway.Cors.ALL_ORIGINS,
           allowMethods: ['POST', 'OPTIONS'],
-          allowHeaders: ['Content-Type', 'X-Api-Key'],
+          allowHeaders: ['Content-Type', 'X-Api-Key', 'X-Trace-Id'],
         },
         cloudWatchRole: true,
       });
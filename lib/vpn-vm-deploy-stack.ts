@@ -4,9 +4,29 @@ import * as ec2 from 'aws-cdk-lib/aws-ec2';
 import * as autoscaling from 'aws-cdk-lib/aws-autoscaling';
 import * as ssm from 'aws-cdk-lib/aws-ssm';
 import * as iam from 'aws-cdk-lib/aws-iam';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
+
+export interface VPNVMDeployStackProps extends cdk.StackProps {
+  /**
+   * Keep a pre-initialised instance in an ASG warm pool, in this state, while the VPN is
+   * off, so starting it is an instance resume rather than a cold launch + first boot.
+   * Defaults to the VPN_WARM_POOL_STATE environment variable; no warm pool if unset.
+   * 'Hibernated' also needs an AMI/instance type that supports hibernation and an
+   * encrypted root volume large enough for RAM.
+   */
+  readonly warmPoolState?: 'Stopped' | 'Hibernated';
+
+  /**
+   * How many VPN instances a started region runs (the ASG's maxCapacity), for when several
+   * people share a region. Defaults to the VPN_INSTANCE_COUNT environment variable, or 1.
+   * The Lambdas' VPN_INSTANCE_COUNT (VPNLambdaDeployStack) must match.
+   */
+  readonly instanceCount?: number;
+}
 
 export class VPNVMDeployStack extends cdk.Stack {
-  constructor(scope: Construct, id: string, props?: cdk.StackProps) {
+  constructor(scope: Construct, id: string, props?: VPNVMDeployStackProps) {
     super(scope, id, props);
 
     const PRIVATE_IP_CIDR = ssm.StringParameter.valueForStringParameter(this, '/vpn-wireguard/PRIVATE_IP_CIDR');
@@ -54,10 +74,32 @@ export class VPNVMDeployStack extends cdk.Stack {
       allowAllOutbound: true   // Can be set to false
     });
 
+    // The whitelist (SSH) lives in managed prefix lists, one per address family, which
+    // vpn_toggle updates in every region at once as soon as a start request arrives (see
+    // src/vpn_toggle/prefix_lists.py) - so a newly started instance's security group already
+    // admits the caller. Seeded with PRIVATE_IP_CIDR; CloudFormation only rewrites the
+    // entries if this definition changes. maxEntries matches the proxy's whitelist cap.
+    const whitelistPrefixList = new ec2.CfnPrefixList(this, 'VPNWhitelistPrefixList', {
+      prefixListName: 'vpn-wireguard-whitelist',
+      addressFamily: 'IPv4',
+      maxEntries: 20,
+      entries: [{ cidr: PRIVATE_IP_CIDR, description: 'initial whitelist' }],
+    });
+    const whitelistPrefixListIpv6 = new ec2.CfnPrefixList(this, 'VPNWhitelistPrefixListIpv6', {
+      prefixListName: 'vpn-wireguard-whitelist-ipv6',
+      addressFamily: 'IPv6',
+      maxEntries: 20,
+    });
+
+    vpnSecurityGroup.addIngressRule(
+      ec2.Peer.prefixList(whitelistPrefixList.attrPrefixListId),
+      ec2.Port.tcp(22),
+      'allow ssh access from the whitelisted IP addresses');
+
     vpnSecurityGroup.addIngressRule(
-      ec2.Peer.ipv4(PRIVATE_IP_CIDR),
+      ec2.Peer.prefixList(whitelistPrefixListIpv6.attrPrefixListId),
       ec2.Port.tcp(22),
-      'allow ssh access from my IP address');
+      'allow ssh access from the whitelisted IPv6 addresses');
 
     vpnSecurityGroup.addIngressRule(
       ec2.Peer.anyIpv4(),
@@ -121,6 +163,11 @@ export class VPNVMDeployStack extends cdk.Stack {
       'systemctl enable --now wg-quick@wg0'
     );
 
+    const instanceCount = props?.instanceCount ?? Number(process.env.VPN_INSTANCE_COUNT ?? '1');
+    if (!Number.isInteger(instanceCount) || instanceCount < 1) {
+      throw new Error(`Invalid VPN instance count ${instanceCount}; use a whole number of at least 1`);
+    }
+
     const vpnASG = new autoscaling.AutoScalingGroup(this, 'VPNASG', {
       vpc,
       instanceType: ec2.InstanceType.of(ec2.InstanceClass.C6G, ec2.InstanceSize.LARGE),
@@ -128,10 +175,45 @@ export class VPNVMDeployStack extends cdk.Stack {
       associatePublicIpAddress: true,
       keyPair: ec2.KeyPair.fromKeyPairName(this, 'ImportedVPNVMKeyPair', vpnVMKeyPair.keyName),
       minCapacity: 0,
-      maxCapacity: 1,
+      maxCapacity: instanceCount,
       securityGroup: vpnSecurityGroup,
       userData: userData,
       role: vpnInstanceRole,
     });
+
+    const warmPoolState = props?.warmPoolState ?? process.env.VPN_WARM_POOL_STATE;
+    if (warmPoolState) {
+      if (warmPoolState !== 'Stopped' && warmPoolState !== 'Hibernated') {
+        throw new Error(`Unsupported warm pool state ${warmPoolState}; use Stopped or Hibernated`);
+      }
+      // The pool is sized maxCapacity - desired, i.e. every instance while the VPN is off. Each
+      // instance runs the UserData (render-wg0.sh, enabling wg-quick) once, on its first boot,
+      // and is then parked; reuseOnScaleIn sends it back to the pool when the VPN is turned
+      // off (by vpn_toggle or idle_shutdown) instead of terminating it.
+      vpnASG.addWarmPool({
+        poolState: warmPoolState === 'Hibernated' ? autoscaling.PoolState.HIBERNATED : autoscaling.PoolState.STOPPED,
+        minSize: 0,
+        reuseOnScaleIn: true,
+      });
+    }
+
+    // The toggle Lambda returns as soon as it has requested capacity; the finalize Lambda in
+    // the central region sets up DNS and the security group when the instance is running.
+    // EC2 only publishes state changes in the instance's own region, so forward them. (In the
+    // central region itself the finalize rule sees them directly.)
+    const forwardStateChanges = new events.Rule(this, 'VPNForwardInstanceRunning', {
+      eventPattern: {
+        source: ['aws.ec2'],
+        detailType: ['EC2 Instance State-change Notification'],
+        detail: { state: ['running'] },
+      },
+      description: 'Forwards EC2 running events to the central region, for the VPN finalize Lambda.',
+      targets: [new targets.EventBus(events.EventBus.fromEventBusArn(
+        this, 'CentralEventBus', `arn:aws:events:${central_region}:${cdk.Aws.ACCOUNT_ID}:event-bus/default`))],
+    });
+    const notCentralRegion = new cdk.CfnCondition(this, 'NotCentralRegion', {
+      expression: cdk.Fn.conditionNot(cdk.Fn.conditionEquals(cdk.Aws.REGION, central_region)),
+    });
+    (forwardStateChanges.node.defaultChild as events.CfnRule).cfnOptions.condition = notCentralRegion;
   }
 }
@@ -1,11 +1,16 @@
-import { isIPv4, isIPv6 } from 'net';
+import { randomUUID } from 'crypto';
 import { SNSClient, PublishCommand } from '@aws-sdk/client-sns';
 import { SSMClient, GetParameterCommand } from '@aws-sdk/client-ssm';
 import { APIGatewayProxyEvent, APIGatewayProxyResult } from 'aws-lambda';
+import { MIN_WHITELIST_PREFIX, validateCIDR } from './validation';
 
 const TOPIC_ARN = process.env.TOPIC_ARN;
 const API_KEY_PARAM_NAME = process.env.API_KEY_PARAM_NAME;
-const ALLOWED_REGIONS = ['eu-west-1', 'eu-west-2', 'us-east-1', 'eu-north-1', 'ap-southeast-2', 'ca-central-1', 'eu-west-3', 'none'];
+const ALLOWED_REGIONS = ['eu-west-1', 'eu-west-2', 'us-east-1', 'eu-north-1', 'ap-southeast-2', 'ca-central-1', 'eu-west-3', 'auto', 'none'];
+
+// A caller-supplied X-Trace-Id is reused (so a client can correlate its own logs);
+// anything else gets a fresh ID.
+const TRACE_ID_PATTERN = /^[A-Za-z0-9-]{8,64}$/;
 
 const ssmClient = new SSMClient({});
 // Cache with a 5-minute TTL to minimize SSM API calls while allowing for manual updates.
@@ -41,10 +46,14 @@ async function getApiKey(): Promise<string | undefined> {
   }
 }
 
+// A single address, or a list of addresses/CIDRs (e.g. phone, laptop and office) that
+// vpn_toggle collapses into the fewest security group ranges.
+const MAX_WHITELIST_ENTRIES = 20;
+
 interface VPNRequest {
   apiKey?: string;
   region: string;
-  whitelist_ip: string;
+  whitelist_ip: string | string[];
 }
 
 const createResponse = (
@@ -56,22 +65,25 @@ const createResponse = (
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'POST, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, X-Api-Key',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Api-Key, X-Trace-Id',
   },
   body: JSON.stringify(body),
 });
 
-const validateIPAddress = (ip: string): boolean => {
-  // Uses Node's built-in parser instead of a hand-rolled regex - the classic
-  // IPv6-validation regex is vulnerable to catastrophic backtracking (ReDoS)
-  // on attacker-controlled input.
-  return isIPv4(ip) || isIPv6(ip);
-};
-
 const sanitizeInput = (input: string): string => {
   // Remove any potentially malicious characters
   // Note: hyphen must be escaped or at start/end of character class
-  return input.replace(/[^\w\s.\-:]/g, '').trim();
+  return input.replace(/[^\w\s.\-:/]/g, '').trim();
+};
+
+// Returns the trace ID that follows this request through SNS into vpn_toggle's logs,
+// metrics and spans.
+const resolveTraceId = (event: APIGatewayProxyEvent): string => {
+  const headers = event.headers || {};
+  const traceHeader = Object.keys(headers).find(k => k.toLowerCase() === 'x-trace-id');
+  const provided = traceHeader ? headers[traceHeader] : undefined;
+  if (provided && TRACE_ID_PATTERN.test(provided)) return provided;
+  return randomUUID().replace(/-/g, '');
 };
 
 // Redacts the API key (and any header/casing variant of it) before an event is
@@ -101,7 +113,9 @@ const redactEvent = (event: APIGatewayProxyEvent): unknown => {
 export const handler = async (
   event: APIGatewayProxyEvent
 ): Promise<APIGatewayProxyResult> => {
-  console.log('Received event:', JSON.stringify(redactEvent(event), null, 2));
+  const receivedAt = Date.now();
+  const traceId = resolveTraceId(event);
+  console.log(`[trace_id=${traceId}] Received event:`, JSON.stringify(redactEvent(event), null, 2));
 
   // Handle CORS preflight
   if (event.httpMethod === 'OPTIONS') {
@@ -161,11 +175,21 @@ export const handler = async (
       });
     }
 
-    // Validate IP address format
-    const sanitizedIP = sanitizeInput(body.whitelist_ip);
-    if (!validateIPAddress(sanitizedIP)) {
+    // Validate IP address / CIDR format
+    const whitelistEntries = Array.isArray(body.whitelist_ip) ? body.whitelist_ip : [body.whitelist_ip];
+    if (whitelistEntries.length === 0 || whitelistEntries.length > MAX_WHITELIST_ENTRIES) {
+      return createResponse(400, { error: `whitelist_ip must list 1-${MAX_WHITELIST_ENTRIES} addresses` });
+    }
+    if (whitelistEntries.some((entry) => typeof entry !== 'string')) {
       return createResponse(400, { error: 'Invalid IP address format' });
     }
+    const sanitizedEntries = whitelistEntries.map(sanitizeInput);
+    if (!sanitizedEntries.every(validateCIDR)) {
+      return createResponse(400, {
+        error: `Invalid IP address format (CIDRs must be /${MIN_WHITELIST_PREFIX.v4} or narrower for IPv4, /${MIN_WHITELIST_PREFIX.v6} for IPv6)`,
+      });
+    }
+    const sanitizedIP = Array.isArray(body.whitelist_ip) ? sanitizedEntries : sanitizedEntries[0];
 
     // Create SNS client
     const snsClient = new SNSClient({
@@ -191,22 +215,32 @@ export const handler = async (
           DataType: 'String',
           StringValue: sanitizedRegion,
         },
+        trace_id: {
+          DataType: 'String',
+          StringValue: traceId,
+        },
+        // Epoch milliseconds; lets vpn_toggle measure delivery and tap-to-ready time.
+        requested_at: {
+          DataType: 'Number',
+          StringValue: String(receivedAt),
+        },
       },
     });
 
     const result = await snsClient.send(command);
 
-    console.log('Published to SNS:', result.MessageId);
+    console.log(`[trace_id=${traceId}] Published to SNS:`, result.MessageId, `(${Date.now() - receivedAt} ms)`);
 
     return createResponse(200, {
       success: true,
       messageId: result.MessageId,
+      traceId,
       message: 'VPN start message sent successfully',
       region: sanitizedRegion,
       ip: sanitizedIP,
     });
   } catch (error) {
-    console.error('Error:', error);
+    console.error(`[trace_id=${traceId}] Error:`, error);
     const errorMessage =
       error instanceof Error ? error.message : 'Unknown error occurred';
     return createResponse(500, {
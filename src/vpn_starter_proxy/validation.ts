@@ -0,0 +1,23 @@
+import { isIPv4, isIPv6 } from 'net';
+
+// Widest CIDR accepted per family, so a typo like 1.2.3.4/0 can't open the VPN to the whole
+// internet. Must match vpn_toggle's MIN_WHITELIST_PREFIX (src/vpn_toggle/aws_helpers.py).
+export const MIN_WHITELIST_PREFIX = { v4: 16, v6: 48 };
+
+export const validateIPAddress = (ip: string): boolean => {
+  // Uses Node's built-in parser instead of a hand-rolled regex - the classic
+  // IPv6-validation regex is vulnerable to catastrophic backtracking (ReDoS)
+  // on attacker-controlled input.
+  return isIPv4(ip) || isIPv6(ip);
+};
+
+// An address, or a CIDR no wider than MIN_WHITELIST_PREFIX.
+export const validateCIDR = (entry: string): boolean => {
+  const [address, prefix, ...rest] = entry.split('/');
+  if (rest.length > 0) return false;
+  if (prefix === undefined) return validateIPAddress(address);
+  if (!/^\d{1,3}$/.test(prefix)) return false;
+  if (isIPv4(address)) return Number(prefix) >= MIN_WHITELIST_PREFIX.v4 && Number(prefix) <= 32;
+  if (isIPv6(address)) return Number(prefix) >= MIN_WHITELIST_PREFIX.v6 && Number(prefix) <= 128;
+  return false;
+};
@@ -2,22 +2,41 @@
 Helper functions for interacting with AWS.
 """
 
+import ipaddress
 import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field, fields
 from datetime import UTC, datetime, timedelta
+from enum import StrEnum
 
-import boto3
-from pydantic import BaseModel
+from botocore.config import Config
+
+from .metrics import register_aws_call_hooks
+from .region_state import get_ledger
+
+VALID_ZONES = ["eu-west-1", "us-east-1", "eu-north-1", "eu-west-2", "ap-southeast-2", "ca-central-1", "eu-west-3"]
 
 APPLICATION_NAME_KEY = "application-name"
 APPLICATION_NAME_VALUE = "wireguard-vpn"
 
 # (protocol, port) ingress rules that stay open to the world when update_security_group
-# clamps every other rule to the caller's /32.
+# clamps every other rule to the caller's whitelist.
 # 51820: WireGuard handshake (cryptographically secured).
 # 51413: BitTorrent tcp+udp, DNAT-forwarded over wg0 to the torrent peer (see the
 # vpn-image repo's wg0.conf.template PostUp).
 WORLD_OPEN_PORTS = {("udp", 51820), ("tcp", 51413), ("udp", 51413)}
 
+# Widest whitelist entry accepted per IP version, so a typo like 1.2.3.4/0 can't open the
+# instances to the whole internet. Must match the starter proxy's MIN_WHITELIST_PREFIX.
+MIN_WHITELIST_PREFIX = {4: 16, 6: 48}
+
+# How many instances a started region runs, unless VPN_INSTANCE_COUNT says otherwise. Must not
+# exceed the ASG's maxCapacity (VPNVMDeployStack's instanceCount).
+DEFAULT_INSTANCE_COUNT = 1
+
 if len(logging.getLogger().handlers) > 0:
     logging.getLogger().setLevel(logging.INFO)
 else:
@@ -26,25 +45,131 @@ else:
     )
 logger = logging.getLogger(__name__)
 
+# Shared by every pooled client. Keep-alive plus a pool sized for the concurrent region
+# fan-out lets warm invocations reuse connections (and TLS sessions) instead of redoing
+# the handshake per call; the timeouts keep one slow region from stalling a whole toggle.
+CLIENT_CONFIG = Config(
+    connect_timeout=5,
+    read_timeout=15,
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 3},
+)
+
+# (service, region) -> client. Module-level, so it survives warm Lambda invocations.
+_clients: dict = {}
+_clients_lock = threading.Lock()
+_session = None
+
+# hosted zone name -> zone ID; zone IDs never change, so this is safe to keep across warm invocations.
+_hosted_zone_ids: dict[str, str] = {}
+
+
+def get_client(service: str, region: str | None = None):
+    """
+    Returns a pooled botocore client for the service/region, creating it on first use.
+    Clients are thread-safe, but creating them (and the session) isn't, so construction is
+    serialised behind a lock. botocore is used directly, and only imported here, because
+    boto3's own import drags in s3transfer, which nothing here needs - that's a sizeable
+    slice of a cold start.
+    """
+    global _session
+    key = (service, region)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                if _session is None:
+                    import botocore.session
+
+                    _session = botocore.session.get_session()
+                    register_aws_call_hooks(_session)
+                client = _session.create_client(service, region_name=region, config=CLIENT_CONFIG)
+                _clients[key] = client
+    return client
+
+
+def reset_client_pool() -> None:
+    """Drops every pooled client (and the shared session), e.g. after credentials change."""
+    global _session
+    with _clients_lock:
+        _clients.clear()
+        _session = None
+
+
+class InstanceReadiness(StrEnum):
+    """Outcome of waiting for a freshly scaled-up ASG instance."""
 
-class SecurityGroupRule(BaseModel):
+    RUNNING = "running"
+    TIMED_OUT = "timed-out"
+    LAUNCH_FAILED = "launch-failed"
+    # Capacity requested; the finalize Lambda sets up DNS/security group once it's running.
+    PENDING = "pending"
+
+
+# ASG lifecycle states of an instance that's on its way out, and can't serve the VPN.
+RETIRING_LIFECYCLE_STATES = {
+    "Terminating",
+    "Terminating:Wait",
+    "Terminating:Proceed",
+    "Terminated",
+    "Detaching",
+    "Detached",
+}
+
+# ASG lifecycle states of instances parked in (or moving into/out of) a warm pool all start
+# with this. Such an instance isn't serving the VPN; once it's pulled out of the pool for a
+# scale-out it moves to Pending/InService like a fresh launch (EC2 state stopped -> pending ->
+# running, rather than a cold boot).
+WARMED_LIFECYCLE_PREFIX = "Warmed:"
+
+# EC2 states an instance never comes back from to "running" on its own.
+FAILED_INSTANCE_STATES = {"shutting-down", "terminated"}
+
+
+class _ResponseView:
+    """
+    Base for the lightweight, slotted views below over boto response dicts. They copy out
+    just the keys the helpers use, with none of the cost of validating the full response.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_response(cls, data: dict):
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+
+@dataclass(slots=True)
+class SecurityGroupRule(_ResponseView):
     IpProtocol: str
     FromPort: int
     ToPort: int
     IpRanges: list[dict]
 
 
-class SecurityGroup(BaseModel):
+@dataclass(slots=True)
+class SecurityGroup(_ResponseView):
     GroupId: str
-    IpPermissions: list[SecurityGroupRule]
+    IpPermissions: list[dict]
 
 
-class AutoScalingGroup(BaseModel):
+@dataclass(slots=True)
+class AutoScalingGroup(_ResponseView):
     AutoScalingGroupName: str
     DesiredCapacity: int
+    Instances: list[dict] = field(default_factory=list)
+    WarmPoolConfiguration: dict | None = None
 
+    @property
+    def warm_pool_state(self) -> str | None:
+        """@return: the warm pool's state ("Stopped", "Hibernated", ...), or None without a pool"""
+        return (self.WarmPoolConfiguration or {}).get("PoolState")
 
-class Ec2Instance(BaseModel):
+
+@dataclass(slots=True)
+class Ec2Instance(_ResponseView):
     InstanceId: str
     State: dict
     SecurityGroups: list[dict]
@@ -52,30 +177,56 @@ class Ec2Instance(BaseModel):
     LaunchTime: datetime
 
 
+@dataclass(slots=True)
+class RegionSnapshot:
+    """
+    Everything the post-launch steps need about a region's running VPN instances, resolved
+    once so DNS and security-group updates don't each repeat the ASG/instance lookups.
+    The instances share the ASG's launch template, and so its security group.
+    """
+
+    region: str
+    asg: AutoScalingGroup
+    instances: list[Ec2Instance]
+    public_ips: list[str]
+    security_group_id: str
+
+
+def get_instance_count() -> int:
+    """@return: how many instances a started region should run (VPN_INSTANCE_COUNT)"""
+    return int(os.environ.get("VPN_INSTANCE_COUNT", DEFAULT_INSTANCE_COUNT))
+
+
 def get_asg(aws_region: str) -> AutoScalingGroup:
     """
     Gets the ASG for the VPN.
     @param aws_region: The AWS region to use
     @return: The ASG object
     """
-    client = boto3.client("autoscaling", region_name=aws_region)
-    response = client.describe_auto_scaling_groups(
-        Filters=[
-            {"Name": f"tag:{APPLICATION_NAME_KEY}", "Values": [APPLICATION_NAME_VALUE]},
-        ]
-    )
-    return AutoScalingGroup(**response["AutoScalingGroups"][0])
+    client = get_client("autoscaling", aws_region)
+    paginator = client.get_paginator("describe_auto_scaling_groups")
+    groups = [
+        group
+        for page in paginator.paginate(
+            Filters=[
+                {"Name": f"tag:{APPLICATION_NAME_KEY}", "Values": [APPLICATION_NAME_VALUE]},
+            ]
+        )
+        for group in page["AutoScalingGroups"]
+    ]
+    return AutoScalingGroup.from_response(groups[0])
 
 
 def update_asg_capacity(
     asg: AutoScalingGroup, region: str, desired_capacity: int
 ) -> int:
     """
-    Toggles the ASG to have an instance on or off.
+    Toggles the ASG to have its instances on or off, and records the new capacity in the
+    region-state ledger.
     @param asg: The ASG to toggle
-    @return: The new capacity setting of the ASG (either 0 or 1)
+    @return: The new capacity setting of the ASG (0, or the number of instances when on)
     """
-    client = boto3.client("autoscaling", region_name=region)
+    client = get_client("autoscaling", region)
     current_capacity = asg.DesiredCapacity
     if desired_capacity != current_capacity:
         logger.debug(
@@ -89,104 +240,245 @@ def update_asg_capacity(
         logger.debug(
             "ASG capacity is already %s in region %s", desired_capacity, region
         )
+    get_ledger().record(region, desired_capacity)
     return desired_capacity
 
 
-def _get_instance_public_ip(asg: AutoScalingGroup, region) -> str:
-    """Gets the public IP address of the instance."""
-    instance_ec2 = get_instance_from_asg(asg, region)
-    return instance_ec2.NetworkInterfaces[0]["Association"]["PublicIp"]
-
-
-def get_instance_from_asg(asg: AutoScalingGroup, region: str) -> Ec2Instance:
-    """Gets the EC2 instance details from the ASG."""
-    asg_client = boto3.client("autoscaling", region_name=region)
-    response = asg_client.describe_auto_scaling_instances()
-    vm_instance_id = None
-    for instance in response["AutoScalingInstances"]:
-        if instance["AutoScalingGroupName"] == asg.AutoScalingGroupName:
-            vm_instance_id = instance["InstanceId"]
-            break
-    if vm_instance_id is not None:
-        client = boto3.client("ec2", region_name=region)
-        response = client.describe_instances(InstanceIds=[vm_instance_id])
-        return Ec2Instance(**response["Reservations"][0]["Instances"][0])
-    else:
+def remove_instance_from_asg(asg: AutoScalingGroup, region: str, instance_id: str) -> int:
+    """
+    Takes one instance out of service, decrementing the ASG's desired capacity, so the rest
+    keep running - scaling in would leave the choice of instance to the termination policy.
+    The new capacity is recorded in the region-state ledger.
+    @return: the ASG's new desired capacity
+    """
+    client = get_client("autoscaling", region)
+    logger.debug("Terminating instance %s of the ASG in region %s", instance_id, region)
+    client.terminate_instance_in_auto_scaling_group(InstanceId=instance_id, ShouldDecrementDesiredCapacity=True)
+    asg.DesiredCapacity -= 1
+    get_ledger().record(region, asg.DesiredCapacity)
+    return asg.DesiredCapacity
+
+
+def get_instances_from_asg(asg: AutoScalingGroup, region: str) -> list[Ec2Instance]:
+    """
+    Gets the EC2 instance details for all of the ASG's instances, straight from the ASG's own
+    Instances list - a single DescribeInstances call, however many instances it has and however
+    many other ASGs the region has. Instances that are retiring or sitting in the warm pool are
+    ignored.
+    @return: the instances, ordered by instance ID
+    """
+    vm_instance_ids = sorted(
+        i["InstanceId"]
+        for i in asg.Instances
+        if i.get("LifecycleState") not in RETIRING_LIFECYCLE_STATES
+        and not i.get("LifecycleState", "").startswith(WARMED_LIFECYCLE_PREFIX)
+    )
+    if not vm_instance_ids:
         raise ValueError(f"No instance found for {asg.AutoScalingGroupName}")
+    client = get_client("ec2", region)
+    response = client.describe_instances(InstanceIds=vm_instance_ids)
+    instances = [
+        Ec2Instance.from_response(instance)
+        for reservation in response["Reservations"]
+        for instance in reservation["Instances"]
+    ]
+    return sorted(instances, key=lambda instance: instance.InstanceId)
+
+
+def get_instance_states(region: str, instance_ids: list[str]) -> dict[str, str | None]:
+    """
+    One DescribeInstances call for known instances.
+    @return: instance ID -> its EC2 state name (e.g. "running"), or None if it no longer exists
+    """
+    client = get_client("ec2", region)
+    reservations = client.describe_instances(Filters=[{"Name": "instance-id", "Values": list(instance_ids)}])[
+        "Reservations"
+    ]
+    states = {
+        instance["InstanceId"]: instance["State"]["Name"].lower()
+        for reservation in reservations
+        for instance in reservation["Instances"]
+    }
+    return {instance_id: states.get(instance_id) for instance_id in instance_ids}
+
+
+def get_region_snapshot(
+    region: str, asg: AutoScalingGroup | None = None, instances: list[Ec2Instance] | None = None
+) -> RegionSnapshot:
+    """
+    Builds a RegionSnapshot, only looking up whatever the caller doesn't already hold
+    (e.g. the instances returned by wait_for_instances_running).
+    """
+    if asg is None:
+        asg = get_asg(region)
+    if instances is None:
+        instances = get_instances_from_asg(asg, region)
+    return RegionSnapshot(
+        region=region,
+        asg=asg,
+        instances=instances,
+        public_ips=[instance.NetworkInterfaces[0]["Association"]["PublicIp"] for instance in instances],
+        security_group_id=instances[0].SecurityGroups[0]["GroupId"],
+    )
+
+
+def wait_for_instances_running(
+    region: str,
+    timeout_seconds: float,
+    initial_delay_seconds: float = 1.0,
+    max_delay_seconds: float = 8.0,
+) -> tuple[InstanceReadiness, list[Ec2Instance]]:
+    """
+    Polls the region's ASG until all of its desired instances reach "running", one of them
+    dies, or the deadline passes. Polls every second or so at first (so instances that are
+    already up are seen almost immediately), then backs off exponentially with jitter up to
+    max_delay_seconds.
+    @param timeout_seconds: overall deadline, measured from the first poll
+    @return: (outcome, instances) - the instances are the last ones seen, empty if none attached
+    """
+    deadline = time.monotonic() + timeout_seconds
+    delay = initial_delay_seconds
+    instances = []
+    while True:
+        try:
+            asg = get_asg(region)
+            instances = get_instances_from_asg(asg, region)
+            states = {instance.InstanceId: instance.State["Name"].lower() for instance in instances}
+            failed = [instance_id for instance_id, state in states.items() if state in FAILED_INSTANCE_STATES]
+            if failed:
+                logger.warning("Instances %s in region %s have failed", failed, region)
+                return InstanceReadiness.LAUNCH_FAILED, instances
+            if len(instances) >= asg.DesiredCapacity and all(state == "running" for state in states.values()):
+                return InstanceReadiness.RUNNING, instances
+        except ValueError:
+            # ASG hasn't attached an instance yet.
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return InstanceReadiness.TIMED_OUT, instances
+        logger.info("Waiting for instances to start in region %s...", region)
+        time.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(max_delay_seconds, delay * 2)
 
 
-def update_security_group(
-    asg: AutoScalingGroup, allowed_client_ip: str, region_name: str
-) -> None:
+def collapse_whitelist(entries: str | list[str]) -> list[str]:
     """
-    Updates the security group to allow traffic from the given IP address.
+    Collapses whitelisted addresses/CIDRs into the fewest covering CIDRs, so the security
+    group's rule count stays bounded however many addresses are listed.
+    @param entries: an address or CIDR, or a list of them
+    @return: the collapsed CIDRs, IPv4 first, each family in address order
+    @raise ValueError: if an entry isn't an address or CIDR, or is wider than MIN_WHITELIST_PREFIX allows
     """
-    instance_ec2 = get_instance_from_asg(asg, region_name)
-    ec2 = boto3.client("ec2", region_name=region_name)
-    security_group_id = instance_ec2.SecurityGroups[0]["GroupId"]
+    if isinstance(entries, str):
+        entries = [entries]
+    networks = [ipaddress.ip_network(entry.strip(), strict=False) for entry in entries]
+    for network in networks:
+        if network.prefixlen < MIN_WHITELIST_PREFIX[network.version]:
+            raise ValueError(
+                f"Whitelist entry {network} is too wide; use a /{MIN_WHITELIST_PREFIX[network.version]} or narrower"
+            )
+    return [
+        str(network)
+        for version in (4, 6)
+        for network in ipaddress.collapse_addresses(n for n in networks if n.version == version)
+    ]
+
+
+def _ip_permissions(rules: set[tuple]) -> list[dict]:
+    """Groups (protocol, from_port, to_port, cidr) rules into EC2 IpPermissions."""
+    grouped: dict[tuple, dict] = {}
+    for protocol, from_port, to_port, cidr in sorted(rules, key=str):
+        permission = grouped.get((protocol, from_port, to_port))
+        if permission is None:
+            permission = {"IpProtocol": protocol}
+            if from_port is not None:
+                permission.update(FromPort=from_port, ToPort=to_port)
+            grouped[(protocol, from_port, to_port)] = permission
+        if ipaddress.ip_network(cidr).version == 6:
+            permission.setdefault("Ipv6Ranges", []).append({"CidrIpv6": cidr})
+        else:
+            permission.setdefault("IpRanges", []).append({"CidrIp": cidr})
+    return list(grouped.values())
+
+
+def update_security_group(snapshot: RegionSnapshot, allowed_client_ips: str | list[str]) -> None:
+    """
+    Updates the snapshot's security group to allow traffic from the given IP addresses/CIDRs.
+    Only the difference is applied, at (protocol, port range, CIDR) level: additions are
+    authorized before removals are revoked, so the ports never close in between, and a call
+    is skipped when its side of the difference is empty.
+    """
+    cidrs = collapse_whitelist(allowed_client_ips)
+    ec2 = get_client("ec2", snapshot.region)
+    security_group_id = snapshot.security_group_id
     security_group = ec2.describe_security_groups(GroupIds=[security_group_id])[
         "SecurityGroups"
     ][0]
-    permissions = security_group["IpPermissions"]
-    authorize_permissions = []
-    for p in permissions:
-        q = p.copy()
+    current, desired = set(), set()
+    for p in security_group["IpPermissions"]:
+        ports = (p["IpProtocol"], p.get("FromPort"), p.get("ToPort"))
         # Rules for world-open ports keep their existing (0.0.0.0/0) ranges
-        if (
-            q.get("FromPort") == q.get("ToPort")
-            and (q.get("IpProtocol"), q.get("FromPort")) in WORLD_OPEN_PORTS
-        ):
-            pass
-        else:
-            q["IpRanges"] = [{"CidrIp": f"{allowed_client_ip}/32"}]
-        authorize_permissions.append(q)
-    if (
-        len(permissions) > 0
-        and len(authorize_permissions) > 0
-        and permissions != authorize_permissions
-    ):
-        ec2.revoke_security_group_ingress(
-            GroupId=security_group_id, IpPermissions=permissions
-        )
-        ec2.authorize_security_group_ingress(
-            GroupId=security_group_id, IpPermissions=authorize_permissions
-        )
-    else:
+        if p.get("FromPort") == p.get("ToPort") and (p["IpProtocol"], p.get("FromPort")) in WORLD_OPEN_PORTS:
+            continue
+        current.update((*ports, r["CidrIp"]) for r in p.get("IpRanges", []))
+        current.update((*ports, r["CidrIpv6"]) for r in p.get("Ipv6Ranges", []))
+        desired.update((*ports, cidr) for cidr in cidrs)
+    additions, removals = desired - current, current - desired
+    if not additions and not removals:
         logger.info("No security group changes needed")
+        return
+    if additions:
+        ec2.authorize_security_group_ingress(GroupId=security_group_id, IpPermissions=_ip_permissions(additions))
+    if removals:
+        ec2.revoke_security_group_ingress(GroupId=security_group_id, IpPermissions=_ip_permissions(removals))
+    logger.info("Security group %s: %d rule(s) added, %d removed", security_group_id, len(additions), len(removals))
+
+
+def _get_hosted_zone_id(hosted_zone_name: str) -> str:
+    """Looks up (and caches) the ID of the named hosted zone."""
+    hosted_zone_id = _hosted_zone_ids.get(hosted_zone_name)
+    if hosted_zone_id is None:
+        client = get_client("route53")
+        hosted_zone_id = client.list_hosted_zones_by_name(DNSName=hosted_zone_name)["HostedZones"][0]["Id"]
+        _hosted_zone_ids[hosted_zone_name] = hosted_zone_id
+    return hosted_zone_id
+
 
+def _get_a_record(client, hosted_zone_id: str, alias_name: str) -> dict | None:
+    """@return: the alias's own A record set (read without listing the whole zone), if it has one"""
+    existing = client.list_resource_record_sets(
+        HostedZoneId=hosted_zone_id, StartRecordName=alias_name, StartRecordType="A", MaxItems="1"
+    )["ResourceRecordSets"]
+    if existing and existing[0]["Name"] == alias_name + "." and existing[0]["Type"] == "A":
+        return existing[0]
+    return None
 
-def set_dns_alias(
-    alias_name: str, hosted_zone_name: str, asg: AutoScalingGroup, region: str
-) -> dict:
+
+def set_dns_alias(alias_name: str, hosted_zone_name: str, snapshot: RegionSnapshot) -> dict | None:
     """
-    Sets the DNS alias to point to the given IP address.
+    Sets the DNS alias to point to the snapshot instances' public IP addresses - a multi-value
+    A record when there are several, so clients spread across them.
+    Reads back only the alias's own A record (not the whole zone), and skips the change
+    entirely if it already points at the right IPs.
+    @return: the Route53 change response, or None if no change was needed
     """
-    action = "CREATE"
-    ip_address = _get_instance_public_ip(asg, region)
-    logger.debug("Setting DNS alias %s to %s", alias_name, ip_address)
-    client = boto3.client("route53")
-    hosted_zone_id = client.list_hosted_zones_by_name(DNSName=hosted_zone_name)[
-        "HostedZones"
-    ][0]["Id"]
-    for r in client.list_resource_record_sets(HostedZoneId=hosted_zone_id)[
-        "ResourceRecordSets"
-    ]:
-        if r["Name"] == alias_name + ".":
-            action = "UPSERT"
-            break
+    ip_addresses = sorted(snapshot.public_ips)
+    client = get_client("route53")
+    hosted_zone_id = _get_hosted_zone_id(hosted_zone_name)
+    existing = _get_a_record(client, hosted_zone_id, alias_name)
+    if existing and sorted(r["Value"] for r in existing.get("ResourceRecords", [])) == ip_addresses:
+        logger.info("DNS alias %s already points to %s", alias_name, ip_addresses)
+        return None
 
+    logger.debug("Setting DNS alias %s to %s", alias_name, ip_addresses)
     return client.change_resource_record_sets(
         ChangeBatch={
             "Changes": [
                 {
-                    "Action": action,
+                    "Action": "UPSERT",
                     "ResourceRecordSet": {
                         "Name": alias_name,
-                        "ResourceRecords": [
-                            {
-                                "Value": ip_address,
-                            },
-                        ],
+                        "ResourceRecords": [{"Value": ip_address} for ip_address in ip_addresses],
                         "TTL": 60,
                         "Type": "A",
                     },
@@ -198,49 +490,124 @@ def set_dns_alias(
     )
 
 
-def get_network_bytes_sum(
-    instance_id: str, region: str, window_minutes: int, end_time: datetime | None = None
-) -> int | None:
+def remove_dns_alias(alias_name: str, hosted_zone_name: str) -> dict | None:
     """
-    Sums NetworkIn + NetworkOut for an instance over the trailing window, using the free
-    5-minute basic-monitoring datapoints (no detailed monitoring required).
-    @param end_time: the reference "now" for the window; defaults to the real current time.
-    Callers evaluating uptime and idle-traffic together should pass the same "now" they used
-    for the uptime calculation, so both checks are measured against a single consistent clock.
-    @return: total bytes transferred, or None if no datapoints are available yet
-    (e.g. a just-launched instance) - callers should treat that as "unknown", not "idle".
+    Deletes the DNS alias's A record, e.g. when every instance it pointed at is gone.
+    @return: the Route53 change response, or None if there was no record to delete
     """
-    client = boto3.client("cloudwatch", region_name=region)
-    end_time = end_time or datetime.now(UTC)
-    start_time = end_time - timedelta(minutes=window_minutes)
+    client = get_client("route53")
+    hosted_zone_id = _get_hosted_zone_id(hosted_zone_name)
+    existing = _get_a_record(client, hosted_zone_id, alias_name)
+    if existing is None:
+        return None
+    logger.debug("Deleting DNS alias %s", alias_name)
+    return client.change_resource_record_sets(
+        ChangeBatch={
+            "Changes": [{"Action": "DELETE", "ResourceRecordSet": existing}],
+            "Comment": "VPN A record",
+        },
+        HostedZoneId=hosted_zone_id,
+    )
+
+
+NETWORK_METRICS_PERIOD_SECONDS = 300
+
+
+def _get_network_bytes_datapoints(
+    instance_ids: list[str], region: str, start_time: datetime, end_time: datetime
+) -> dict[str, list[tuple[datetime, float]]]:
+    """
+    Fetches the NetworkIn and NetworkOut 5-minute sums of every instance in a single batched
+    GetMetricData request.
+    @return: instance ID -> [(period start, bytes), ...] across both metrics
+    """
+    client = get_client("cloudwatch", region)
     response = client.get_metric_data(
         MetricDataQueries=[
             {
-                "Id": f"{metric.lower()}_sum",
+                "Id": f"{metric.lower()}_{index}",
                 "MetricStat": {
                     "Metric": {
                         "Namespace": "AWS/EC2",
                         "MetricName": metric,
                         "Dimensions": [{"Name": "InstanceId", "Value": instance_id}],
                     },
-                    "Period": 300,
+                    "Period": NETWORK_METRICS_PERIOD_SECONDS,
                     "Stat": "Sum",
                 },
             }
+            for index, instance_id in enumerate(instance_ids)
             for metric in ("NetworkIn", "NetworkOut")
         ],
         StartTime=start_time,
         EndTime=end_time,
     )
-    values = [v for result in response["MetricDataResults"] for v in result["Values"]]
-    if not values:
-        return None
-    return int(sum(values))
+    datapoints: dict[str, list[tuple[datetime, float]]] = {instance_id: [] for instance_id in instance_ids}
+    for result in response["MetricDataResults"]:
+        instance_id = instance_ids[int(result["Id"].rsplit("_", 1)[1])]
+        datapoints[instance_id].extend(zip(result["Timestamps"], result["Values"], strict=True))
+    return datapoints
+
+
+def get_network_bytes_sums(
+    instance_ids: list[str], region: str, window_minutes: int, end_time: datetime | None = None
+) -> dict[str, int | None]:
+    """
+    Sums NetworkIn + NetworkOut for each instance over the trailing window, using the free
+    5-minute basic-monitoring datapoints (no detailed monitoring required). Every instance
+    is covered by a single batched GetMetricData request.
+    @param end_time: the reference "now" for the window; defaults to the real current time.
+    Callers evaluating uptime and idle-traffic together should pass the same "now" they used
+    for the uptime calculation, so both checks are measured against a single consistent clock.
+    @return: instance ID -> total bytes transferred, or None if no datapoints are available
+    yet (e.g. a just-launched instance) - callers should treat that as "unknown", not "idle".
+    """
+    if not instance_ids:
+        return {}
+    end_time = end_time or datetime.now(UTC)
+    start_time = end_time - timedelta(minutes=window_minutes)
+    datapoints = _get_network_bytes_datapoints(instance_ids, region, start_time, end_time)
+    return {
+        instance_id: int(sum(value for _, value in points)) if points else None
+        for instance_id, points in datapoints.items()
+    }
+
+
+def get_network_bytes_by_period(
+    instance_ids: list[str], region: str, start_time: datetime, end_time: datetime
+) -> dict[str, dict[int, int]]:
+    """
+    Fetches NetworkIn + NetworkOut per 5-minute period for each instance, in a single batched
+    GetMetricData request. `start_time` should sit on a period boundary, so CloudWatch's
+    periods line up with the epoch-aligned period indexes returned.
+    @return: instance ID -> {period index (epoch seconds // 300): bytes}; periods without any
+    datapoint are absent
+    """
+    if not instance_ids:
+        return {}
+    datapoints = _get_network_bytes_datapoints(instance_ids, region, start_time, end_time)
+    by_period: dict[str, dict[int, int]] = {}
+    for instance_id, points in datapoints.items():
+        periods = by_period.setdefault(instance_id, {})
+        for timestamp, value in points:
+            period = int(timestamp.timestamp()) // NETWORK_METRICS_PERIOD_SECONDS
+            periods[period] = periods.get(period, 0) + int(value)
+    return by_period
+
+
+def get_network_bytes_sum(
+    instance_id: str, region: str, window_minutes: int, end_time: datetime | None = None
+) -> int | None:
+    """
+    Sums NetworkIn + NetworkOut for a single instance over the trailing window.
+    See get_network_bytes_sums.
+    """
+    return get_network_bytes_sums([instance_id], region, window_minutes, end_time=end_time)[instance_id]
 
 
 def publish_notification(topic_arn: str, subject: str, message: str) -> None:
     """
     Publishes a notification message (e.g. an auto-stop alert) to an SNS topic.
     """
-    client = boto3.client("sns")
+    client = get_client("sns")
     client.publish(TopicArn=topic_arn, Subject=subject, Message=message)
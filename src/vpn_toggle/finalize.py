@@ -0,0 +1,77 @@
+"""
+Lambda function that completes an event-driven start (FINALIZE_ON_EVENT): the toggle Lambda
+only requests capacity and records the start as pending in the region-state ledger; this runs
+on EC2's "running" state-change events for the new instances - forwarded to the central
+region's event bus by each VPN region's stack - and, once all of the region's instances are
+running, points DNS at them and whitelists the client IP.
+
+EC2 emits state changes for every instance in a region, so anything without a pending start
+in the ledger, or that isn't one of the region's wireguard ASG instances, is ignored.
+"""
+
+import logging
+import os
+from datetime import UTC, datetime
+
+from .aws_helpers import VALID_ZONES, get_asg, get_instances_from_asg
+from .metrics import get_recorder, invocation
+from .profiling import profiled
+from .region_state import get_ledger
+from .tracing import trace_context
+from .vpn_toggle import finalize_vpn
+
+logger = logging.getLogger(__name__)
+
+
+def finalize(region: str, instance_id: str, a_record: str, hosted_zone_name: str) -> bool:
+    """
+    Finishes the region's pending start if the instance is one of its wireguard ASG instances
+    and all of them are now running - i.e. on the last of their running events.
+    @return: True if DNS and the security group were set up
+    """
+    pending = get_ledger().get_pending(region)
+    if pending is None:
+        logger.debug("No pending start in %s; ignoring %s", region, instance_id)
+        return False
+    asg = get_asg(region)
+    try:
+        instances = get_instances_from_asg(asg, region)
+    except ValueError:
+        logger.info("No instance attached to the VPN ASG in %s yet; ignoring %s", region, instance_id)
+        return False
+    instance_ids = [instance.InstanceId for instance in instances]
+    if instance_id not in instance_ids:
+        logger.debug("%s isn't a VPN instance in %s (%s); ignoring", instance_id, region, instance_ids)
+        return False
+    waiting = [i.InstanceId for i in instances if i.State["Name"].lower() != "running"]
+    if waiting or len(instances) < asg.DesiredCapacity:
+        logger.info("Waiting for the other VPN instances in %s to run (%s not running yet)", region, waiting)
+        return False
+
+    logger.info("Finalizing the VPN in %s on %s for %s", region, instance_ids, pending["whitelist_ip"])
+    finalize_vpn(asg, region, instances, a_record, hosted_zone_name, pending["whitelist_ip"])
+    requested_at = datetime.fromisoformat(pending["requested_at"])
+    get_recorder().record_phase("request_to_done", region, (datetime.now(UTC) - requested_at).total_seconds() * 1000)
+    return True
+
+
+@profiled("finalize")
+def handler(event: dict, context: dict | None = None):
+    """Lambda handler, invoked by an EventBridge rule on EC2 Instance State-change Notification events."""
+    a_record_name = os.environ["A_RECORD_NAME"]
+    domain_name = os.environ["DOMAIN_NAME"]
+    region = event.get("region")
+    detail = event.get("detail") or {}
+    instance_id = detail.get("instance-id")
+    if region not in VALID_ZONES or not instance_id or detail.get("state") != "running":
+        logger.debug("Ignoring event %s", event.get("id"))
+        return {"finalized": False}
+
+    ledger = get_ledger()
+    pending = ledger.get_pending(region) or {}
+    with trace_context(pending.get("trace_id")), invocation("finalize"):
+        try:
+            finalized = finalize(region, instance_id, a_record_name, domain_name)
+        finally:
+            ledger.flush()
+    return {"finalized": finalized, "region": region}
@@ -0,0 +1,229 @@
+"""
+Offline client-IP -> nearest VPN region lookup, for start requests with region "auto".
+
+The index is a bundled binary file (data/ip_regions.bin) holding, per address family, the
+sorted start addresses of non-overlapping ranges and a region ID for each; a lookup is one
+bisect. The CSV it's built from may nest finer ranges inside coarser ones - they're flattened
+when the index is built. It's read once per container, on the first "auto" request.
+
+data/ip_regions.bin is built from data/ip_regions.csv with:
+    python -m vpn_toggle.geo src/vpn_toggle/data/ip_regions.csv [output.bin]
+"""
+
+import ipaddress
+import logging
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+
+AUTO_REGION = "auto"
+# Used when the index has no deployed region for a client's address (private/unallocated
+# addresses, or a continent without a VPN region of its own).
+DEFAULT_REGION = "eu-west-1"
+# Region name for ranges the index should not place at all (private and reserved addresses).
+UNASSIGNED = "-"
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ip_regions.bin")
+
+_MAGIC = b"VPNGEO1\n"
+# Region ID for gaps between ranges.
+_NO_REGION = 255
+
+logger = logging.getLogger(__name__)
+
+
+def _flatten(ranges: list[tuple[int, int, int]], max_address: int) -> tuple[list[int], bytes]:
+    """
+    Flattens possibly nested (first, last, region_id) ranges into the start address and region
+    ID of each run of addresses, the innermost range winning and gaps getting _NO_REGION.
+    @raise ValueError: if two ranges partially overlap, or the same range is listed twice
+    """
+    segments = [(0, _NO_REGION)]
+
+    def start_segment(start: int, region_id: int) -> None:
+        if start > max_address:
+            return
+        if segments and segments[-1][0] == start:
+            segments.pop()
+        if not segments or segments[-1][1] != region_id:
+            segments.append((start, region_id))
+
+    # Wider ranges first among those starting together, so nested ones stack on top.
+    enclosing: list[tuple[int, int, int]] = []
+    for first, last, region_id in sorted(ranges, key=lambda r: (r[0], -r[1])):
+        while enclosing and enclosing[-1][1] < first:
+            _, end, _ = enclosing.pop()
+            start_segment(end + 1, enclosing[-1][2] if enclosing else _NO_REGION)
+        if enclosing and (last > enclosing[-1][1] or (first, last) == enclosing[-1][:2]):
+            raise ValueError(f"Overlapping range starting at {ipaddress.ip_address(first)}")
+        start_segment(first, region_id)
+        enclosing.append((first, last, region_id))
+    while enclosing:
+        _, end, _ = enclosing.pop()
+        start_segment(end + 1, enclosing[-1][2] if enclosing else _NO_REGION)
+    return [start for start, _ in segments], bytes(region_id for _, region_id in segments)
+
+
+class IpRegionIndex:
+    """Sorted-array range index from IP address to region name."""
+
+    def __init__(self, regions: list[str], v4_starts: array, v4_ids: bytes, v6_starts: list[int], v6_ids: bytes):
+        self.regions = regions
+        self._v4_starts = v4_starts
+        self._v4_ids = v4_ids
+        self._v6_starts = v6_starts
+        self._v6_ids = v6_ids
+
+    def lookup(self, ip: str) -> str | None:
+        """@return: the region for the address, or None if the index doesn't cover it"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        starts, ids = (self._v4_starts, self._v4_ids) if address.version == 4 else (self._v6_starts, self._v6_ids)
+        position = bisect_right(starts, int(address)) - 1
+        if position < 0 or ids[position] == _NO_REGION:
+            return None
+        return self.regions[ids[position]]
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple[str, str, str]]) -> "IpRegionIndex":
+        """
+        Builds an index from (first_address, last_address, region) rows. A range nested inside
+        a wider one overrides it (e.g. a country's block inside its registry's /8), and the
+        region UNASSIGNED carves a range out of the index altogether.
+        @raise ValueError: if two ranges partially overlap, or the same range is listed twice
+        """
+        regions: list[str] = []
+        families: dict[int, list[tuple[int, int, int]]] = {4: [], 6: []}
+        for first, last, region in rows:
+            first_address, last_address = ipaddress.ip_address(first), ipaddress.ip_address(last)
+            if region == UNASSIGNED:
+                region_id = _NO_REGION
+            else:
+                if region not in regions:
+                    regions.append(region)
+                region_id = regions.index(region)
+            families[first_address.version].append((int(first_address), int(last_address), region_id))
+        if len(regions) >= _NO_REGION:
+            raise ValueError(f"Too many regions ({len(regions)})")
+
+        built = {
+            version: _flatten(ranges, (1 << (32 if version == 4 else 128)) - 1) for version, ranges in families.items()
+        }
+        return cls(regions, array("I", built[4][0]), built[4][1], built[6][0], built[6][1])
+
+    def to_bytes(self) -> bytes:
+        names = b"".join(struct.pack("B", len(r)) + r.encode("ascii") for r in self.regions)
+        v4_starts = array("I", self._v4_starts)
+        if sys.byteorder != "little":
+            v4_starts.byteswap()
+        return b"".join(
+            [
+                _MAGIC,
+                struct.pack("<B", len(self.regions)),
+                names,
+                struct.pack("<I", len(v4_starts)),
+                v4_starts.tobytes(),
+                self._v4_ids,
+                struct.pack("<I", len(self._v6_starts)),
+                b"".join(start.to_bytes(16, "big") for start in self._v6_starts),
+                self._v6_ids,
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "IpRegionIndex":
+        if not data.startswith(_MAGIC):
+            raise ValueError("Not an IP region index")
+        offset = len(_MAGIC)
+        (region_count,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        regions = []
+        for _ in range(region_count):
+            (length,) = struct.unpack_from("B", data, offset)
+            regions.append(data[offset + 1 : offset + 1 + length].decode("ascii"))
+            offset += 1 + length
+
+        (v4_count,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        v4_starts = array("I")
+        v4_starts.frombytes(data[offset : offset + 4 * v4_count])
+        if sys.byteorder != "little":
+            v4_starts.byteswap()
+        offset += 4 * v4_count
+        v4_ids = data[offset : offset + v4_count]
+        offset += v4_count
+
+        (v6_count,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        v6_starts = [int.from_bytes(data[offset + 16 * i : offset + 16 * (i + 1)], "big") for i in range(v6_count)]
+        offset += 16 * v6_count
+        v6_ids = data[offset : offset + v6_count]
+        return cls(regions, v4_starts, v4_ids, v6_starts, v6_ids)
+
+
+def read_csv_rows(path: str) -> list[tuple[str, str, str]]:
+    """
+    Reads `<cidr>,<region>` or `<first>,<last>,<region>` rows ('#' starts a comment line;
+    region UNASSIGNED marks a range that maps to no region).
+    @return: (first_address, last_address, region) rows
+    """
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) == 2:
+                network = ipaddress.ip_network(fields[0])
+                rows.append((str(network[0]), str(network[-1]), fields[1]))
+            else:
+                rows.append((fields[0], fields[1], fields[2]))
+    return rows
+
+
+_index: IpRegionIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> IpRegionIndex:
+    """Returns the bundled index, reading it on first use and keeping it for the container's life."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                with open(DEFAULT_INDEX_PATH, "rb") as f:
+                    _index = IpRegionIndex.from_bytes(f.read())
+    return _index
+
+
+def resolve_region(client_ip: str, candidates: list[str], default: str = DEFAULT_REGION) -> str:
+    """
+    Picks the VPN region nearest the client IP.
+    @param candidates: the deployed regions the answer must be one of
+    @param default: returned when the index has no deployed region for the address
+    """
+    try:
+        region = get_index().lookup(client_ip)
+    except ValueError:
+        logger.warning("Can't resolve a region for client IP %r; using %s", client_ip, default)
+        return default
+    if region not in candidates:
+        logger.warning("No deployed region found for %s (index says %s); using %s", client_ip, region, default)
+        return default
+    logger.info("Resolved client IP %s to %s", client_ip, region)
+    return region
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m vpn_toggle.geo <ip_regions.csv> [output.bin]")
+        sys.exit(1)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+    index = IpRegionIndex.from_rows(read_csv_rows(sys.argv[1]))
+    with open(output_path, "wb") as out:
+        out.write(index.to_bytes())
+    print(f"Wrote {output_path} ({len(index._v4_starts)} IPv4 and {len(index._v6_starts)} IPv6 boundaries)")
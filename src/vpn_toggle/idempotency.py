@@ -0,0 +1,91 @@
+"""
+Short-circuits repeated start requests. A request for the region that's already on, for the
+IP it was already set up for, needs none of the enable path (capacity update, readiness
+polling, DNS, security group) - just confirmation that its instances are still running.
+
+A request is recognised as a repeat from either a per-container cache of recent completed
+starts (so a warm container doesn't even read the ledger) or the whitelist IP recorded in the
+region-state ledger. Either way one DescribeInstances call confirms it, so a region where an
+instance has since been stopped (by idle_shutdown, the console or an ASG replacement) is
+enabled again normally.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from .aws_helpers import get_instance_count, get_instance_states
+from .region_state import get_ledger
+
+DEFAULT_DEDUP_WINDOW_SECONDS = 120
+
+logger = logging.getLogger(__name__)
+
+# (region, whitelisted CIDRs) -> (instance IDs, monotonic expiry). Module-level, so it
+# survives warm invocations.
+_recent: dict[tuple[str, tuple[str, ...]], tuple[list[str], float]] = {}
+_recent_lock = threading.Lock()
+
+
+def _window_seconds() -> float:
+    return float(os.environ.get("DEDUP_WINDOW_SECONDS", DEFAULT_DEDUP_WINDOW_SECONDS))
+
+
+def remember(region: str, whitelist: list[str], instance_ids: list[str]) -> None:
+    """Records a completed start (instances running, DNS and security group set up)."""
+    with _recent_lock:
+        _recent[(region, tuple(whitelist))] = (list(instance_ids), time.monotonic() + _window_seconds())
+    get_ledger().record_whitelist(region, whitelist)
+
+
+def forget(region: str) -> None:
+    """Drops the region's cached starts, e.g. when it's being disabled."""
+    with _recent_lock:
+        for key in [key for key in _recent if key[0] == region]:
+            del _recent[key]
+
+
+def clear() -> None:
+    with _recent_lock:
+        _recent.clear()
+
+
+def _recorded_instances(region: str, whitelist: list[str], all_regions: list[str]) -> list[str] | None:
+    """@return: the instances the ledger says are set up for this request, if any"""
+    ledger = get_ledger()
+    entry = ledger.get(region) or {}
+    if entry.get("desired_capacity") != get_instance_count() or not ledger.is_set_up_for(region, whitelist):
+        return None
+    if len(entry.get("instance_ids") or []) != entry["desired_capacity"]:
+        return None
+    if not all(ledger.is_known_off(other) for other in all_regions if other != region):
+        return None
+    return entry["instance_ids"]
+
+
+def is_repeat(region: str, whitelist: list[str], all_regions: list[str]) -> bool:
+    """
+    @param all_regions: every deployed region - the others must be recorded as off
+    @param whitelist: the request's collapsed CIDRs (see aws_helpers.collapse_whitelist)
+    @return: True if the region is already on and set up for the whitelist, confirmed by a single
+    state check of its instances
+    """
+    with _recent_lock:
+        cached = _recent.get((region, tuple(whitelist)))
+        if cached is not None and cached[1] <= time.monotonic():
+            del _recent[(region, tuple(whitelist))]
+            cached = None
+    instance_ids = cached[0] if cached else _recorded_instances(region, whitelist, all_regions)
+    if not instance_ids:
+        return False
+    states = get_instance_states(region, instance_ids)
+    not_running = {instance_id: state for instance_id, state in states.items() if state != "running"}
+    if not_running:
+        logger.info("Instances in %s aren't all running (%s); enabling again", region, not_running)
+        forget(region)
+        return False
+    if cached is None:
+        with _recent_lock:
+            _recent[(region, tuple(whitelist))] = (instance_ids, time.monotonic() + _window_seconds())
+    return True
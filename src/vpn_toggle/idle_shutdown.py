@@ -1,21 +1,32 @@
 """
 Lambda function, run on a schedule, that auto-stops VPN instances which have either
 been idle (near-zero network traffic) for a while, or exceeded a hard runtime cap -
-so a forgotten VPN doesn't rack up compute costs indefinitely.
+so a forgotten VPN doesn't rack up compute costs indefinitely. Each of a region's instances
+is judged on its own traffic, so one idle instance of several is stopped on its own.
 """
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
 
 from .aws_helpers import (
+    VALID_ZONES,
+    AutoScalingGroup,
+    Ec2Instance,
     get_asg,
-    get_instance_from_asg,
-    get_network_bytes_sum,
+    get_instances_from_asg,
+    get_region_snapshot,
     publish_notification,
+    remove_dns_alias,
+    remove_instance_from_asg,
+    set_dns_alias,
     update_asg_capacity,
 )
-from .vpn_toggle import VALID_ZONES
+from .idle_tracker import update_network_bytes
+from .metrics import invocation, timed_phase
+from .profiling import profiled
+from .region_state import get_ledger
 
 DEFAULT_MAX_RUNTIME_MINUTES = 120
 DEFAULT_GRACE_PERIOD_MINUTES = 15
@@ -32,68 +43,202 @@ logging.getLogger("urllib3").setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def check_region(
+def _check_instances(
     region: str,
     now: datetime,
     max_runtime_minutes: int,
     grace_period_minutes: int,
     idle_window_minutes: int,
     idle_byte_threshold: int,
-) -> tuple[bool, str | None, dict]:
-    """
-    Decides whether a region's VPN instance should be auto-stopped.
-    Does not mutate any state - the caller acts on the result.
-    @return: (should_stop, reason, detail)
-    """
-    asg = get_asg(region)
-    if asg.DesiredCapacity != 1:
-        return False, None, {}
+    asg: AutoScalingGroup | None = None,
+) -> tuple[list[Ec2Instance], dict[str, tuple[bool, str | None, dict]]]:
+    """@return: (the region's instances, their decisions) - see check_region"""
+    if asg is None:
+        asg = get_asg(region)
+    if asg.DesiredCapacity == 0:
+        get_ledger().record(region, asg.DesiredCapacity)
+        return [], {}
 
     try:
-        instance = get_instance_from_asg(asg, region)
+        instances = get_instances_from_asg(asg, region)
     except ValueError:
         # ASG is scaling in/out; no instance attached yet.
-        return False, None, {}
+        get_ledger().record(region, asg.DesiredCapacity)
+        return [], {}
+    get_ledger().record(region, asg.DesiredCapacity, [instance.InstanceId for instance in instances])
 
-    if instance.State["Name"].lower() != "running":
-        return False, None, {}
-
-    uptime_minutes = (now - instance.LaunchTime).total_seconds() / 60
-    detail = {"uptime_minutes": uptime_minutes}
-
-    if uptime_minutes >= max_runtime_minutes:
-        return True, "max-runtime-cap", detail
+    decisions = {}
+    # Instances past the grace period but under the cap; their traffic decides.
+    idle_candidates = {}
+    for instance in instances:
+        if instance.State["Name"].lower() != "running":
+            decisions[instance.InstanceId] = (False, None, {})
+            continue
+        uptime_minutes = (now - instance.LaunchTime).total_seconds() / 60
+        detail = {"uptime_minutes": uptime_minutes}
+        if uptime_minutes >= max_runtime_minutes:
+            decisions[instance.InstanceId] = (True, "max-runtime-cap", detail)
+        elif uptime_minutes < grace_period_minutes:
+            decisions[instance.InstanceId] = (False, None, detail)
+        else:
+            idle_candidates[instance.InstanceId] = detail
 
-    if uptime_minutes < grace_period_minutes:
-        return False, None, detail
+    if idle_candidates:
+        # One batched metrics query covers every candidate.
+        totals = update_network_bytes(list(idle_candidates), region, idle_window_minutes, now=now)
+        for instance_id, detail in idle_candidates.items():
+            bytes_transferred = totals[instance_id]
+            if bytes_transferred is None:
+                # No CloudWatch datapoints yet - fail safe, don't guess that it's idle.
+                decisions[instance_id] = (False, None, detail)
+                continue
+            detail["bytes_transferred"] = bytes_transferred
+            if bytes_transferred < idle_byte_threshold:
+                decisions[instance_id] = (True, "idle-timeout", detail)
+            else:
+                decisions[instance_id] = (False, None, detail)
 
-    bytes_transferred = get_network_bytes_sum(instance.InstanceId, region, idle_window_minutes, end_time=now)
-    if bytes_transferred is None:
-        # No CloudWatch datapoints yet - fail safe, don't guess that it's idle.
-        return False, None, detail
-    detail["bytes_transferred"] = bytes_transferred
+    return instances, {instance.InstanceId: decisions[instance.InstanceId] for instance in instances}
 
-    if bytes_transferred < idle_byte_threshold:
-        return True, "idle-timeout", detail
 
-    return False, None, detail
+def check_region(
+    region: str,
+    now: datetime,
+    max_runtime_minutes: int,
+    grace_period_minutes: int,
+    idle_window_minutes: int,
+    idle_byte_threshold: int,
+    asg: AutoScalingGroup | None = None,
+) -> dict[str, tuple[bool, str | None, dict]]:
+    """
+    Decides, for each of a region's VPN instances, whether it should be auto-stopped. Stops
+    nothing itself - the caller acts on the result - but does update the region-state ledger
+    (the region's capacity and instances, and their traffic windows; see idle_tracker.py).
+    @param asg: the region's ASG, if the caller already fetched it
+    @return: instance ID -> (should_stop, reason, detail), empty if the region is off
+    """
+    _, decisions = _check_instances(
+        region,
+        now,
+        max_runtime_minutes,
+        grace_period_minutes,
+        idle_window_minutes,
+        idle_byte_threshold,
+        asg=asg,
+    )
+    return decisions
 
 
-def _format_message(region: str, reason: str, detail: dict) -> str:
+def _format_reason(reason: str, detail: dict) -> str:
     uptime_minutes = detail.get("uptime_minutes")
-    lines = [f"VPN in region {region} was automatically stopped."]
     if reason == "max-runtime-cap":
-        lines.append(f"Reason: it had been running for {uptime_minutes:.0f} minutes, exceeding the max runtime cap.")
+        return f"Reason: it had been running for {uptime_minutes:.0f} minutes, exceeding the max runtime cap."
+    bytes_transferred = detail.get("bytes_transferred", 0)
+    return (
+        f"Reason: only {bytes_transferred} bytes transferred while running for "
+        f"{uptime_minutes:.0f} minutes, indicating it was idle."
+    )
+
+
+def _format_message(region: str, stopping: dict[str, tuple[str, dict]], instance_count: int) -> str:
+    if len(stopping) == instance_count:
+        lines = [f"VPN in region {region} was automatically stopped."]
     else:
-        bytes_transferred = detail.get("bytes_transferred", 0)
-        lines.append(
-            f"Reason: only {bytes_transferred} bytes transferred while running for "
-            f"{uptime_minutes:.0f} minutes, indicating it was idle."
-        )
+        lines = [f"{len(stopping)} of the {instance_count} VPN instances in {region} were automatically stopped."]
+    for instance_id, (reason, detail) in stopping.items():
+        line = _format_reason(reason, detail)
+        lines.append(line if instance_count == 1 else f"{instance_id}: {line}")
     lines.append("Start it again from the usual API/shortcut when you next need it.")
     return "\n".join(lines)
 
 
+def _repoint_dns(region: str, asg: AutoScalingGroup, remaining: list[Ec2Instance]) -> None:
+    """
+    Points the VPN's A record at the instances left after some were stopped - including any
+    still starting, which already have their public IP - or, if none of them has one yet,
+    deletes the record rather than leave it listing the stopped instances.
+    """
+    a_record_name = os.environ.get("A_RECORD_NAME")
+    domain_name = os.environ.get("DOMAIN_NAME")
+    if not a_record_name or not domain_name:
+        logger.warning("A_RECORD_NAME/DOMAIN_NAME not set; the A record still lists the stopped instances")
+        return
+    addressed = [
+        instance
+        for instance in remaining
+        if instance.NetworkInterfaces and "Association" in instance.NetworkInterfaces[0]
+    ]
+    if not addressed:
+        logger.info("No other VPN instance in %s has a public IP; deleting the A record", region)
+        remove_dns_alias(a_record_name, domain_name)
+        return
+    set_dns_alias(a_record_name, domain_name, get_region_snapshot(region, asg=asg, instances=addressed))
+
+
+def _shutdown_region_if_idle(
+    region: str,
+    now: datetime,
+    topic_arn: str,
+    max_runtime_minutes: int,
+    grace_period_minutes: int,
+    idle_window_minutes: int,
+    idle_byte_threshold: int,
+) -> bool | None:
+    """
+    Checks one region and stops whichever of its instances should be auto-stopped, then sends
+    a notification. When that's all of them the region is scaled to zero; otherwise only those
+    instances are taken out and DNS is pointed at the rest.
+    Errors are logged rather than raised, so one region can't abort the others.
+    @return: True if any of the region's instances was stopped, None if the region couldn't be
+    checked or stopped
+    """
+    try:
+        asg = get_asg(region)
+        instances, decisions = _check_instances(
+            region,
+            now,
+            max_runtime_minutes,
+            grace_period_minutes,
+            idle_window_minutes,
+            idle_byte_threshold,
+            asg=asg,
+        )
+    except Exception:
+        logger.exception("Error checking region %s for idle shutdown", region)
+        return None
+
+    stopping = {
+        instance_id: (reason, detail) for instance_id, (should_stop, reason, detail) in decisions.items() if should_stop
+    }
+    if not stopping:
+        return False
+
+    reasons = ", ".join(sorted({reason for reason, _ in stopping.values()}))
+    try:
+        if len(stopping) == len(decisions):
+            update_asg_capacity(asg, region, 0)
+        else:
+            for instance_id in stopping:
+                remove_instance_from_asg(asg, region, instance_id)
+            remaining = [
+                instance
+                for instance in instances
+                if instance.InstanceId not in stopping and instance.State["Name"].lower() in ("pending", "running")
+            ]
+            _repoint_dns(region, asg, remaining)
+        publish_notification(
+            topic_arn,
+            subject=f"VPN auto-stopped in {region} ({reasons})",
+            message=_format_message(region, stopping, len(decisions)),
+        )
+        logger.info("Auto-stopped VPN instances in %s (%s): %s", region, reasons, stopping)
+        return True
+    except Exception:
+        logger.exception("Error auto-stopping region %s", region)
+        return None
+
+
+@profiled("idle_shutdown")
 def handler(event: dict | None = None, context: dict | None = None):
     """Lambda handler, invoked on an EventBridge schedule."""
     topic_arn = os.environ["NOTIFICATION_TOPIC_ARN"]
@@ -103,31 +248,33 @@ def handler(event: dict | None = None, context: dict | None = None):
     idle_byte_threshold = int(os.environ.get("IDLE_BYTE_THRESHOLD_BYTES", DEFAULT_IDLE_BYTE_THRESHOLD_BYTES))
 
     now = datetime.now(UTC)
-    stopped_regions = []
-
-    for region in VALID_ZONES:
-        try:
-            should_stop, reason, detail = check_region(
-                region, now, max_runtime_minutes, grace_period_minutes, idle_window_minutes, idle_byte_threshold
-            )
-        except Exception:
-            logger.exception("Error checking region %s for idle shutdown", region)
-            continue
+    limits = (max_runtime_minutes, grace_period_minutes, idle_window_minutes, idle_byte_threshold)
 
-        if not should_stop:
-            continue
+    with invocation("idle_shutdown"):
+        return _check_regions(now, topic_arn, limits)
 
-        try:
-            asg = get_asg(region)
-            update_asg_capacity(asg, region, 0)
-            publish_notification(
-                topic_arn,
-                subject=f"VPN auto-stopped in {region} ({reason})",
-                message=_format_message(region, reason, detail),
-            )
-            stopped_regions.append(region)
-            logger.info("Auto-stopped VPN in %s (%s): %s", region, reason, detail)
-        except Exception:
-            logger.exception("Error auto-stopping region %s", region)
+
+def _check_regions(now: datetime, topic_arn: str, limits: tuple[int, int, int, int]) -> dict:
+    # Only regions the ledger doesn't know to be off need checking, bar a periodic full sweep.
+    ledger = get_ledger()
+    regions, full_scan = ledger.plan_scan(VALID_ZONES, now=now)
+
+    # Regions are independent, so check (and stop) them side by side - the run's wall time
+    # is that of the slowest region rather than the sum of all of them.
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(regions), 1)) as executor:
+            futures = {
+                region: executor.submit(
+                    timed_phase("region_check", region)(_shutdown_region_if_idle), region, now, topic_arn, *limits
+                )
+                for region in regions
+            }
+        outcomes = {region: future.result() for region, future in futures.items()}
+        stopped_regions = [region for region, stopped in outcomes.items() if stopped]
+        # A region that failed wasn't re-read, so the next run has to sweep everything again.
+        if full_scan and None not in outcomes.values():
+            ledger.mark_reconciled(now)
+    finally:
+        ledger.flush()
 
     return {"stopped_regions": stopped_regions}
@@ -0,0 +1,165 @@
+"""
+Incremental network-traffic tracking for the idle check in idle_shutdown.py. Rather than
+re-querying the whole trailing idle window from CloudWatch on every run, each instance keeps a
+rolling buffer of its 5-minute NetworkIn + NetworkOut sums in the region-state ledger. A run
+only fetches the periods that have closed (or may still have changed) since the last one, and
+periods that fall out of the window are evicted from the running total as the window advances.
+
+Basic-monitoring datapoints can land a few minutes after their period ends, so the most recent
+periods are treated as unsettled and fetched again on the next run; only settled periods are
+never re-read.
+"""
+
+import logging
+from array import array
+from datetime import UTC, datetime, timedelta
+
+from .aws_helpers import NETWORK_METRICS_PERIOD_SECONDS, get_network_bytes_by_period
+from .region_state import get_ledger
+
+# How long after a period ends before its datapoint is assumed final.
+SETTLE_SECONDS = 10 * 60
+# Slot value for a period without any datapoint.
+_MISSING = -1
+
+logger = logging.getLogger(__name__)
+
+
+def window_periods(window_minutes: int) -> int:
+    """
+    @return: how many 5-minute periods a rolling window holds - enough whole periods to cover
+    `window_minutes`, plus the (partial) period "now" falls in
+    """
+    return -(-window_minutes * 60 // NETWORK_METRICS_PERIOD_SECONDS) + 1
+
+
+def period_of(moment: datetime) -> int:
+    """@return: the index (epoch seconds // 300) of the 5-minute period `moment` falls in"""
+    return int(moment.timestamp()) // NETWORK_METRICS_PERIOD_SECONDS
+
+
+class TrafficWindow:
+    """
+    Ring buffer of per-period byte sums for the `capacity` periods ending at period `end`.
+    Period p lives in slot p % capacity, and the window keeps a running total and datapoint
+    count, so advancing, overwriting a period and reading the total are all O(1) per period.
+    """
+
+    def __init__(self, capacity: int, end: int, settled: int | None = None):
+        self.capacity = capacity
+        self.end = end
+        # Periods up to and including this one are final and won't be fetched again.
+        self.settled = max(settled, self.start - 1) if settled is not None else self.start - 1
+        self._slots = array("q", [_MISSING]) * capacity
+        self._total = 0
+        self._present = 0
+
+    @property
+    def start(self) -> int:
+        """@return: the oldest period the window holds"""
+        return self.end - self.capacity + 1
+
+    def total_bytes(self) -> int | None:
+        """@return: bytes over the window, or None if it holds no datapoints at all"""
+        return self._total if self._present else None
+
+    def get(self, period: int) -> int | None:
+        if not self.start <= period <= self.end:
+            return None
+        value = self._slots[period % self.capacity]
+        return None if value == _MISSING else value
+
+    def set(self, period: int, value: int | None) -> None:
+        """Overwrites one period's sum (None marks it as having no datapoint); ignored outside the window."""
+        if not self.start <= period <= self.end:
+            return
+        index = period % self.capacity
+        previous = self._slots[index]
+        if previous != _MISSING:
+            self._total -= previous
+            self._present -= 1
+        if value is None:
+            self._slots[index] = _MISSING
+        else:
+            self._slots[index] = value
+            self._total += value
+            self._present += 1
+
+    def advance(self, end: int) -> None:
+        """Moves the window forward so it ends at period `end`, evicting the periods that fall out of it."""
+        if end <= self.end:
+            return
+        if end - self.end >= self.capacity:
+            # Nothing in the window survives.
+            self._slots = array("q", [_MISSING]) * self.capacity
+            self._total = self._present = 0
+        else:
+            for period in range(self.end + 1, end + 1):
+                # The slot still holds the period one window-length earlier.
+                self.set(period - self.capacity, None)
+        self.end = end
+        self.settled = max(self.settled, self.start - 1)
+
+    def to_dict(self) -> dict:
+        """@return: the window as {end, settled, sums (oldest first, None for no datapoint)}"""
+        return {
+            "end": self.end,
+            "settled": self.settled,
+            "sums": [self.get(period) for period in range(self.start, self.end + 1)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, capacity: int) -> "TrafficWindow":
+        """
+        Rebuilds a persisted window. If the capacity has changed since (IDLE_WINDOW_MINUTES was
+        changed), the periods that still fit are kept and the rest are fetched again.
+        """
+        sums = data["sums"]
+        end = data["end"]
+        window = cls(capacity, end, settled=data["settled"])
+        for period, value in zip(range(end - len(sums) + 1, end + 1), sums, strict=True):
+            window.set(period, value)
+        if capacity > len(sums):
+            # The periods before the persisted window were never fetched.
+            window.settled = window.start - 1
+        return window
+
+
+def update_network_bytes(
+    instance_ids: list[str], region: str, window_minutes: int, now: datetime | None = None
+) -> dict[str, int | None]:
+    """
+    Brings each instance's persisted traffic window up to `now` with a single GetMetricData
+    request covering only the unsettled periods, and prunes the windows of instances that are
+    no longer in `instance_ids`.
+    @return: instance ID -> bytes transferred over the window, or None if there are no datapoints
+    yet - as get_network_bytes_sums, but without re-reading the whole window every run
+    """
+    if not instance_ids:
+        return {}
+    now = now or datetime.now(UTC)
+    capacity = window_periods(window_minutes)
+    current = period_of(now)
+    stored = get_ledger().get_traffic(region)
+
+    windows = {}
+    for instance_id in instance_ids:
+        data = stored.get(instance_id)
+        window = TrafficWindow.from_dict(data, capacity) if data else TrafficWindow(capacity, current)
+        window.advance(current)
+        windows[instance_id] = window
+
+    fetch_from = min(window.settled + 1 for window in windows.values())
+    start_time = datetime.fromtimestamp(fetch_from * NETWORK_METRICS_PERIOD_SECONDS, UTC)
+    logger.debug("Fetching network traffic in %s since %s for %s", region, start_time, instance_ids)
+    by_period = get_network_bytes_by_period(instance_ids, region, start_time, now)
+
+    settled = period_of(now - timedelta(seconds=SETTLE_SECONDS)) - 1
+    for instance_id, window in windows.items():
+        fetched = by_period.get(instance_id, {})
+        for period in range(fetch_from, current + 1):
+            window.set(period, fetched.get(period))
+        window.settled = max(window.settled, settled)
+
+    get_ledger().record_traffic(region, {instance_id: window.to_dict() for instance_id, window in windows.items()})
+    return {instance_id: window.total_bytes() for instance_id, window in windows.items()}
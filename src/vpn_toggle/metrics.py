@@ -0,0 +1,166 @@
+"""
+Per-invocation instrumentation for the Lambdas: phase durations (scale-up, wait-for-running,
+DNS upsert, security group update, per-region checks) and AWS API call/retry counts, written
+out as CloudWatch Embedded Metric Format (EMF) log lines. CloudWatch Logs turns those into
+metrics - e.g. time-to-ready percentiles per region - with no PutMetricData calls.
+
+Lambda runs one invocation per container at a time, so a single module-level recorder is
+shared by all of an invocation's worker threads.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .tracing import get_trace_id, span
+
+DEFAULT_NAMESPACE = "WireguardVpn"
+
+
+class MetricsRecorder:
+    """Thread-safe accumulator for one invocation's phase timings and AWS call counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (phase, region) -> [duration_ms, ...]
+        self.phase_durations: dict[tuple[str, str | None], list[float]] = defaultdict(list)
+        # (service, region) -> {"calls": n, "retries": n, "errors": n}
+        self.aws_calls: dict[tuple[str, str | None], dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "retries": 0, "errors": 0}
+        )
+
+    def record_phase(self, phase: str, region: str | None, duration_ms: float) -> None:
+        with self._lock:
+            self.phase_durations[(phase, region)].append(duration_ms)
+
+    def record_aws_call(self, service: str, region: str | None, retries: int, failed: bool) -> None:
+        with self._lock:
+            counts = self.aws_calls[(service, region)]
+            counts["calls"] += 1
+            counts["retries"] += retries
+            counts["errors"] += int(failed)
+
+    def to_emf(self, function: str, namespace: str, timestamp_ms: int | None = None) -> list[dict]:
+        """
+        @return: one EMF document per (phase, region) and per (service, region) - each
+        phase's samples go out as a value array, so CloudWatch can compute percentiles
+        """
+        timestamp_ms = timestamp_ms if timestamp_ms is not None else int(time.time() * 1000)
+        # Not a dimension - just lets Logs Insights join the metric lines to a request.
+        trace = {"TraceId": get_trace_id()} if get_trace_id() else {}
+        documents = []
+        with self._lock:
+            for (phase, region), durations in self.phase_durations.items():
+                documents.append(
+                    _emf_document(
+                        namespace,
+                        timestamp_ms,
+                        [["Function", "Phase"], ["Function", "Phase", "Region"]],
+                        [{"Name": "PhaseDuration", "Unit": "Milliseconds"}],
+                        {
+                            "Function": function,
+                            "Phase": phase,
+                            "Region": region or "global",
+                            "PhaseDuration": durations if len(durations) > 1 else durations[0],
+                            **trace,
+                        },
+                    )
+                )
+            for (service, region), counts in self.aws_calls.items():
+                documents.append(
+                    _emf_document(
+                        namespace,
+                        timestamp_ms,
+                        [["Function", "Service"]],
+                        [
+                            {"Name": "AwsCalls", "Unit": "Count"},
+                            {"Name": "AwsRetries", "Unit": "Count"},
+                            {"Name": "AwsErrors", "Unit": "Count"},
+                        ],
+                        {
+                            "Function": function,
+                            "Service": service,
+                            "Region": region or "global",
+                            "AwsCalls": counts["calls"],
+                            "AwsRetries": counts["retries"],
+                            "AwsErrors": counts["errors"],
+                            **trace,
+                        },
+                    )
+                )
+        return documents
+
+
+def _emf_document(namespace: str, timestamp_ms: int, dimensions: list, metrics: list, values: dict) -> dict:
+    return {
+        "_aws": {
+            "Timestamp": timestamp_ms,
+            "CloudWatchMetrics": [{"Namespace": namespace, "Dimensions": dimensions, "Metrics": metrics}],
+        },
+        **values,
+    }
+
+
+_recorder = MetricsRecorder()
+
+
+def get_recorder() -> MetricsRecorder:
+    return _recorder
+
+
+@contextmanager
+def timed_phase(phase: str, region: str | None = None):
+    """
+    Times the enclosed block as `phase` (for `region`), whether or not it raises, and traces
+    it as a span of the same name. Also usable as a decorator, e.g. to time a function
+    submitted to an executor.
+    """
+    started = time.perf_counter()
+    try:
+        with span(phase, region=region):
+            yield
+    finally:
+        _recorder.record_phase(phase, region, (time.perf_counter() - started) * 1000)
+
+
+def _after_call(event_name: str, http_response=None, parsed=None, model=None, context=None, **kwargs) -> None:
+    service = model.service_model.service_name if model is not None else event_name.split(".")[1]
+    region = (context or {}).get("client_region")
+    retries = ((parsed or {}).get("ResponseMetadata") or {}).get("RetryAttempts", 0)
+    failed = http_response is None or http_response.status_code >= 300
+    _recorder.record_aws_call(service, region, retries, failed)
+
+
+def _after_call_error(event_name: str, model=None, context=None, **kwargs) -> None:
+    # The request never got a response (connection error, timeout) even after retries.
+    service = model.service_model.service_name if model is not None else event_name.split(".")[1]
+    _recorder.record_aws_call(service, (context or {}).get("client_region"), 0, True)
+
+
+def register_aws_call_hooks(session) -> None:
+    """Counts every API call (and its retries) made by clients created from the botocore session."""
+    session.register("after-call", _after_call)
+    session.register("after-call-error", _after_call_error)
+
+
+@contextmanager
+def invocation(function: str):
+    """
+    Wraps one handler invocation: starts from an empty recorder and, on the way out (even on
+    error), prints the EMF lines to stdout, where the Lambda runtime ships them to CloudWatch
+    Logs. Set METRICS_NAMESPACE to override the metric namespace.
+    """
+    global _recorder
+    _recorder = MetricsRecorder()
+    try:
+        with timed_phase("invocation"):
+            yield _recorder
+    finally:
+        namespace = os.environ.get("METRICS_NAMESPACE", DEFAULT_NAMESPACE)
+        for document in _recorder.to_emf(function, namespace):
+            sys.stdout.write(json.dumps(document, separators=(",", ":")) + "\n")
+        sys.stdout.flush()
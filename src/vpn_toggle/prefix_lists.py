@@ -0,0 +1,104 @@
+"""
+Keeps the whitelist in a managed prefix list per region (one per address family), which the
+VPN security group references (see lib/vpn-vm-deploy-stack.ts). The lists of every deployed
+region are updated together, in parallel, as soon as a request arrives - so by the time the
+target region's instance is running its security group already admits the caller, and the
+enable path has no security group work left (WHITELIST_PREFIX_LISTS).
+
+The last whitelist pushed everywhere is kept in the region-state ledger, so repeat requests
+for the same addresses skip the sync entirely. To push a whitelist ahead of any request:
+    python -m vpn_toggle.prefix_lists 1.2.3.4 5.6.7.0/24
+"""
+
+import ipaddress
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .aws_helpers import VALID_ZONES, collapse_whitelist, get_client
+from .metrics import timed_phase
+from .region_state import get_ledger
+
+# AddressFamily -> prefix list name, as created by VPNVMDeployStack.
+WHITELIST_PREFIX_LIST_NAMES = {"IPv4": "vpn-wireguard-whitelist", "IPv6": "vpn-wireguard-whitelist-ipv6"}
+
+logger = logging.getLogger(__name__)
+
+
+def use_prefix_lists() -> bool:
+    """@return: True if the security groups take the whitelist from the prefix lists"""
+    return os.environ.get("WHITELIST_PREFIX_LISTS", "").lower() == "true"
+
+
+def update_region(region: str, cidrs: list[str]) -> bool:
+    """
+    Brings the region's whitelist prefix lists to exactly `cidrs`, with one
+    ModifyManagedPrefixList call per list that actually needs a change.
+    @return: True if any list was modified
+    """
+    ec2 = get_client("ec2", region)
+    prefix_lists = ec2.describe_managed_prefix_lists(
+        Filters=[{"Name": "prefix-list-name", "Values": list(WHITELIST_PREFIX_LIST_NAMES.values())}]
+    )["PrefixLists"]
+    if not prefix_lists:
+        raise ValueError(f"No whitelist prefix list found in {region}")
+    modified = False
+    for prefix_list in prefix_lists:
+        version = 6 if prefix_list["AddressFamily"] == "IPv6" else 4
+        desired = {cidr for cidr in cidrs if ipaddress.ip_network(cidr).version == version}
+        current = {
+            entry["Cidr"]
+            for entry in ec2.get_managed_prefix_list_entries(PrefixListId=prefix_list["PrefixListId"])["Entries"]
+        }
+        additions, removals = desired - current, current - desired
+        if not additions and not removals:
+            continue
+        ec2.modify_managed_prefix_list(
+            PrefixListId=prefix_list["PrefixListId"],
+            CurrentVersion=prefix_list["Version"],
+            AddEntries=[{"Cidr": cidr, "Description": "vpn whitelist"} for cidr in sorted(additions)],
+            RemoveEntries=[{"Cidr": cidr} for cidr in sorted(removals)],
+        )
+        modified = True
+    return modified
+
+
+def sync_whitelist(whitelist: str | list[str], regions: list[str] | None = None, force: bool = False) -> dict:
+    """
+    Pushes the whitelist to every region's prefix lists concurrently, unless the ledger shows
+    it's already been pushed.
+    @param force: sync even if the ledger says the whitelist is unchanged
+    @return: region -> "updated" | "unchanged" | "error" (empty if nothing needed doing)
+    """
+    regions = regions or VALID_ZONES
+    cidrs = collapse_whitelist(whitelist)
+    ledger = get_ledger()
+    if not force and ledger.is_whitelist_synced(cidrs):
+        logger.debug("Whitelist prefix lists already hold %s", cidrs)
+        return {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        futures = {
+            region: executor.submit(timed_phase("prefix_list_update", region)(update_region), region, cidrs)
+            for region in regions
+        }
+        for region, future in futures.items():
+            try:
+                results[region] = "updated" if future.result() else "unchanged"
+            except Exception:
+                logger.exception("Error updating the whitelist prefix lists in %s", region)
+                results[region] = "error"
+    if "error" not in results.values():
+        ledger.record_synced_whitelist(cidrs)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m vpn_toggle.prefix_lists <ip_or_cidr> [<ip_or_cidr> ...]")
+        sys.exit(1)
+    try:
+        print(sync_whitelist(sys.argv[1:], force=True))
+    finally:
+        get_ledger().flush()
@@ -0,0 +1,143 @@
+"""
+Lambda function, run on a schedule, that pre-starts the VPN in the region it's most likely to
+be wanted in shortly, based on the start history vpn_toggle records in the region-state
+ledger - so a regular start (same region, similar time of day) finds the instance already up.
+
+The look-ahead never exceeds idle_shutdown's grace period: a pre-warmed instance nobody uses
+is past its grace period soon after the predicted start time, and idle_shutdown then stops it
+on its next idle check, so a wrong guess only costs a few tens of minutes of runtime.
+"""
+
+import logging
+import os
+from datetime import UTC, date, datetime, timedelta
+
+from .aws_helpers import VALID_ZONES, get_asg, get_instance_count, update_asg_capacity
+from .idle_shutdown import DEFAULT_GRACE_PERIOD_MINUTES
+from .metrics import invocation, timed_phase
+from .profiling import profiled
+from .region_state import get_ledger
+
+DEFAULT_LEAD_MINUTES = 15
+# A region is only pre-warmed when, on at least this share of comparable past days (weekdays
+# or weekend days, like the day being predicted), it was started inside the look-ahead window...
+DEFAULT_MIN_CONFIDENCE = 0.5
+# ...and on at least this many of them, so a couple of one-off starts don't trigger it.
+DEFAULT_MIN_MATCHING_DAYS = 3
+# At most one pre-warm per region per use window.
+DEFAULT_COOLDOWN_MINUTES = 12 * 60
+
+if len(logging.getLogger().handlers) > 0:
+    logging.getLogger().setLevel(logging.INFO)
+else:
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s:%(message)s")
+logging.getLogger("botocore").setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _is_weekend(day: date) -> bool:
+    return day.weekday() >= 5
+
+
+def _comparable_days(first: date, last: date, weekend: bool) -> int:
+    """@return: how many days in [first, last] are weekend days (or weekdays)"""
+    return sum(1 for n in range((last - first).days + 1) if _is_weekend(first + timedelta(days=n)) == weekend)
+
+
+def predict_region(
+    history: dict,
+    now: datetime,
+    lead_minutes: int,
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    min_matching_days: int = DEFAULT_MIN_MATCHING_DAYS,
+) -> tuple[str | None, float]:
+    """
+    Picks the region most likely to be started within the next `lead_minutes`, by time of day
+    (UTC) on comparable days.
+    @param history: region-state ledger history (region -> {"start": [epoch_minute, ...]})
+    @return: (region, confidence), or (None, best_confidence) if no region clears the bar
+    """
+    window_start = now.hour * 60 + now.minute
+    weekend = _is_weekend(now.date())
+    best_region, best_confidence = None, 0.0
+    for region, events in history.items():
+        starts = [datetime.fromtimestamp(minute * 60, UTC) for minute in events.get("start", [])]
+        past_starts = [s for s in starts if s.date() < now.date()]
+        if not past_starts:
+            continue
+        matching_days = {
+            s.date()
+            for s in past_starts
+            if _is_weekend(s.date()) == weekend and (s.hour * 60 + s.minute - window_start) % 1440 < lead_minutes
+        }
+        observed_days = _comparable_days(min(past_starts).date(), now.date() - timedelta(days=1), weekend)
+        if not observed_days or len(matching_days) < min_matching_days:
+            continue
+        confidence = len(matching_days) / observed_days
+        if confidence > best_confidence:
+            best_region, best_confidence = region, confidence
+    if best_confidence < min_confidence:
+        return None, best_confidence
+    return best_region, best_confidence
+
+
+def prewarm(
+    now: datetime,
+    lead_minutes: int,
+    cooldown_minutes: int = DEFAULT_COOLDOWN_MINUTES,
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    min_matching_days: int = DEFAULT_MIN_MATCHING_DAYS,
+) -> str | None:
+    """
+    Starts the predicted region's instances, unless the VPN is already on somewhere or the
+    region was pre-warmed recently. DNS and the security group are left to the user's own
+    start request, which then finds the instances already running.
+    @return: the region pre-warmed, or None
+    """
+    ledger = get_ledger()
+    region, confidence = predict_region(ledger.get_history(), now, lead_minutes, min_confidence, min_matching_days)
+    if region is None:
+        logger.info("No region to pre-warm (best confidence %.2f)", confidence)
+        return None
+
+    running = [r for r in VALID_ZONES if (ledger.get(r) or {}).get("desired_capacity", 0) != 0]
+    if running:
+        logger.info("Not pre-warming %s: the VPN is already on in %s", region, running)
+        return None
+    last_prewarm = ledger.get_last_prewarm()
+    if last_prewarm and last_prewarm[0] == region and now - last_prewarm[1] < timedelta(minutes=cooldown_minutes):
+        logger.info("Not pre-warming %s again: already pre-warmed at %s", region, last_prewarm[1])
+        return None
+
+    asg = get_asg(region)
+    if asg.DesiredCapacity != 0:
+        return None
+    logger.info("Pre-warming %s (confidence %.2f over the next %d minutes)", region, confidence, lead_minutes)
+    with timed_phase("prewarm", region):
+        update_asg_capacity(asg, region, get_instance_count())
+    ledger.record_prewarm(region, now)
+    return region
+
+
+@profiled("prewarm")
+def handler(event: dict | None = None, context: dict | None = None):
+    """Lambda handler, invoked on an EventBridge schedule."""
+    grace_period_minutes = int(os.environ.get("GRACE_PERIOD_MINUTES", DEFAULT_GRACE_PERIOD_MINUTES))
+    lead_minutes = int(os.environ.get("PREWARM_LEAD_MINUTES", DEFAULT_LEAD_MINUTES))
+    if lead_minutes > grace_period_minutes:
+        logger.warning(
+            "PREWARM_LEAD_MINUTES %d exceeds the idle grace period; using %d", lead_minutes, grace_period_minutes
+        )
+        lead_minutes = grace_period_minutes
+
+    with invocation("prewarm"):
+        try:
+            region = prewarm(
+                datetime.now(UTC),
+                lead_minutes,
+                cooldown_minutes=int(os.environ.get("PREWARM_COOLDOWN_MINUTES", DEFAULT_COOLDOWN_MINUTES)),
+                min_confidence=float(os.environ.get("PREWARM_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE)),
+            )
+        finally:
+            get_ledger().flush()
+    return {"prewarmed_region": region}
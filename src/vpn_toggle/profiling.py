@@ -0,0 +1,98 @@
+"""
+On-demand cProfile wrapper for the Lambda handlers, for finding out where a slow invocation's
+time went (client setup, pydantic validation, waiting on AWS, ...).
+
+Enabled per invocation by a truthy PROFILE_HANDLER environment variable or a `"profile": true`
+key in the event. The profile covers the handler's worker threads too, is written to /tmp as
+a pstats file (and uploaded to s3://$PROFILE_S3_BUCKET/ if that's set), and its top functions
+by cumulative time are logged. When disabled, the wrapper only checks the flag - cProfile and
+pstats aren't even imported.
+"""
+
+import functools
+import logging
+import os
+import time
+
+PROFILE_DIR = "/tmp"
+DEFAULT_TOP_FUNCTIONS = 25
+
+logger = logging.getLogger(__name__)
+
+
+def _enabled(event) -> bool:
+    if os.environ.get("PROFILE_HANDLER", "").lower() in ("1", "true", "yes"):
+        return True
+    return isinstance(event, dict) and event.get("profile") is True
+
+
+def profiled(name: str):
+    """Decorates a handler(event, context) so it can be profiled on demand."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event=None, context=None):
+            if not _enabled(event):
+                return handler(event, context)
+            return _run_profiled(name, handler, event, context)
+
+        return wrapper
+
+    return decorator
+
+
+def _run_profiled(name: str, handler, event, context):
+    import cProfile
+    import sys
+    import threading
+
+    main_profile = cProfile.Profile()
+    thread_profiles = []
+
+    def start_thread_profile(*args):
+        # Runs as the first profile event of each thread started while profiling; hands the
+        # thread over to a profiler of its own (cProfile only sees the thread that enables it).
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        thread_profiles.append(profile)
+        profile.enable()
+
+    threading.setprofile(start_thread_profile)
+    main_profile.enable()
+    try:
+        return handler(event, context)
+    finally:
+        main_profile.disable()
+        threading.setprofile(None)
+        _report(name, main_profile, thread_profiles)
+
+
+def _report(name: str, main_profile, thread_profiles: list) -> None:
+    import io
+    import pstats
+
+    try:
+        stats = pstats.Stats(main_profile)
+        for profile in thread_profiles:
+            profile.create_stats()
+            stats.add(profile)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.pstats")
+        stats.dump_stats(path)
+
+        summary = io.StringIO()
+        stats.stream = summary
+        top = int(os.environ.get("PROFILE_TOP_FUNCTIONS", DEFAULT_TOP_FUNCTIONS))
+        stats.sort_stats("cumulative").print_stats(top)
+        logger.info("Profile of %s written to %s; top %d by cumulative time:\n%s", name, path, top, summary.getvalue())
+
+        bucket = os.environ.get("PROFILE_S3_BUCKET")
+        if bucket:
+            from .aws_helpers import get_client
+
+            key = f"profiles/{os.path.basename(path)}"
+            with open(path, "rb") as f:
+                get_client("s3").put_object(Bucket=bucket, Key=key, Body=f.read())
+            logger.info("Uploaded profile to s3://%s/%s", bucket, key)
+    except Exception:
+        # Profiling is a diagnostic aid; never let it fail the invocation.
+        logger.exception("Could not write the profile of %s", name)
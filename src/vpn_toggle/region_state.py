@@ -0,0 +1,427 @@
+"""
+A small persistent ledger of each region's VPN state (desired capacity, instance IDs and when
+the capacity last changed), so the toggler and the idle checker can skip regions that are
+known to be off instead of querying all of them on every invocation.
+
+It also keeps a compact history of user-initiated starts and stops per region (base-36 epoch
+minutes, newest last, capped) for the pre-warm predictor in prewarm.py.
+
+Each enabled region also records a digest of the whitelist its instances were last set up for,
+so an identical repeat request can be answered without redoing the enable (see idempotency.py),
+and any start still waiting for its instances to come up, for the event-driven finalize step
+(finalize.py) - the only place the whitelist itself is kept.
+Running instances keep a rolling window of their recent network traffic, so the idle checker
+only has to fetch what's new from CloudWatch (see idle_tracker.py). The SNS publish time of the
+last applied request is kept too, so a delayed retry of an older request can't undo a newer one.
+
+The ledger is one JSON document, held in a standard-tier SSM parameter (at most 4KB) in
+production (REGION_STATE_PARAMETER) or in memory/a local file for tests and CLI use. Because
+regions can also be changed outside these Lambdas (console, CLI, ASG health replacement), every
+scan is periodically widened to a full reconciliation that re-reads every region and corrects
+any drift.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import UTC, datetime, timedelta
+
+DEFAULT_RECONCILE_INTERVAL_MINUTES = 60
+# Per region and event kind - a week or so of daily use, enough for the predictor. Sized (with
+# the whitelist kept once and everything else compact) so the whole document stays under
+# MAX_DOCUMENT_BYTES with every region in regular use; see test_worst_case_document_fits_ssm.
+HISTORY_MAX_EVENTS = 8
+# A standard-tier SSM parameter's value limit.
+MAX_DOCUMENT_BYTES = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def whitelist_digest(whitelist: str | list[str]) -> str:
+    """@return: a short, stable fingerprint of a whitelist, for recording it without its CIDRs"""
+    entries = [whitelist] if isinstance(whitelist, str) else sorted(whitelist)
+    return hashlib.sha256(",".join(entries).encode()).hexdigest()[:16]
+
+
+def _to_base36(number: int) -> str:
+    digits = ""
+    while True:
+        number, digit = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + digits
+        if not number:
+            return digits
+
+
+def _encode_events(minutes: list[int]) -> str:
+    return " ".join(_to_base36(minute) for minute in minutes)
+
+
+def _decode_events(events: str | list[int]) -> list[int]:
+    # Documents written before the history was compacted hold plain lists.
+    return list(events) if isinstance(events, list) else [int(token, 36) for token in events.split()]
+
+
+def encode_document(document: dict) -> str:
+    """
+    @return: the document as compact JSON; if it would still exceed MAX_DOCUMENT_BYTES, the
+    history (only a pre-warm hint) is dropped rather than failing the save
+    """
+    value = json.dumps(document, separators=(",", ":"))
+    if len(value.encode()) > MAX_DOCUMENT_BYTES and document.get("history"):
+        logger.warning("Region-state document is %d bytes; dropping the start/stop history", len(value))
+        value = json.dumps({k: v for k, v in document.items() if k != "history"}, separators=(",", ":"))
+    return value
+
+
+class InMemoryBackend:
+    """Keeps the document in process memory - for tests, and when no parameter is configured."""
+
+    def __init__(self, document: dict | None = None):
+        self.document = json.loads(json.dumps(document or {}))
+
+    def load(self) -> dict:
+        return json.loads(json.dumps(self.document))
+
+    def save(self, document: dict) -> None:
+        self.document = json.loads(json.dumps(document))
+
+
+class FileBackend:
+    """Keeps the document in a local JSON file - for running the toggler from a workstation."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, document: dict) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(document, f)
+
+
+class SsmParameterBackend:
+    """Keeps the document as the JSON value of a (String) SSM parameter."""
+
+    def __init__(self, parameter_name: str, client):
+        self.parameter_name = parameter_name
+        self.client = client
+
+    def load(self) -> dict:
+        try:
+            value = self.client.get_parameter(Name=self.parameter_name)["Parameter"]["Value"]
+        except self.client.exceptions.ParameterNotFound:
+            return {}
+        try:
+            return json.loads(value) or {}
+        except ValueError:
+            logger.warning("Ignoring unparseable state in SSM parameter %s", self.parameter_name)
+            return {}
+
+    def save(self, document: dict) -> None:
+        self.client.put_parameter(
+            Name=self.parameter_name,
+            Value=encode_document(document),
+            Type="String",
+            Overwrite=True,
+        )
+
+
+class RegionStateLedger:
+    """
+    Thread-safe view over the persisted region-state document. Reads are lazy and cached for
+    the life of the ledger; writes are buffered until flush(), so a concurrent region fan-out
+    costs one load and (at most) one re-load and save.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._document: dict | None = None
+        # Paths (keys from the document root) of the values changed since the last flush.
+        self._changes: set[tuple[str, ...]] = set()
+
+    def _regions(self) -> dict:
+        if self._document is None:
+            self._document = self._backend.load()
+            self._document.setdefault("regions", {})
+        return self._document["regions"]
+
+    def get(self, region: str) -> dict | None:
+        """@return: the region's recorded state, or None if nothing is known about it"""
+        with self._lock:
+            entry = self._regions().get(region)
+            return dict(entry) if entry is not None else None
+
+    def record(
+        self,
+        region: str,
+        desired_capacity: int,
+        instance_ids: list[str] | None = None,
+        now: datetime | None = None,
+    ) -> None:
+        """
+        Records a region's desired capacity (and, if known, its instances). The last-change
+        time only moves when the capacity actually changes.
+        """
+        now = now or datetime.now(UTC)
+        with self._lock:
+            regions = self._regions()
+            entry = regions.get(region, {})
+            updated = dict(entry)
+            if entry.get("desired_capacity") != desired_capacity:
+                updated["desired_capacity"] = desired_capacity
+                updated["changed_at"] = now.isoformat(timespec="seconds")
+                if desired_capacity == 0:
+                    updated["instance_ids"] = []
+                    updated.pop("whitelist", None)
+                    updated.pop("pending", None)
+                    updated.pop("traffic", None)
+            if instance_ids is not None:
+                instance_ids = sorted(instance_ids)
+                if instance_ids != entry.get("instance_ids"):
+                    # A replacement (or additional) instance hasn't been set up for anyone yet.
+                    updated.pop("whitelist", None)
+                updated["instance_ids"] = instance_ids
+            if updated != entry:
+                regions[region] = updated
+                for key in set(entry) | set(updated):
+                    if entry.get(key) != updated.get(key):
+                        self._changes.add(("regions", region, key))
+
+    def record_whitelist(self, region: str, whitelist_ip: str | list[str]) -> None:
+        """
+        Records that the region's current instances have been fully set up (DNS and security
+        group) for the IP(s); cleared when the region is scaled to zero or its instances change.
+        Only a digest is kept (see whitelist_digest).
+        """
+        digest = whitelist_digest(whitelist_ip)
+        with self._lock:
+            entry = self._regions().get(region)
+            if entry is not None and entry.get("whitelist") != digest:
+                entry["whitelist"] = digest
+                self._changes.add(("regions", region, "whitelist"))
+
+    def is_set_up_for(self, region: str, whitelist_ip: str | list[str]) -> bool:
+        """@return: True if the region's current instances were last set up for exactly these IP(s)"""
+        entry = self.get(region) or {}
+        return entry.get("whitelist") == whitelist_digest(whitelist_ip)
+
+    def record_pending(
+        self, region: str, whitelist_ip: str | list[str], trace_id: str | None = None, now: datetime | None = None
+    ) -> None:
+        """
+        Records a start whose DNS and security group setup is left to the finalize Lambda,
+        for when the region's instances reach "running".
+        """
+        now = now or datetime.now(UTC)
+        with self._lock:
+            entry = self._regions().setdefault(region, {})
+            entry["pending"] = {
+                "whitelist_ip": whitelist_ip,
+                "trace_id": trace_id,
+                "requested_at": now.isoformat(timespec="seconds"),
+            }
+            self._changes.add(("regions", region, "pending"))
+
+    def get_pending(self, region: str) -> dict | None:
+        """@return: the region's unfinished start ({whitelist_ip, trace_id, requested_at}), if any"""
+        with self._lock:
+            pending = self._regions().get(region, {}).get("pending")
+            return dict(pending) if pending else None
+
+    def clear_pending(self, region: str) -> None:
+        with self._lock:
+            entry = self._regions().get(region)
+            if entry is not None and entry.pop("pending", None) is not None:
+                self._changes.add(("regions", region, "pending"))
+
+    def record_traffic(self, region: str, traffic: dict) -> None:
+        """
+        Records the region's per-instance rolling traffic windows (see idle_tracker.py),
+        replacing any kept for instances that are no longer listed.
+        """
+        with self._lock:
+            entry = self._regions().setdefault(region, {})
+            if entry.get("traffic", {}) != traffic:
+                if traffic:
+                    entry["traffic"] = traffic
+                else:
+                    entry.pop("traffic", None)
+                self._changes.add(("regions", region, "traffic"))
+
+    def get_traffic(self, region: str) -> dict:
+        """@return: instance ID -> persisted traffic window, for the region's instances"""
+        with self._lock:
+            return json.loads(json.dumps(self._regions().get(region, {}).get("traffic", {})))
+
+    def is_known_off(self, region: str) -> bool:
+        """@return: True only if the region is recorded as scaled to zero"""
+        entry = self.get(region)
+        return entry is not None and entry.get("desired_capacity") == 0
+
+    def plan_scan(
+        self,
+        regions: list[str],
+        now: datetime | None = None,
+        reconcile_interval_minutes: int | None = None,
+        always: tuple[str, ...] = (),
+    ) -> tuple[list[str], bool]:
+        """
+        Chooses which regions a scan needs to touch: every region not known to be off (plus
+        any in `always`), or every region when a full reconciliation is due.
+        @return: (regions_to_scan, is_full_reconciliation) - after a full reconciliation the
+        caller should call mark_reconciled()
+        """
+        now = now or datetime.now(UTC)
+        if reconcile_interval_minutes is None:
+            reconcile_interval_minutes = int(
+                os.environ.get("RECONCILE_INTERVAL_MINUTES", DEFAULT_RECONCILE_INTERVAL_MINUTES)
+            )
+        with self._lock:
+            self._regions()
+            reconciled_at = self._document.get("reconciled_at")
+        if reconciled_at is None or now - datetime.fromisoformat(reconciled_at) >= timedelta(
+            minutes=reconcile_interval_minutes
+        ):
+            return list(regions), True
+        return [r for r in regions if r in always or not self.is_known_off(r)], False
+
+    def mark_reconciled(self, now: datetime | None = None) -> None:
+        """Records that every region has just been re-read from AWS."""
+        now = now or datetime.now(UTC)
+        with self._lock:
+            self._regions()
+            self._document["reconciled_at"] = now.isoformat(timespec="seconds")
+            self._changes.add(("reconciled_at",))
+
+    def record_event(self, region: str, kind: str, now: datetime | None = None) -> None:
+        """Appends a user-initiated "start" or "stop" to the region's history."""
+        now = now or datetime.now(UTC)
+        with self._lock:
+            self._regions()
+            region_history = self._document.setdefault("history", {}).setdefault(region, {})
+            events = _decode_events(region_history.get(kind, ""))
+            events.append(int(now.timestamp() // 60))
+            region_history[kind] = _encode_events(events[-HISTORY_MAX_EVENTS:])
+            self._changes.add(("history", region, kind))
+
+    def get_history(self) -> dict:
+        """@return: region -> {"start": [epoch_minute, ...], "stop": [...]}, oldest first"""
+        with self._lock:
+            self._regions()
+            return {
+                region: {kind: _decode_events(events) for kind, events in region_history.items()}
+                for region, region_history in self._document.get("history", {}).items()
+            }
+
+    def record_prewarm(self, region: str, now: datetime | None = None) -> None:
+        """Records that the predictor pre-warmed the region."""
+        now = now or datetime.now(UTC)
+        with self._lock:
+            self._regions()
+            self._document["prewarmed"] = {"region": region, "at": now.isoformat(timespec="seconds")}
+            self._changes.add(("prewarmed",))
+
+    def get_last_prewarm(self) -> tuple[str, datetime] | None:
+        """@return: (region, when) of the last pre-warm, or None if there's never been one"""
+        with self._lock:
+            self._regions()
+            prewarmed = self._document.get("prewarmed")
+        if not prewarmed:
+            return None
+        return prewarmed["region"], datetime.fromisoformat(prewarmed["at"])
+
+    def record_synced_whitelist(self, cidrs: list[str]) -> None:
+        """Records (a digest of) the whitelist last pushed to every region's prefix lists (see prefix_lists.py)."""
+        with self._lock:
+            self._regions()
+            self._document["prefix_list_whitelist"] = whitelist_digest(cidrs)
+            self._changes.add(("prefix_list_whitelist",))
+
+    def is_whitelist_synced(self, cidrs: list[str]) -> bool:
+        """@return: True if these CIDRs are the whitelist last pushed to the prefix lists"""
+        with self._lock:
+            self._regions()
+            return self._document.get("prefix_list_whitelist") == whitelist_digest(cidrs)
+
+    def record_request(self, published_at: datetime) -> None:
+        """Records the SNS publish time of the request being applied (see is_superseded)."""
+        with self._lock:
+            self._regions()
+            self._document["last_request_at"] = published_at.isoformat(timespec="milliseconds")
+            self._changes.add(("last_request_at",))
+
+    def is_superseded(self, published_at: datetime) -> bool:
+        """@return: True if a request published after this one has already been applied"""
+        with self._lock:
+            self._regions()
+            last_request_at = self._document.get("last_request_at")
+        return last_request_at is not None and published_at < datetime.fromisoformat(last_request_at)
+
+    def flush(self) -> None:
+        """
+        Persists any buffered changes and forgets the cached document, so the next read
+        (e.g. in the next warm invocation) picks up what other writers have saved since.
+
+        The toggler, finalize, idle_shutdown and prewarm Lambdas can all run at once, so rather
+        than overwriting the document with this invocation's (possibly stale) copy, the latest
+        saved document is re-read and only the values this ledger changed are applied to it.
+        """
+        with self._lock:
+            if self._changes and self._document is not None:
+                latest = self._backend.load()
+                for path in self._changes:
+                    _copy_value(self._document, latest, path)
+                self._backend.save(latest)
+            self._document = None
+            self._changes = set()
+
+
+def _copy_value(source: dict, target: dict, path: tuple[str, ...]) -> None:
+    """Sets (or, if it's absent from `source`, removes) the value at `path` in `target`."""
+    *parents, key = path
+    for parent in parents:
+        source = source.get(parent, {})
+        target = target.setdefault(parent, {})
+    if key in source:
+        target[key] = source[key]
+    else:
+        target.pop(key, None)
+
+
+_ledger: RegionStateLedger | None = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> RegionStateLedger:
+    """
+    Returns the process-wide ledger, backed by the SSM parameter named in REGION_STATE_PARAMETER
+    if set, otherwise by memory (which only lives as long as the container).
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            parameter_name = os.environ.get("REGION_STATE_PARAMETER")
+            if parameter_name:
+                # Imported here: aws_helpers itself records into the ledger.
+                from .aws_helpers import get_client
+
+                backend = SsmParameterBackend(parameter_name, get_client("ssm"))
+            else:
+                backend = InMemoryBackend()
+            _ledger = RegionStateLedger(backend)
+        return _ledger
+
+
+def reset_ledger() -> None:
+    """Drops the process-wide ledger so the next get_ledger() reloads it from its backend."""
+    global _ledger
+    with _ledger_lock:
+        _ledger = None
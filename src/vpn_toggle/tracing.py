@@ -0,0 +1,109 @@
+"""
+Request tracing for the toggle Lambda. The starter proxy generates a trace ID for every start
+request and sends it (with the time it received the request) as SNS message attributes; the
+toggler adopts it for the invocation so every log line, EMF metric line and span can be tied
+back to the iOS shortcut tap that caused it.
+
+Spans are exported through OpenTelemetry when it's installed and configured (e.g. the AWS
+Distro for OpenTelemetry Lambda layer, which forwards them to X-Ray); otherwise they cost
+nothing. Like the metrics recorder, the current trace is module-level, because Lambda runs
+one invocation per container at a time and the region fan-out runs on worker threads.
+"""
+
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import UTC, datetime
+
+TRACE_ID_ATTRIBUTE = "trace_id"
+REQUESTED_AT_ATTRIBUTE = "requested_at"
+
+_trace_id: str | None = None
+_root_span = None
+
+
+def get_trace_id() -> str | None:
+    """@return: the current invocation's trace ID, if one is active"""
+    return _trace_id
+
+
+def from_sns_record(record: dict) -> tuple[str | None, datetime | None]:
+    """
+    Reads the proxy's trace attributes off an SNS event record.
+    @return: (trace_id, requested_at) - either may be None, e.g. for messages sent by hand
+    """
+    attributes = record.get("Sns", {}).get("MessageAttributes") or {}
+    trace_id = (attributes.get(TRACE_ID_ATTRIBUTE) or {}).get("Value")
+    requested_at = None
+    raw_requested_at = (attributes.get(REQUESTED_AT_ATTRIBUTE) or {}).get("Value")
+    if raw_requested_at:
+        try:
+            requested_at = datetime.fromtimestamp(int(raw_requested_at) / 1000, UTC)
+        except ValueError:
+            pass
+    return trace_id, requested_at
+
+
+class TraceIdFilter(logging.Filter):
+    """Tags each log record with the current trace ID (as record.trace_id and a message prefix)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id
+        if _trace_id and not getattr(record, "_trace_prefixed", False):
+            record.msg = f"[trace_id={_trace_id}] {record.msg}"
+            record._trace_prefixed = True
+        return True
+
+
+def install_log_filter() -> None:
+    """Adds the trace ID filter to the root logger's handlers (including the Lambda runtime's)."""
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+
+def _tracer():
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer(__name__)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Opens an OpenTelemetry span tagged with the trace ID, parented on the invocation's root
+    span even from worker threads. A no-op when OpenTelemetry isn't installed.
+    """
+    tracer = _tracer()
+    if tracer is None:
+        yield None
+        return
+    from opentelemetry import trace
+
+    context = None
+    if _root_span is not None and not trace.get_current_span().get_span_context().is_valid:
+        context = trace.set_span_in_context(_root_span)
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    if _trace_id:
+        attributes["vpn.trace_id"] = _trace_id
+    with tracer.start_as_current_span(name, context=context, attributes=attributes) as current:
+        yield current
+
+
+@contextmanager
+def trace_context(trace_id: str | None = None, name: str = "vpn_toggle"):
+    """
+    Makes `trace_id` (or a freshly generated one) the current trace for the enclosed
+    invocation, under a root span named `name`.
+    """
+    global _trace_id, _root_span
+    _trace_id = trace_id or uuid.uuid4().hex
+    try:
+        with span(name) as root:
+            _root_span = root
+            yield _trace_id
+    finally:
+        _trace_id = None
+        _root_span = None
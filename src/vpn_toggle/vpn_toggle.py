@@ -7,20 +7,39 @@ import logging
 import logging.config
 import os
 import sys
-import time
-from urllib import request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
 
 from pydantic import BaseModel
 
 from .aws_helpers import (
+    VALID_ZONES,
+    Ec2Instance,
+    InstanceReadiness,
+    collapse_whitelist,
     get_asg,
-    get_instance_from_asg,
+    get_instance_count,
+    get_instances_from_asg,
+    get_region_snapshot,
     set_dns_alias,
     update_asg_capacity,
     update_security_group,
+    wait_for_instances_running,
 )
+from .geo import AUTO_REGION, resolve_region
+from .idempotency import forget, is_repeat, remember
+from .metrics import get_recorder, invocation, timed_phase
+from .prefix_lists import sync_whitelist, use_prefix_lists
+from .profiling import profiled
+from .region_state import get_ledger
+from .tracing import from_sns_record, get_trace_id, install_log_filter, trace_context
+
+# How long enable_vpn waits for the instances to reach "running" (instances routinely take
+# longer than 25s); overridable with the READY_TIMEOUT_SECONDS environment variable.
+DEFAULT_READY_TIMEOUT_SECONDS = 90
+# Target-region outcomes that fail the invocation (the other regions are still toggled first).
+FAILED_OUTCOMES = ("error", InstanceReadiness.TIMED_OUT.value, InstanceReadiness.LAUNCH_FAILED.value)
 
-VALID_ZONES = ["eu-west-1", "us-east-1", "eu-north-1", "eu-west-2", "ap-southeast-2", "ca-central-1", "eu-west-3"]
 # create least privilegd role for this feature
 
 if len(logging.getLogger().handlers) > 0:
@@ -32,12 +51,14 @@ else:
 logging.getLogger("botocore").setLevel(logging.INFO)
 logging.getLogger("boto3").setLevel(logging.INFO)
 logging.getLogger("urllib3").setLevel(logging.INFO)
+install_log_filter()
 logger = logging.getLogger(__name__)
 
 
 class VpnEvent(BaseModel):
     region: str
-    whitelist_ip: str
+    # An address, or a list of addresses/CIDRs.
+    whitelist_ip: str | list[str]
 
 
 class SnsMessage(BaseModel):
@@ -53,78 +74,315 @@ class LambdaContext(BaseModel):
     function_version: str
 
 
-def enable_vpn(asg, region: str, a_record: str, hosted_zone_name: str, client_ip: str):
-    """Enables VPN by setting the ASG capacity to 1."""
-    new_capacity = update_asg_capacity(asg, region, 1)
-    if new_capacity == 1:
-        logger.debug("Waiting for the VPN VM to start in region %s", region)
-        # Check ASG if VM is available, for up to a minute (instances routinely
-        # take longer than 25s to reach "running")
-        for _ in range(12):
-            up_asg = get_asg(region)
-            try:
-                instance = get_instance_from_asg(up_asg, region)
-                if instance.State["Name"].lower() != "running":
-                    logger.info("Waiting for instance to start...")
-                    time.sleep(5)
-                else:
-                    break
-            except ValueError:
-                logger.info("Waiting for instance to start...")
-                time.sleep(5)
-
-        set_dns_alias(a_record, hosted_zone_name, asg, region)
-        update_security_group(asg, client_ip, region)
-    else:
+def enable_vpn(
+    asg,
+    region: str,
+    a_record: str,
+    hosted_zone_name: str,
+    client_ip: str | list[str],
+    ready_timeout_seconds: float | None = None,
+) -> InstanceReadiness | None:
+    """
+    Enables VPN by setting the ASG capacity to the instance count (VPN_INSTANCE_COUNT), then -
+    once the instances are running - points DNS at them and whitelists the client IP.
+    @return: the readiness outcome; DNS/security group are only touched when it's RUNNING
+    """
+    with timed_phase("time_to_ready", region):
+        return _enable_vpn(asg, region, a_record, hosted_zone_name, client_ip, ready_timeout_seconds)
+
+
+def _enable_vpn(
+    asg,
+    region: str,
+    a_record: str,
+    hosted_zone_name: str,
+    client_ip: str | list[str],
+    ready_timeout_seconds: float | None,
+) -> InstanceReadiness | None:
+    instance_count = get_instance_count()
+    with timed_phase("scale_up", region):
+        new_capacity = update_asg_capacity(asg, region, instance_count)
+    if new_capacity != instance_count:
         logger.debug("VPN not enabled in region %s", region)
+        return None
+    if asg.warm_pool_state:
+        logger.info("Resuming the VPN VM in region %s from its %s warm pool", region, asg.warm_pool_state)
 
+    if ready_timeout_seconds is None:
+        ready_timeout_seconds = float(os.environ.get("READY_TIMEOUT_SECONDS", DEFAULT_READY_TIMEOUT_SECONDS))
+    logger.debug("Waiting for the VPN VM to start in region %s", region)
+    with timed_phase("wait_for_running", region):
+        readiness, instances = wait_for_instances_running(region, ready_timeout_seconds)
+    if readiness != InstanceReadiness.RUNNING:
+        logger.error("VPN VM in region %s did not start (%s); skipping DNS and security group", region, readiness.value)
+        return readiness
 
-def disable_vpn(asg, region: str):
-    """Disables VPN by setting the ASG capacity to 0."""
-    update_asg_capacity(asg, region, 0)
+    finalize_vpn(asg, region, instances, a_record, hosted_zone_name, client_ip)
+    return readiness
 
 
-def manage_vpn(
-    target_region: str, a_record_name: str, hosted_zone_name: str, whitelist_ip: str
+def finalize_vpn(
+    asg,
+    region: str,
+    instances: list[Ec2Instance],
+    a_record: str,
+    hosted_zone_name: str,
+    client_ip: str | list[str],
 ):
-    """Main function"""
+    """Points DNS at the region's running instances and whitelists the client IP(s)."""
+    instance_ids = [instance.InstanceId for instance in instances]
+    get_ledger().record(region, len(instances), instance_ids)
+
+    snapshot = get_region_snapshot(region, asg=asg, instances=instances)
+    if use_prefix_lists():
+        # The security group takes the whitelist from the prefix lists manage_vpn has synced.
+        timed_phase("dns_upsert", region)(set_dns_alias)(a_record, hosted_zone_name, snapshot)
+    else:
+        # DNS and security group are independent of each other, so update them side by side.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(timed_phase("dns_upsert", region)(set_dns_alias), a_record, hosted_zone_name, snapshot),
+                executor.submit(
+                    timed_phase("security_group_update", region)(update_security_group), snapshot, client_ip
+                ),
+            ]
+        for future in futures:
+            future.result()
+    get_ledger().clear_pending(region)
+    remember(region, client_ip, instance_ids)
+
+
+def request_vpn(
+    asg, region: str, a_record: str, hosted_zone_name: str, client_ip: str | list[str]
+) -> InstanceReadiness | None:
+    """
+    Event-driven counterpart of enable_vpn: sets the ASG capacity to the instance count and
+    returns without waiting. The start is recorded as pending in the region-state ledger first,
+    and the finalize Lambda (finalize.py) completes it when EC2 reports the last instance
+    running. Only instances that are all already running - which won't emit another state
+    change - are finalized here.
+    @return: RUNNING if finalized now, PENDING if left to the finalize Lambda, None if not enabled
+    """
+    ledger = get_ledger()
+    ledger.record_pending(region, client_ip, get_trace_id())
+    # Saved before the scale-up, so the finalize Lambda can't miss it.
+    ledger.flush()
+    instance_count = get_instance_count()
+    with timed_phase("scale_up", region):
+        new_capacity = update_asg_capacity(asg, region, instance_count)
+    if new_capacity != instance_count:
+        ledger.clear_pending(region)
+        return None
+    if asg.DesiredCapacity == instance_count:
+        try:
+            instances = get_instances_from_asg(asg, region)
+        except ValueError:
+            instances = []
+        if len(instances) == instance_count and all(i.State["Name"].lower() == "running" for i in instances):
+            finalize_vpn(asg, region, instances, a_record, hosted_zone_name, client_ip)
+            return InstanceReadiness.RUNNING
+    logger.info("Requested the VPN VMs in region %s; DNS and security group follow once they're running", region)
+    return InstanceReadiness.PENDING
+
+
+def disable_vpn(asg, region: str):
+    """
+    Disables VPN by setting the ASG capacity to 0. With a warm pool (reuse on scale-in), the
+    instances are stopped/hibernated back into the pool rather than terminated.
+    """
+    forget(region)
+    with timed_phase("scale_down", region):
+        update_asg_capacity(asg, region, 0)
+    if asg.warm_pool_state and asg.DesiredCapacity != 0:
+        logger.info("Returning the VPN VM in region %s to its %s warm pool", region, asg.warm_pool_state)
+
+
+def _toggle_region(
+    region: str, target_region: str, a_record_name: str, hosted_zone_name: str, whitelist_ip: list[str]
+) -> str:
+    """Enables or disables a single region, returning the action taken."""
+    asg = get_asg(region)
+    if region == target_region:
+        logger.info("Enabling VPN in %s", region)
+        if os.environ.get("FINALIZE_ON_EVENT", "").lower() == "true":
+            readiness = request_vpn(asg, region, a_record_name, hosted_zone_name, whitelist_ip)
+        else:
+            readiness = enable_vpn(asg, region, a_record_name, hosted_zone_name, whitelist_ip)
+        if readiness not in (None, InstanceReadiness.RUNNING, InstanceReadiness.PENDING):
+            return readiness.value
+        # Every successful request counts as a use, even if the region was already up (e.g.
+        # pre-warmed) - the history feeds the pre-warm predictor.
+        get_ledger().record_event(region, "start")
+        return readiness.value if readiness == InstanceReadiness.PENDING else "enabled"
+    logger.info("Disabling VPN in %s", region)
+    disable_vpn(asg, region)
+    if asg.DesiredCapacity != 0:
+        get_ledger().record_event(region, "stop")
+    return "disabled"
+
+
+def resolve_target_region(target_region: str, whitelist_ip: str | list[str]) -> str:
+    """
+    @return: the region to enable - "auto" resolved to the region nearest the (first)
+    whitelisted IP
+    @raise ValueError: if the region isn't a deployed one, "auto" or "none"
+    """
+    if target_region == AUTO_REGION:
+        first_entry = whitelist_ip if isinstance(whitelist_ip, str) else whitelist_ip[0]
+        target_region = resolve_region(first_entry.split("/")[0], VALID_ZONES)
     if target_region not in VALID_ZONES and target_region != "none":
         raise ValueError(
-            f"Invalid region {target_region}. Valid regions are {VALID_ZONES} or 'none'"
+            f"Invalid region {target_region}. Valid regions are {VALID_ZONES}, '{AUTO_REGION}' or 'none'"
         )
-    for region in VALID_ZONES:
-        asg = get_asg(region)
-        if region == target_region:
-            logger.info("Enabling VPN in %s", region)
-            enable_vpn(asg, region, a_record_name, hosted_zone_name, whitelist_ip)
-        else:
-            logger.info("Disabling VPN in %s", region)
-            disable_vpn(asg, region)
+    return target_region
+
+
+def manage_vpn(
+    target_region: str, a_record_name: str, hosted_zone_name: str, whitelist_ip: str | list[str]
+) -> dict[str, str]:
+    """
+    Enables the target region and disables every other region, concurrently.
+    A target region of "auto" is resolved to the region nearest the (first) whitelisted IP.
+    The whitelist - an address, or a list of addresses/CIDRs - is collapsed into the fewest
+    CIDRs that cover it.
+    The target region is submitted first so its scale-up isn't queued behind the others;
+    a failure in one region is logged and recorded without aborting the rest (handler() then
+    fails the invocation if it was the target). Regions the
+    region-state ledger knows are already off are skipped, except on a periodic full
+    reconciliation. A repeat of a start that's already in effect (same region, same IP) only
+    confirms the instances are still running. With WHITELIST_PREFIX_LISTS, the whitelist is pushed
+    to every region's prefix lists alongside the toggle instead of into the target's security
+    group after it boots, and the target is reported as "error" if its own prefix lists
+    couldn't be updated.
+    @return: a mapping of region -> "enabled" | "disabled" | "skipped" | "error", or the target
+    region's readiness outcome ("timed-out" / "launch-failed") if its instances never came up, or
+    "pending" if FINALIZE_ON_EVENT leaves DNS/security group to the finalize Lambda
+    """
+    entries = [whitelist_ip] if isinstance(whitelist_ip, str) else whitelist_ip
+    target_region = resolve_target_region(target_region, entries)
+    whitelist = collapse_whitelist(entries)
+    ledger = get_ledger()
+    if target_region != "none":
+        with timed_phase("repeat_check", target_region):
+            repeat = is_repeat(target_region, whitelist, VALID_ZONES)
+        if repeat:
+            logger.info("VPN is already on in %s for %s; nothing to change", target_region, whitelist)
+            # Not a new start, so it stays out of the pre-warm predictor's history.
+            ledger.flush()
+            return {region: "enabled" if region == target_region else "skipped" for region in VALID_ZONES}
+    scan_regions, full_scan = ledger.plan_scan(VALID_ZONES, always=(target_region,))
+    regions = sorted(scan_regions, key=lambda r: r != target_region)
+    results = {region: "skipped" for region in VALID_ZONES if region not in scan_regions}
+    sync_prefix_lists = target_region != "none" and use_prefix_lists()
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(regions), 1) + sync_prefix_lists) as executor:
+            # Every region's prefix lists are brought up to date while the target boots.
+            prefix_list_sync = executor.submit(sync_whitelist, whitelist, VALID_ZONES) if sync_prefix_lists else None
+            futures = {
+                region: executor.submit(
+                    _toggle_region, region, target_region, a_record_name, hosted_zone_name, whitelist
+                )
+                for region in regions
+            }
+            for region, future in futures.items():
+                try:
+                    results[region] = future.result()
+                except Exception:
+                    logger.exception("Error toggling VPN in region %s", region)
+                    results[region] = "error"
+            if prefix_list_sync is not None:
+                try:
+                    synced = prefix_list_sync.result()
+                except Exception:
+                    logger.exception("Error syncing the whitelist prefix lists")
+                    synced = {target_region: "error"}
+                if synced.get(target_region) == "error":
+                    # The target's security group only admits what its prefix lists hold.
+                    logger.error("The whitelist isn't in %s's prefix lists; the client can't connect", target_region)
+                    results[target_region] = "error"
+        # A region that failed wasn't re-read, so the next run has to sweep everything again.
+        if full_scan and all(results[region] != "error" for region in regions):
+            ledger.mark_reconciled()
+    finally:
+        ledger.flush()
+    return results
 
 
+def _sns_timestamp(record: dict) -> datetime:
+    raw = record.get("Sns", {}).get("Timestamp")
+    return datetime.fromisoformat(raw) if raw else datetime.min.replace(tzinfo=UTC)
+
+
+def latest_request(records: list[dict]) -> tuple[VpnEvent, dict]:
+    """
+    Collapses a batch of SNS records to the most recently published request. SNS itself
+    delivers one record per invocation - bursts are serialised by the function's reserved
+    concurrency instead (see VPNLambdaDeployStack), and handler() drops any that arrive after
+    a newer request was applied - so this only coalesces events that carry several, e.g.
+    replayed test events. Records without a Timestamp rank before any that have one; ties go
+    to the later record.
+    @return: (the winning request, its SNS record)
+    """
+    ranked = sorted(enumerate(records), key=lambda item: (_sns_timestamp(item[1]), item[0]))
+    _, winner = ranked[-1]
+    if len(records) > 1:
+        logger.info("Coalesced %d queued requests; acting on the latest", len(records))
+    return VpnEvent(**json.loads(winner["Sns"]["Message"])), winner
+
+
+def _ms_since(moment: datetime) -> float:
+    return (datetime.now(UTC) - moment).total_seconds() * 1000
+
+
+@profiled("vpn_toggle")
 def handler(event: dict, context: dict | None = None):
     """Lambda handler"""
     a_record_name = os.environ["A_RECORD_NAME"]
     domain_name = os.environ["DOMAIN_NAME"]
     target_region = None
     whitelist_ip = None
+    trace_id = None
+    requested_at = None
+    published_at = None
 
     try:
         if "region" in event and "whitelist_ip" in event:
             vpn_event = VpnEvent(**event)
             target_region = vpn_event.region
             whitelist_ip = vpn_event.whitelist_ip
+            trace_id = event.get("trace_id")
         elif "Records" in event:
             sns_event = SnsEvent(**event)
-            message = json.loads(sns_event.Records[0]["Sns"]["Message"])
-            vpn_event = VpnEvent(**message)
+            vpn_event, record = latest_request(sns_event.Records)
             target_region = vpn_event.region
             whitelist_ip = vpn_event.whitelist_ip
+            trace_id, requested_at = from_sns_record(record)
+            if record.get("Sns", {}).get("Timestamp"):
+                published_at = _sns_timestamp(record)
         else:
             raise ValueError("Missing region or whitelist_ip in event")
 
         if a_record_name and domain_name and target_region and whitelist_ip:
-            manage_vpn(target_region, a_record_name, domain_name, whitelist_ip)
+            with trace_context(trace_id), invocation("vpn_toggle"):
+                if requested_at is not None:
+                    # Proxy -> SNS -> Lambda delivery, including any cold start before this line.
+                    get_recorder().record_phase("request_to_handler", None, _ms_since(requested_at))
+                target_region = resolve_target_region(target_region, whitelist_ip)
+                if published_at is not None:
+                    ledger = get_ledger()
+                    if ledger.is_superseded(published_at):
+                        # A throttled retry landing after a newer request; applying it would undo that one.
+                        logger.warning("Dropping the request published at %s; a newer one was applied", published_at)
+                        return {}
+                    ledger.record_request(published_at)  # flushed by manage_vpn
+                logger.info("Switching VPN to %s", target_region)
+                results = manage_vpn(target_region, a_record_name, domain_name, whitelist_ip)
+                if results.get(target_region) in FAILED_OUTCOMES:
+                    # Fail the invocation, so it's retried and shows up in the Errors metric.
+                    raise RuntimeError(f"VPN could not be enabled in {target_region}: {results}")
+                if requested_at is not None:
+                    get_recorder().record_phase("request_to_done", target_region, _ms_since(requested_at))
+                return results
         else:
             raise ValueError("Missing environment variables or region")
     except Exception as e:
@@ -133,6 +391,9 @@ def handler(event: dict, context: dict | None = None):
 
 
 if __name__ == "__main__":
+    # Only the CLI needs urllib; keep it out of the Lambda's import path.
+    from urllib import request
+
     if len(sys.argv) >= 4:
         aws_region = sys.argv[1]
         vpn_alias = sys.argv[2]
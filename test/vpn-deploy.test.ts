@@ -91,3 +91,85 @@ test('SQS Queue Created', () => {
 //     VisibilityTimeout: 300
 //   });
 });
+
+test('VPN Stack only adds a warm pool when a pool state is configured', () => {
+  process.env.CDK_DEFAULT_ACCOUNT = '123456789012';
+  process.env.CDK_DEFAULT_REGION = 'us-east-1';
+  delete process.env.VPN_WARM_POOL_STATE;
+  const context = { "@aws-cdk/aws-autoscaling:generateLaunchTemplateInsteadOfLaunchConfig": true };
+
+  const coldStack = new VPNVMDeployStack(new cdk.App({ context }), 'ColdStack');
+  Template.fromStack(coldStack).resourceCountIs('AWS::AutoScaling::WarmPool', 0);
+
+  const warmStack = new VPNVMDeployStack(new cdk.App({ context }), 'WarmStack', { warmPoolState: 'Stopped' });
+  Template.fromStack(warmStack).hasResourceProperties('AWS::AutoScaling::WarmPool', {
+    PoolState: 'Stopped',
+    MinSize: 0,
+    InstanceReusePolicy: { ReuseOnScaleIn: true },
+  });
+});
+
+test('VPN Stack sizes the ASG for the configured instance count', () => {
+  process.env.CDK_DEFAULT_ACCOUNT = '123456789012';
+  process.env.CDK_DEFAULT_REGION = 'us-east-1';
+  delete process.env.VPN_INSTANCE_COUNT;
+  const context = { "@aws-cdk/aws-autoscaling:generateLaunchTemplateInsteadOfLaunchConfig": true };
+
+  const single = Template.fromStack(new VPNVMDeployStack(new cdk.App({ context }), 'SingleStack'));
+  single.hasResourceProperties('AWS::AutoScaling::AutoScalingGroup', { MinSize: '0', MaxSize: '1' });
+
+  const shared = Template.fromStack(new VPNVMDeployStack(new cdk.App({ context }), 'SharedStack', { instanceCount: 3 }));
+  shared.hasResourceProperties('AWS::AutoScaling::AutoScalingGroup', { MinSize: '0', MaxSize: '3' });
+
+  expect(() => new VPNVMDeployStack(new cdk.App({ context }), 'BadStack', { instanceCount: 0 })).toThrow();
+});
+
+test('VPN Stack forwards EC2 running events to the central region outside it', () => {
+  process.env.CDK_DEFAULT_ACCOUNT = '123456789012';
+  process.env.CDK_DEFAULT_REGION = 'us-east-1';
+  const context = { "@aws-cdk/aws-autoscaling:generateLaunchTemplateInsteadOfLaunchConfig": true };
+  const template = Template.fromStack(new VPNVMDeployStack(new cdk.App({ context }), 'ForwardStack'));
+
+  template.hasResource('AWS::Events::Rule', {
+    Condition: 'NotCentralRegion',
+    Properties: Match.objectLike({
+      EventPattern: {
+        source: ['aws.ec2'],
+        'detail-type': ['EC2 Instance State-change Notification'],
+        detail: { state: ['running'] },
+      },
+      Targets: Match.arrayWith([
+        Match.objectLike({
+          Arn: { 'Fn::Join': ['', Match.arrayWith([Match.stringLikeRegexp('arn:aws:events:eu-west-1:')])] },
+        }),
+      ]),
+    }),
+  });
+});
+
+test('VPN Stack takes the SSH whitelist from managed prefix lists', () => {
+  process.env.CDK_DEFAULT_ACCOUNT = '123456789012';
+  process.env.CDK_DEFAULT_REGION = 'us-east-1';
+  const context = { "@aws-cdk/aws-autoscaling:generateLaunchTemplateInsteadOfLaunchConfig": true };
+  const template = Template.fromStack(new VPNVMDeployStack(new cdk.App({ context }), 'PrefixListStack'));
+
+  template.hasResourceProperties('AWS::EC2::PrefixList', {
+    PrefixListName: 'vpn-wireguard-whitelist',
+    AddressFamily: 'IPv4',
+    MaxEntries: 20,
+  });
+  template.hasResourceProperties('AWS::EC2::PrefixList', {
+    PrefixListName: 'vpn-wireguard-whitelist-ipv6',
+    AddressFamily: 'IPv6',
+  });
+  template.hasResourceProperties('AWS::EC2::SecurityGroup', {
+    SecurityGroupIngress: Match.arrayWith([
+      Match.objectLike({
+        IpProtocol: 'tcp',
+        FromPort: 22,
+        ToPort: 22,
+        SourcePrefixListId: { 'Fn::GetAtt': [Match.stringLikeRegexp('VPNWhitelistPrefixList'), 'PrefixListId'] },
+      }),
+    ]),
+  });
+});
@@ -127,7 +127,7 @@ test('VPN Idle Shutdown IAM role is scoped to update/describe ASG state, read Cl
         PolicyDocument: {
           Statement: Match.arrayWith([
             Match.objectLike({
-              Action: 'autoscaling:UpdateAutoScalingGroup',
+              Action: ['autoscaling:UpdateAutoScalingGroup', 'autoscaling:TerminateInstanceInAutoScalingGroup'],
               Effect: 'Allow',
               Condition: { StringEquals: { 'aws:ResourceTag/application-name': 'wireguard-vpn' } },
             }),
@@ -168,3 +168,194 @@ test('VPN Idle Shutdown Lambda has its own log group', () => {
     },
   });
 });
+
+test('Region-state ledger parameter is passed to, and writable by, both VPN Lambdas', () => {
+  const template = Template.fromStack(makeStack());
+
+  template.hasResourceProperties('AWS::SSM::Parameter', {
+    Name: '/vpn-wireguard/REGION_STATE',
+    Type: 'String',
+  });
+
+  for (const handler of ['vpn_toggle.vpn_toggle.handler', 'vpn_toggle.idle_shutdown.handler']) {
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Handler: handler,
+      Environment: {
+        Variables: Match.objectLike({
+          REGION_STATE_PARAMETER: { Ref: Match.stringLikeRegexp('VPNRegionStateParameter') },
+        }),
+      },
+    });
+  }
+
+  template.hasResourceProperties('AWS::IAM::Policy', {
+    PolicyDocument: {
+      Statement: Match.arrayWith([
+        Match.objectLike({ Action: 'ssm:PutParameter', Effect: 'Allow' }),
+      ]),
+    },
+  });
+});
+
+test('X-Ray active tracing on the proxy and toggle Lambdas is opt-in via ENABLE_XRAY_TRACING', () => {
+  delete process.env.ENABLE_XRAY_TRACING;
+  Template.fromStack(makeStack()).hasResourceProperties('AWS::Lambda::Function', {
+    Handler: 'vpn_toggle.vpn_toggle.handler',
+    TracingConfig: Match.absent(),
+  });
+
+  process.env.ENABLE_XRAY_TRACING = 'true';
+  try {
+    const template = Template.fromStack(makeStack());
+    for (const handler of ['vpn_toggle.vpn_toggle.handler', 'index.handler']) {
+      template.hasResourceProperties('AWS::Lambda::Function', {
+        Handler: handler,
+        TracingConfig: { Mode: 'Active' },
+      });
+    }
+  } finally {
+    delete process.env.ENABLE_XRAY_TRACING;
+  }
+});
+
+test('VPN Pre-warm Lambda is scheduled, capped at the idle grace period, and can only scale tagged ASGs', () => {
+  const template = Template.fromStack(makeStack());
+
+  template.hasResourceProperties('AWS::Lambda::Function', {
+    Handler: 'vpn_toggle.prewarm.handler',
+    Environment: {
+      Variables: Match.objectLike({
+        GRACE_PERIOD_MINUTES: '15',
+        PREWARM_LEAD_MINUTES: '15',
+        REGION_STATE_PARAMETER: Match.anyValue(),
+      }),
+    },
+  });
+
+  template.hasResourceProperties('AWS::Events::Rule', {
+    ScheduleExpression: 'rate(15 minutes)',
+    Targets: Match.arrayWith([
+      Match.objectLike({
+        Arn: Match.objectLike({ 'Fn::GetAtt': Match.arrayWith([Match.stringLikeRegexp('VPNPrewarmFunction')]) }),
+      }),
+    ]),
+  });
+
+  template.hasResourceProperties('AWS::IAM::Role', {
+    Policies: Match.arrayWith([
+      Match.objectLike({
+        PolicyDocument: {
+          Statement: Match.arrayWith([
+            Match.objectLike({
+              Action: 'autoscaling:UpdateAutoScalingGroup',
+              Condition: { StringEquals: { 'aws:ResourceTag/application-name': 'wireguard-vpn' } },
+            }),
+          ]),
+        },
+      }),
+    ]),
+  });
+});
+
+test('VPN Finalize Lambda runs on EC2 running events and the toggle no longer waits for the instance', () => {
+  const template = Template.fromStack(makeStack());
+
+  template.hasResourceProperties('AWS::Lambda::Function', {
+    Handler: 'vpn_toggle.vpn_toggle.handler',
+    Environment: { Variables: Match.objectLike({ FINALIZE_ON_EVENT: 'true' }) },
+  });
+  template.hasResourceProperties('AWS::Lambda::Function', {
+    Handler: 'vpn_toggle.finalize.handler',
+    Environment: {
+      Variables: Match.objectLike({
+        A_RECORD_NAME: 'vpn',
+        DOMAIN_NAME: 'example.com',
+        REGION_STATE_PARAMETER: Match.anyValue(),
+      }),
+    },
+  });
+  template.hasResourceProperties('AWS::Events::Rule', {
+    EventPattern: {
+      source: ['aws.ec2'],
+      'detail-type': ['EC2 Instance State-change Notification'],
+      detail: { state: ['running'] },
+    },
+    Targets: Match.arrayWith([
+      Match.objectLike({
+        Arn: Match.objectLike({ 'Fn::GetAtt': Match.arrayWith([Match.stringLikeRegexp('VPNFinalizeFunction')]) }),
+      }),
+    ]),
+  });
+});
+
+test('VPN instance count is passed to the Lambdas that scale regions up', () => {
+  process.env.VPN_INSTANCE_COUNT = '3';
+  try {
+    const template = Template.fromStack(makeStack());
+
+    for (const handler of ['vpn_toggle.vpn_toggle.handler', 'vpn_toggle.prewarm.handler']) {
+      template.hasResourceProperties('AWS::Lambda::Function', {
+        Handler: handler,
+        Environment: { Variables: Match.objectLike({ VPN_INSTANCE_COUNT: '3' }) },
+      });
+    }
+    // Idle shutdown repoints DNS at the instances it leaves running.
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Handler: 'vpn_toggle.idle_shutdown.handler',
+      Environment: { Variables: Match.objectLike({ A_RECORD_NAME: 'vpn', DOMAIN_NAME: 'example.com' }) },
+    });
+  } finally {
+    delete process.env.VPN_INSTANCE_COUNT;
+  }
+});
+
+test('VPN Toggle Lambda handles one request at a time', () => {
+  const template = Template.fromStack(makeStack());
+
+  template.hasResourceProperties('AWS::Lambda::Function', {
+    Handler: 'vpn_toggle.vpn_toggle.handler',
+    ReservedConcurrentExecutions: 1,
+  });
+  template.hasResourceProperties('AWS::SNS::Subscription', {
+    Protocol: 'lambda',
+    Endpoint: { 'Fn::GetAtt': [Match.stringLikeRegexp('VPNToggleFunction'), 'Arn'] },
+  });
+});
+
+test('Profiles are uploaded only when a profile bucket is configured, and only to its profiles/ prefix', () => {
+  const withoutBucket = Template.fromStack(makeStack());
+  withoutBucket.resourcePropertiesCountIs('AWS::Lambda::Function', {
+    Environment: { Variables: Match.objectLike({ PROFILE_S3_BUCKET: Match.anyValue() }) },
+  }, 0);
+
+  process.env.PROFILE_S3_BUCKET = 'vpn-profiles';
+  try {
+    const template = Template.fromStack(makeStack());
+
+    for (const handler of [
+      'vpn_toggle.vpn_toggle.handler',
+      'vpn_toggle.finalize.handler',
+      'vpn_toggle.idle_shutdown.handler',
+      'vpn_toggle.prewarm.handler',
+    ]) {
+      template.hasResourceProperties('AWS::Lambda::Function', {
+        Handler: handler,
+        Environment: { Variables: Match.objectLike({ PROFILE_S3_BUCKET: 'vpn-profiles' }) },
+      });
+    }
+    template.hasResourceProperties('AWS::IAM::Policy', {
+      PolicyDocument: {
+        Statement: Match.arrayWith([
+          Match.objectLike({
+            Action: Match.arrayWith(['s3:PutObject']),
+            Resource: Match.objectLike({
+              'Fn::Join': Match.arrayWith([Match.arrayWith([Match.stringLikeRegexp(':s3:::vpn-profiles/profiles/\\*')])]),
+            }),
+          }),
+        ]),
+      },
+    });
+  } finally {
+    delete process.env.PROFILE_S3_BUCKET;
+  }
+});
@@ -0,0 +1,13 @@
+import { validateCIDR } from '../src/vpn_starter_proxy/validation';
+
+test('Whitelist entries accept addresses and CIDRs down to the minimum prefix', () => {
+  for (const entry of ['1.2.3.4', '1.2.3.4/32', '10.1.0.0/16', '2001:db8::1', '2001:db8::/48']) {
+    expect(validateCIDR(entry)).toBe(true);
+  }
+});
+
+test('Whitelist entries wider than the minimum prefix, or malformed, are rejected', () => {
+  for (const entry of ['1.2.3.4/0', '0.0.0.0/0', '10.0.0.0/15', '::/0', '2001:db8::/47', '1.2.3.4/33', '1.2.3.4/16/1', 'nope/24']) {
+    expect(validateCIDR(entry)).toBe(false);
+  }
+});
@@ -4,6 +4,8 @@ import boto3
 import pytest
 from moto import mock_aws
 
+from vpn_toggle import aws_helpers, idempotency, region_state
+
 
 @pytest.fixture(autouse=True)
 def aws_credentials():
@@ -15,6 +17,37 @@ def aws_credentials():
     os.environ["AWS_DEFAULT_REGION"] = "eu-west-1"
 
 
+@pytest.fixture(autouse=True)
+def client_pool():
+    """Starts every test with an empty boto3 client pool, so no client outlives its moto mock."""
+    aws_helpers.reset_client_pool()
+    yield
+    aws_helpers.reset_client_pool()
+
+
+@pytest.fixture(autouse=True)
+def region_state_ledger(monkeypatch):
+    """Gives every test a fresh, empty in-memory region-state ledger."""
+    monkeypatch.delenv("REGION_STATE_PARAMETER", raising=False)
+    region_state.reset_ledger()
+    yield region_state.get_ledger()
+    region_state.reset_ledger()
+
+
+@pytest.fixture(autouse=True)
+def repeat_request_cache():
+    """Starts every test with no remembered start requests."""
+    idempotency.clear()
+    yield
+    idempotency.clear()
+
+
+@pytest.fixture(autouse=True)
+def hosted_zone_id_cache(monkeypatch):
+    """Each moto mock hands out fresh zone IDs, so don't let one test's cached ID leak into the next."""
+    monkeypatch.setattr(aws_helpers, "_hosted_zone_ids", {})
+
+
 @pytest.fixture
 def aws(aws_credentials):
     """Activates a moto mock covering every AWS service vpn_toggle/idle_shutdown touch."""
@@ -28,10 +61,10 @@ def make_wireguard_asg(aws):
     Factory fixture: creates a minimal VPC + launch template + tagged ASG (mirroring what
     lib/vpn-vm-deploy-stack.ts deploys) in the given region, optionally with a running
     instance attached (when desired_capacity > 0).
-    @return: a function (region, desired_capacity) -> (asg_name, instance_id | None)
+    @return: a function (region, desired_capacity, max_size) -> (asg_name, first instance_id | None)
     """
 
-    def _make(region: str = "eu-west-1", desired_capacity: int = 1):
+    def _make(region: str = "eu-west-1", desired_capacity: int = 1, max_size: int = 1):
         ec2 = boto3.client("ec2", region_name=region)
         asg_client = boto3.client("autoscaling", region_name=region)
 
@@ -64,7 +97,7 @@ def make_wireguard_asg(aws):
             AutoScalingGroupName=asg_name,
             LaunchTemplate={"LaunchTemplateName": f"wireguard-lt-{region}", "Version": "$Latest"},
             MinSize=0,
-            MaxSize=1,
+            MaxSize=max(max_size, desired_capacity),
             DesiredCapacity=desired_capacity,
             VPCZoneIdentifier=subnet_id,
             Tags=[
@@ -0,0 +1,314 @@
+"""
+Per-invocation AWS API call budgets for the toggle and idle-shutdown entry points.
+
+Every botocore call made through aws_helpers' client pool is counted (per service and
+operation) via a before-call event hook, and each entry point is timed. A test fails as
+soon as a change makes an entry point exceed its recorded budget - e.g. reintroducing a
+per-step instance lookup, or scanning regions the ledger knows are off. If a change
+legitimately needs more calls, update the budget here in the same commit, so the cost
+increase is visible in review.
+
+Counts and wall times are attached to each test's junit-xml properties (record_property).
+"""
+
+import time
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import boto3
+import botocore.session
+import pytest
+
+from vpn_toggle import aws_helpers, idempotency, idle_shutdown, vpn_toggle
+from vpn_toggle.region_state import get_ledger
+
+REGIONS = ["eu-west-1", "us-east-1", "eu-west-2"]
+# Generous ceiling on any one entry point's wall time under moto - catches accidental
+# sleeps/serialisation, not moto jitter.
+WALL_TIME_BUDGET_MS = 10_000
+A_RECORD = "vpn.example.com"
+ZONE = "example.com"
+
+
+@pytest.fixture
+def aws_calls(monkeypatch):
+    """
+    Counts every AWS call made through the client pool, keyed "service.Operation".
+    The pool's session is swapped for one carrying the hook, so every pooled client inherits it.
+    """
+    calls = Counter()
+
+    def _count(event_name, **kwargs):
+        _, service, operation = event_name.split(".")
+        calls[f"{service}.{operation}"] += 1
+
+    session = botocore.session.get_session()
+    session.register("before-call", _count)
+    monkeypatch.setattr(aws_helpers, "_session", session)
+    return calls
+
+
+@pytest.fixture
+def timed(record_property):
+    """Times a call and records its wall time (ms) as a junit-xml property."""
+
+    def _timed(name, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        record_property(f"{name}_ms", round(elapsed_ms, 1))
+        return result, elapsed_ms
+
+    return _timed
+
+
+def assert_within_budget(calls: Counter, budget: dict[str, int], record_property) -> None:
+    record_property("aws_calls", dict(calls))
+    unexpected = sorted(set(calls) - set(budget))
+    assert not unexpected, f"calls outside the budget: {unexpected} ({dict(calls)})"
+    over = {op: (calls[op], limit) for op, limit in budget.items() if calls[op] > limit}
+    assert not over, f"over budget (actual, budget): {over}"
+
+
+def _put_network_bytes(region, instance_id, now, value):
+    boto3.client("cloudwatch", region_name=region).put_metric_data(
+        Namespace="AWS/EC2",
+        MetricData=[
+            {
+                "MetricName": "NetworkIn",
+                "Dimensions": [{"Name": "InstanceId", "Value": instance_id}],
+                "Timestamp": now - timedelta(minutes=5),
+                "Value": value,
+                "Unit": "Bytes",
+            }
+        ],
+    )
+
+
+@pytest.fixture
+def three_regions(monkeypatch, make_wireguard_asg, hosted_zone):
+    """eu-west-1 running, the other two regions off."""
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", REGIONS)
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", REGIONS)
+    _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    make_wireguard_asg(region="us-east-1", desired_capacity=0)
+    make_wireguard_asg(region="eu-west-2", desired_capacity=0)
+    return instance_id
+
+
+def test_switch_region_budget(aws, three_regions, aws_calls, timed, record_property):
+    """Cold ledger: every region is reconciled, the old region stopped and the new one finalised."""
+    _, elapsed_ms = timed("manage_vpn", vpn_toggle.manage_vpn, "us-east-1", A_RECORD, ZONE, "9.9.9.9")
+
+    assert_within_budget(
+        aws_calls,
+        {
+            # one per region, plus one readiness poll of the target
+            "auto-scaling.DescribeAutoScalingGroups": len(REGIONS) + 1,
+            "auto-scaling.UpdateAutoScalingGroup": 2,
+            "ec2.DescribeInstances": 1,
+            "ec2.DescribeSecurityGroups": 1,
+            "ec2.RevokeSecurityGroupIngress": 1,
+            "ec2.AuthorizeSecurityGroupIngress": 1,
+            "route-53.ListHostedZonesByName": 1,
+            "route-53.ListResourceRecordSets": 1,
+            "route-53.ChangeResourceRecordSets": 1,
+        },
+        record_property,
+    )
+    assert elapsed_ms < WALL_TIME_BUDGET_MS
+
+
+def test_repeat_request_with_warm_ledger_budget(aws, three_regions, aws_calls, timed, record_property):
+    """Same request again: answered by one state check of the instance it set up."""
+    vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "9.9.9.9")
+    aws_calls.clear()
+
+    results, elapsed_ms = timed("manage_vpn", vpn_toggle.manage_vpn, "us-east-1", A_RECORD, ZONE, "9.9.9.9")
+
+    assert results["us-east-1"] == "enabled"
+    assert_within_budget(aws_calls, {"ec2.DescribeInstances": 1}, record_property)
+    assert elapsed_ms < WALL_TIME_BUDGET_MS
+
+
+def test_repeat_request_in_new_container_budget(aws, three_regions, aws_calls, record_property):
+    """A cold container recognises the repeat from the ledger's whitelist record."""
+    vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "9.9.9.9")
+    idempotency.clear()
+    aws_calls.clear()
+
+    vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "9.9.9.9")
+
+    assert_within_budget(aws_calls, {"ec2.DescribeInstances": 1}, record_property)
+
+
+def _a_record_values(region):
+    zone_id = boto3.client("route53").list_hosted_zones_by_name(DNSName=ZONE)["HostedZones"][0]["Id"]
+    records = boto3.client("route53").list_resource_record_sets(HostedZoneId=zone_id)["ResourceRecordSets"]
+    record = next(r for r in records if r["Name"] == f"{A_RECORD}." and r["Type"] == "A")
+    return sorted(r["Value"] for r in record["ResourceRecords"])
+
+
+def _whitelisted(region):
+    snapshot = aws_helpers.get_region_snapshot(region)
+    permissions = boto3.client("ec2", region_name=region).describe_security_groups(
+        GroupIds=[snapshot.security_group_id]
+    )["SecurityGroups"][0]["IpPermissions"]
+    return {r["CidrIp"] for p in permissions for r in p["IpRanges"]}, snapshot.public_ips
+
+
+def test_request_from_new_ip_or_stopped_instance_runs_full_enable(aws, three_regions, aws_calls, monkeypatch):
+    vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "9.9.9.9")
+    aws_calls.clear()
+
+    assert vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "8.8.8.8")["us-east-1"] == "enabled"
+
+    assert aws_calls["ec2.DescribeSecurityGroups"] == 1
+    assert aws_calls["ec2.AuthorizeSecurityGroupIngress"] == 1
+    assert aws_calls["route-53.ListResourceRecordSets"] == 1
+    cidrs, public_ips = _whitelisted("us-east-1")
+    assert "8.8.8.8/32" in cidrs and "9.9.9.9/32" not in cidrs
+    assert _a_record_values("us-east-1") == public_ips
+
+    instance_ids = get_ledger().get("us-east-1")["instance_ids"]
+    ec2 = boto3.client("ec2", region_name="us-east-1")
+    ec2.stop_instances(InstanceIds=instance_ids)
+    aws_calls.clear()
+    # moto never brings the stopped instance back, so stand in for EC2 (and the clock) while
+    # the toggler waits for it.
+    clock = iter(range(0, 10_000, 5))
+    monkeypatch.setattr(
+        aws_helpers,
+        "time",
+        MagicMock(monotonic=lambda: next(clock), sleep=lambda seconds: ec2.start_instances(InstanceIds=instance_ids)),
+    )
+
+    assert vpn_toggle.manage_vpn("us-east-1", A_RECORD, ZONE, "8.8.8.8")["us-east-1"] == "enabled"
+
+    assert aws_calls["auto-scaling.DescribeAutoScalingGroups"] >= 2  # at least one readiness re-poll
+    assert aws_calls["ec2.DescribeSecurityGroups"] == 1
+    assert aws_calls["route-53.ListResourceRecordSets"] == 1
+    cidrs, public_ips = _whitelisted("us-east-1")
+    assert "8.8.8.8/32" in cidrs
+    assert _a_record_values("us-east-1") == public_ips
+
+
+def test_enable_vpn_budget(aws, three_regions, aws_calls, timed, record_property):
+    asg = aws_helpers.get_asg("us-east-1")
+    aws_calls.clear()
+
+    _, elapsed_ms = timed("enable_vpn", vpn_toggle.enable_vpn, asg, "us-east-1", A_RECORD, ZONE, "9.9.9.9")
+
+    assert_within_budget(
+        aws_calls,
+        {
+            "auto-scaling.DescribeAutoScalingGroups": 1,
+            "auto-scaling.UpdateAutoScalingGroup": 1,
+            "ec2.DescribeInstances": 1,
+            "ec2.DescribeSecurityGroups": 1,
+            "ec2.RevokeSecurityGroupIngress": 1,
+            "ec2.AuthorizeSecurityGroupIngress": 1,
+            "route-53.ListHostedZonesByName": 1,
+            "route-53.ListResourceRecordSets": 1,
+            "route-53.ChangeResourceRecordSets": 1,
+        },
+        record_property,
+    )
+    assert elapsed_ms < WALL_TIME_BUDGET_MS
+
+
+@pytest.fixture
+def ssh_security_group(aws, make_wireguard_asg, aws_calls):
+    """A running region's snapshot; the SSH rule starts out whitelisting 1.2.3.4/32 only."""
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+    aws_calls.clear()
+    return snapshot
+
+
+def _ssh_cidrs(snapshot):
+    permissions = boto3.client("ec2", region_name="eu-west-1").describe_security_groups(
+        GroupIds=[snapshot.security_group_id]
+    )["SecurityGroups"][0]["IpPermissions"]
+    return sorted(r["CidrIp"] for p in permissions if p["FromPort"] == 22 for r in p["IpRanges"])
+
+
+def test_security_group_noop_update_budget(ssh_security_group, aws_calls, record_property):
+    aws_helpers.update_security_group(ssh_security_group, "1.2.3.4")
+
+    assert_within_budget(aws_calls, {"ec2.DescribeSecurityGroups": 1}, record_property)
+    assert _ssh_cidrs(ssh_security_group) == ["1.2.3.4/32"]
+
+
+def test_security_group_single_ip_change_budget(ssh_security_group, aws_calls, record_property, monkeypatch):
+    aws_helpers.update_security_group(ssh_security_group, ["1.2.3.4", "5.6.7.8"])
+    assert aws_calls == {"ec2.DescribeSecurityGroups": 1, "ec2.AuthorizeSecurityGroupIngress": 1}
+    aws_calls.clear()
+    order = []
+    ec2 = aws_helpers.get_client("ec2", "eu-west-1")
+
+    def recording(name, original):
+        return lambda **kwargs: order.append(name) or original(**kwargs)
+
+    for method in ("authorize_security_group_ingress", "revoke_security_group_ingress"):
+        monkeypatch.setattr(ec2, method, recording(method, getattr(ec2, method)))
+
+    aws_helpers.update_security_group(ssh_security_group, ["1.2.3.4", "9.9.9.9"])
+
+    assert_within_budget(
+        aws_calls,
+        {
+            "ec2.DescribeSecurityGroups": 1,
+            "ec2.AuthorizeSecurityGroupIngress": 1,
+            "ec2.RevokeSecurityGroupIngress": 1,
+        },
+        record_property,
+    )
+    assert order == ["authorize_security_group_ingress", "revoke_security_group_ingress"]
+    assert _ssh_cidrs(ssh_security_group) == ["1.2.3.4/32", "9.9.9.9/32"]
+
+
+def test_idle_shutdown_budget(aws, three_regions, aws_calls, timed, record_property, monkeypatch):
+    """Cold ledger, one idle instance: one ASG read per region, one metrics batch, one stop."""
+    instance_id = three_regions
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", boto3.client("sns").create_topic(Name="vpn-auto-stop")["TopicArn"])
+    now = datetime.now(UTC) + timedelta(minutes=idle_shutdown.DEFAULT_GRACE_PERIOD_MINUTES + 5)
+    _put_network_bytes("eu-west-1", instance_id, now, 10)
+
+    with patch("vpn_toggle.idle_shutdown.datetime") as mock_datetime:
+        mock_datetime.now.return_value = now
+        result, elapsed_ms = timed("idle_shutdown", idle_shutdown.handler)
+
+    assert result == {"stopped_regions": ["eu-west-1"]}
+    assert_within_budget(
+        aws_calls,
+        {
+            "auto-scaling.DescribeAutoScalingGroups": len(REGIONS),
+            "auto-scaling.UpdateAutoScalingGroup": 1,
+            "ec2.DescribeInstances": 1,
+            "cloudwatch.GetMetricData": 1,
+            "sns.Publish": 1,
+        },
+        record_property,
+    )
+    assert elapsed_ms < WALL_TIME_BUDGET_MS
+
+
+def test_idle_shutdown_steady_state_budget(aws, three_regions, aws_calls, timed, record_property, monkeypatch):
+    """Warm ledger, nothing to stop: only the region that's on is checked at all."""
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+    idle_shutdown.handler()
+    aws_calls.clear()
+
+    _, elapsed_ms = timed("idle_shutdown", idle_shutdown.handler)
+
+    assert_within_budget(
+        aws_calls,
+        {
+            "auto-scaling.DescribeAutoScalingGroups": 1,
+            "ec2.DescribeInstances": 1,
+        },
+        record_property,
+    )
+    assert elapsed_ms < WALL_TIME_BUDGET_MS
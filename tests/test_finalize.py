@@ -0,0 +1,98 @@
+import boto3
+import pytest
+
+from vpn_toggle import aws_helpers, finalize, vpn_toggle
+from vpn_toggle.region_state import get_ledger
+
+REGIONS = ["eu-west-1", "us-east-1"]
+
+
+@pytest.fixture
+def event_driven(monkeypatch, make_wireguard_asg, hosted_zone):
+    """eu-west-1 running, us-east-1 off, with the toggle in event-driven mode."""
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", REGIONS)
+    monkeypatch.setenv("FINALIZE_ON_EVENT", "true")
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+    monkeypatch.setattr(aws_helpers.time, "sleep", lambda seconds: pytest.fail("should not wait for the instance"))
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    make_wireguard_asg(region="us-east-1", desired_capacity=0)
+    return hosted_zone
+
+
+def _state_change(region, instance_id, state="running"):
+    return {
+        "id": "event-1",
+        "source": "aws.ec2",
+        "detail-type": "EC2 Instance State-change Notification",
+        "region": region,
+        "detail": {"instance-id": instance_id, "state": state},
+    }
+
+
+def _a_record(hosted_zone):
+    records = boto3.client("route53").list_resource_record_sets(HostedZoneId=hosted_zone)["ResourceRecordSets"]
+    return next((r for r in records if r["Name"] == "vpn.example.com." and r["Type"] == "A"), None)
+
+
+def test_toggle_requests_capacity_and_finalize_completes_on_running_event(event_driven):
+    results = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "9.9.9.9")
+
+    assert results == {"us-east-1": "pending", "eu-west-1": "disabled"}
+    assert get_ledger().get_pending("us-east-1")["whitelist_ip"] == ["9.9.9.9/32"]
+    assert _a_record(event_driven) is None
+
+    (instance,) = aws_helpers.get_instances_from_asg(aws_helpers.get_asg("us-east-1"), "us-east-1")
+    assert finalize.handler(_state_change("us-east-1", instance.InstanceId)) == {
+        "finalized": True,
+        "region": "us-east-1",
+    }
+
+    public_ip = instance.NetworkInterfaces[0]["Association"]["PublicIp"]
+    assert _a_record(event_driven)["ResourceRecords"] == [{"Value": public_ip}]
+    entry = get_ledger().get("us-east-1")
+    assert "pending" not in entry
+    assert get_ledger().is_set_up_for("us-east-1", ["9.9.9.9/32"])
+
+
+def test_finalize_ignores_instances_without_a_pending_start(event_driven, monkeypatch):
+    vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "9.9.9.9")
+
+    assert finalize.handler(_state_change("us-east-1", "i-0123456789abcdef0")) == {
+        "finalized": False,
+        "region": "us-east-1",
+    }
+    assert finalize.handler(_state_change("us-east-1", "i-0123456789abcdef0", state="stopping")) == {
+        "finalized": False
+    }
+
+    monkeypatch.setattr(finalize, "get_asg", lambda region: pytest.fail("should not look up the ASG"))
+    assert finalize.handler(_state_change("eu-west-1", "i-0123456789abcdef0"))["finalized"] is False
+
+
+def test_request_finalizes_inline_when_instance_already_running(event_driven):
+    results = vpn_toggle.manage_vpn("eu-west-1", "vpn.example.com", "example.com", "9.9.9.9")
+
+    assert results["eu-west-1"] == "enabled"
+    assert _a_record(event_driven) is not None
+    assert get_ledger().get_pending("eu-west-1") is None
+
+
+def test_finalize_waits_for_the_last_of_several_instances(event_driven, make_wireguard_asg, monkeypatch):
+    monkeypatch.setenv("VPN_INSTANCE_COUNT", "2")
+    make_wireguard_asg(region="eu-west-2", desired_capacity=2, max_size=2)
+    monkeypatch.setattr(finalize, "VALID_ZONES", [*REGIONS, "eu-west-2"])
+    first, second = aws_helpers.get_instances_from_asg(aws_helpers.get_asg("eu-west-2"), "eu-west-2")
+    ec2 = boto3.client("ec2", region_name="eu-west-2")
+    ec2.stop_instances(InstanceIds=[second.InstanceId])
+    get_ledger().record_pending("eu-west-2", ["9.9.9.9/32"])
+
+    assert finalize.handler(_state_change("eu-west-2", first.InstanceId))["finalized"] is False
+    assert _a_record(event_driven) is None
+
+    ec2.start_instances(InstanceIds=[second.InstanceId])
+    assert finalize.handler(_state_change("eu-west-2", second.InstanceId))["finalized"] is True
+
+    public_ips = aws_helpers.get_region_snapshot("eu-west-2").public_ips
+    assert sorted(r["Value"] for r in _a_record(event_driven)["ResourceRecords"]) == sorted(public_ips)
+    assert get_ledger().is_set_up_for("eu-west-2", ["9.9.9.9/32"])
@@ -0,0 +1,97 @@
+import pytest
+
+from vpn_toggle import aws_helpers, geo, vpn_toggle
+
+
+@pytest.mark.parametrize(
+    "ip, region",
+    [
+        ("8.8.8.8", "us-east-1"),
+        ("81.2.69.160", "eu-west-1"),
+        ("1.1.1.1", "ap-southeast-2"),
+        ("41.0.0.1", "eu-west-3"),
+        ("131.111.8.46", "eu-west-2"),
+        ("86.140.1.1", "eu-west-2"),
+        ("99.230.0.1", "ca-central-1"),
+        ("128.100.1.1", "ca-central-1"),
+        ("130.237.28.40", "eu-north-1"),
+        ("2a00:1450::1", "eu-west-1"),
+        ("::ffff:81.2.69.160", "eu-west-1"),
+    ],
+)
+def test_bundled_index_lookup(ip, region):
+    assert geo.get_index().lookup(ip) == region
+
+
+@pytest.mark.parametrize("ip", ["10.0.0.1", "172.20.0.1", "192.168.1.1", "100.64.0.1", "169.254.169.254", "fd00::1"])
+def test_private_addresses_fall_back_to_the_default_region(ip):
+    assert geo.get_index().lookup(ip) is None
+    assert geo.resolve_region(ip, aws_helpers.VALID_ZONES) == geo.DEFAULT_REGION
+
+
+def test_every_deployed_region_can_be_resolved():
+    index = geo.get_index()
+    assert set(aws_helpers.VALID_ZONES) <= set(index.regions)
+
+
+def test_unplaceable_addresses_fall_back_to_the_default_region():
+    assert geo.resolve_region("10.0.0.1", aws_helpers.VALID_ZONES) == geo.DEFAULT_REGION
+    assert geo.resolve_region("not-an-ip", aws_helpers.VALID_ZONES) == geo.DEFAULT_REGION
+    assert geo.resolve_region("8.8.8.8", ["eu-west-2"], default="eu-west-2") == "eu-west-2"
+
+
+def test_index_is_read_once_per_container(monkeypatch):
+    monkeypatch.setattr(geo, "_index", None)
+    reads = []
+    original = geo.IpRegionIndex.from_bytes
+    monkeypatch.setattr(geo.IpRegionIndex, "from_bytes", lambda data: reads.append(1) or original(data))
+
+    geo.resolve_region("8.8.8.8", aws_helpers.VALID_ZONES)
+    geo.resolve_region("1.1.1.1", aws_helpers.VALID_ZONES)
+
+    assert len(reads) == 1
+
+
+def test_built_index_round_trips_and_rejects_overlaps(tmp_path):
+    csv = tmp_path / "ranges.csv"
+    csv.write_text("# comment\n10.0.0.0/8,eu-west-2\n192.168.0.0,192.168.255.255,us-east-1\n2001:db8::/32,eu-west-2\n")
+
+    index = geo.IpRegionIndex.from_bytes(geo.IpRegionIndex.from_rows(geo.read_csv_rows(str(csv))).to_bytes())
+
+    assert index.lookup("10.1.2.3") == "eu-west-2"
+    assert index.lookup("11.0.0.0") is None
+    assert index.lookup("192.168.1.1") == "us-east-1"
+    assert index.lookup("2001:db8::1") == "eu-west-2"
+    assert index.lookup("255.255.255.255") is None
+    with pytest.raises(ValueError):
+        geo.IpRegionIndex.from_rows([("10.0.0.0", "10.0.0.255", "a"), ("10.0.0.128", "10.0.1.0", "b")])
+    with pytest.raises(ValueError):
+        geo.IpRegionIndex.from_rows([("10.0.0.0", "10.0.0.255", "a"), ("10.0.0.0", "10.0.0.255", "b")])
+
+
+def test_nested_ranges_override_the_range_around_them():
+    index = geo.IpRegionIndex.from_rows(
+        [
+            ("10.0.0.0", "10.255.255.255", "a"),
+            ("10.1.0.0", "10.1.255.255", "b"),
+            ("10.1.0.0", "10.1.0.255", geo.UNASSIGNED),
+            ("10.255.0.0", "10.255.255.255", "c"),
+        ]
+    )
+
+    assert index.lookup("10.0.0.1") == "a"
+    assert index.lookup("10.1.0.1") is None
+    assert index.lookup("10.1.1.1") == "b"
+    assert index.lookup("10.2.0.0") == "a"
+    assert index.lookup("10.255.255.255") == "c"
+    assert index.lookup("11.0.0.0") is None
+    assert index.regions == ["a", "b", "c"]
+
+
+def test_manage_vpn_resolves_auto_to_the_nearest_region(monkeypatch):
+    toggled = {}
+    monkeypatch.setattr(vpn_toggle, "_toggle_region", lambda region, target, *args: toggled.setdefault(region, target))
+
+    vpn_toggle.manage_vpn(geo.AUTO_REGION, "vpn.example.com", "example.com", "1.1.1.1")
+
+    assert set(toggled.values()) == {"ap-southeast-2"}
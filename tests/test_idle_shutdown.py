@@ -20,7 +20,10 @@ def _check(region, now, **overrides):
         "idle_byte_threshold": IDLE_BYTE_THRESHOLD_BYTES,
     }
     kwargs.update(overrides)
-    return idle_shutdown.check_region(region, now, **kwargs)
+    decisions = idle_shutdown.check_region(region, now, **kwargs)
+    # These regions run (at most) one instance.
+    assert len(decisions) <= 1
+    return next(iter(decisions.values()), (False, None, {}))
 
 
 def _put_network_bytes(region, instance_id, now, metric_bytes):
@@ -110,6 +113,112 @@ def test_check_region_fails_safe_when_no_cloudwatch_datapoints_yet(aws, make_wir
     assert "bytes_transferred" not in detail
 
 
+def _instance_ids(region):
+    asg = aws_helpers.get_asg(region)
+    return [i.InstanceId for i in aws_helpers.get_instances_from_asg(asg, region)]
+
+
+def test_check_region_judges_each_instance_with_one_metrics_request(aws, make_wireguard_asg):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=2, max_size=2)
+    busy, quiet = _instance_ids("eu-west-1")
+    now = datetime.now(UTC) + timedelta(minutes=GRACE_PERIOD_MINUTES + 5)
+    _put_network_bytes("eu-west-1", busy, now, {"NetworkIn": IDLE_BYTE_THRESHOLD_BYTES * 2})
+    _put_network_bytes("eu-west-1", quiet, now, {"NetworkIn": 10})
+    calls = []
+    aws_helpers.get_client("cloudwatch", "eu-west-1").meta.events.register(
+        "before-call", lambda model, **kwargs: calls.append(model.name)
+    )
+
+    decisions = idle_shutdown.check_region(
+        "eu-west-1",
+        now,
+        max_runtime_minutes=MAX_RUNTIME_MINUTES,
+        grace_period_minutes=GRACE_PERIOD_MINUTES,
+        idle_window_minutes=IDLE_WINDOW_MINUTES,
+        idle_byte_threshold=IDLE_BYTE_THRESHOLD_BYTES,
+    )
+
+    assert decisions[busy][:2] == (False, None)
+    assert decisions[quiet][:2] == (True, "idle-timeout")
+    assert calls == ["GetMetricData"]
+
+
+def test_handler_stops_only_the_idle_instance_and_repoints_dns(aws, make_wireguard_asg, hosted_zone, monkeypatch):
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", ["eu-west-1"])
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+    make_wireguard_asg(region="eu-west-1", desired_capacity=2, max_size=2)
+    busy, quiet = _instance_ids("eu-west-1")
+    fixed_now = datetime.now(UTC) + timedelta(minutes=GRACE_PERIOD_MINUTES + 5)
+    _put_network_bytes("eu-west-1", busy, fixed_now, {"NetworkIn": IDLE_BYTE_THRESHOLD_BYTES * 2})
+    _put_network_bytes("eu-west-1", quiet, fixed_now, {"NetworkIn": 10})
+    notifications = []
+    monkeypatch.setattr(
+        idle_shutdown,
+        "publish_notification",
+        lambda topic_arn, subject, message: notifications.append((subject, message)),
+    )
+
+    with patch("vpn_toggle.idle_shutdown.datetime") as mock_datetime:
+        mock_datetime.now.return_value = fixed_now
+        result = idle_shutdown.handler()
+
+    assert result == {"stopped_regions": ["eu-west-1"]}
+    assert aws_helpers.get_asg("eu-west-1").DesiredCapacity == 1
+    assert _instance_ids("eu-west-1") == [busy]
+    busy_ip = aws_helpers.get_region_snapshot("eu-west-1").public_ips
+    records = boto3.client("route53").list_resource_record_sets(HostedZoneId=hosted_zone)["ResourceRecordSets"]
+    a_record = next(r for r in records if r["Name"] == "vpn.example.com." and r["Type"] == "A")
+    assert [r["Value"] for r in a_record["ResourceRecords"]] == busy_ip
+    assert "1 of the 2 VPN instances" in notifications[0][1]
+    assert quiet in notifications[0][1]
+
+
+def _a_record(hosted_zone):
+    records = boto3.client("route53").list_resource_record_sets(HostedZoneId=hosted_zone)["ResourceRecordSets"]
+    return next((r for r in records if r["Name"] == "vpn.example.com." and r["Type"] == "A"), None)
+
+
+@pytest.mark.parametrize("other_state", ["pending", "stopped"])
+def test_handler_never_leaves_dns_on_stopped_instances(aws, make_wireguard_asg, hosted_zone, monkeypatch, other_state):
+    """The idle instance was the only running one; the other is still starting, or down."""
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", ["eu-west-1"])
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+    monkeypatch.setattr(idle_shutdown, "publish_notification", lambda *args, **kwargs: None)
+    make_wireguard_asg(region="eu-west-1", desired_capacity=2, max_size=2)
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+    aws_helpers.set_dns_alias("vpn.example.com", "example.com", snapshot)
+    other, quiet = (instance.InstanceId for instance in snapshot.instances)
+    other_ip = snapshot.public_ips[0]
+    fixed_now = datetime.now(UTC) + timedelta(minutes=GRACE_PERIOD_MINUTES + 5)
+    _put_network_bytes("eu-west-1", quiet, fixed_now, {"NetworkIn": 10})
+    if other_state == "stopped":
+        boto3.client("ec2", region_name="eu-west-1").stop_instances(InstanceIds=[other])
+    else:
+        get_instances = idle_shutdown.get_instances_from_asg
+
+        def starting(asg, region):
+            instances = get_instances(asg, region)
+            for instance in instances:
+                if instance.InstanceId == other:
+                    instance.State = {"Name": "pending"}
+            return instances
+
+        monkeypatch.setattr(idle_shutdown, "get_instances_from_asg", starting)
+
+    with patch("vpn_toggle.idle_shutdown.datetime") as mock_datetime:
+        mock_datetime.now.return_value = fixed_now
+        assert idle_shutdown.handler() == {"stopped_regions": ["eu-west-1"]}
+
+    if other_state == "pending":
+        assert _a_record(hosted_zone)["ResourceRecords"] == [{"Value": other_ip}]
+    else:
+        assert _a_record(hosted_zone) is None
+
+
 def test_get_network_bytes_sum_returns_none_without_datapoints(aws, make_wireguard_asg):
     _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
 
@@ -126,6 +235,21 @@ def test_get_network_bytes_sum_sums_in_and_out(aws, make_wireguard_asg):
     assert total == 3000
 
 
+def test_get_network_bytes_sums_batches_instances_into_one_request(aws):
+    now = datetime.now(UTC)
+    _put_network_bytes("eu-west-1", "i-busy", now, {"NetworkIn": 1000, "NetworkOut": 2000})
+    _put_network_bytes("eu-west-1", "i-quiet", now, {"NetworkOut": 10})
+    calls = []
+    aws_helpers.get_client("cloudwatch", "eu-west-1").meta.events.register(
+        "before-call", lambda model, **kwargs: calls.append(model.name)
+    )
+
+    totals = aws_helpers.get_network_bytes_sums(["i-busy", "i-quiet", "i-new"], "eu-west-1", 30)
+
+    assert totals == {"i-busy": 3000, "i-quiet": 10, "i-new": None}
+    assert calls == ["GetMetricData"]
+
+
 def test_publish_notification_delivers_to_subscribed_queue(aws):
     sns = boto3.client("sns", region_name="eu-west-1")
     sqs = boto3.client("sqs", region_name="eu-west-1")
@@ -178,7 +302,10 @@ def test_handler_continues_past_a_region_that_errors(aws, make_wireguard_asg, mo
     fixed_now = datetime.now(UTC) + timedelta(minutes=GRACE_PERIOD_MINUTES + 5)
     _put_network_bytes("us-east-1", idle_instance_id, fixed_now, {"NetworkIn": 10})
 
+    get_asg_calls = []
+
     def broken_get_asg(region):
+        get_asg_calls.append(region)
         if region == "eu-west-1":
             raise RuntimeError("transient AWS error")
         return aws_helpers.get_asg(region)
@@ -193,3 +320,5 @@ def test_handler_continues_past_a_region_that_errors(aws, make_wireguard_asg, mo
         result = idle_shutdown.handler()
 
     assert result == {"stopped_regions": ["us-east-1"]}
+    # The ASG fetched for the check is reused for the stop, not fetched again.
+    assert sorted(get_asg_calls) == ["eu-west-1", "us-east-1"]
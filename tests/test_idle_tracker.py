@@ -0,0 +1,116 @@
+from datetime import UTC, datetime, timedelta
+
+import boto3
+
+from vpn_toggle import idle_tracker
+from vpn_toggle.idle_tracker import TrafficWindow, period_of, window_periods
+from vpn_toggle.region_state import get_ledger
+
+# One minute into a 5-minute period.
+NOW = datetime(2026, 3, 2, 12, 1, tzinfo=UTC)
+
+
+def _put_network_in(region, instance_id, timestamp, value):
+    boto3.client("cloudwatch", region_name=region).put_metric_data(
+        Namespace="AWS/EC2",
+        MetricData=[
+            {
+                "MetricName": "NetworkIn",
+                "Dimensions": [{"Name": "InstanceId", "Value": instance_id}],
+                "Timestamp": timestamp,
+                "Value": value,
+                "Unit": "Bytes",
+            }
+        ],
+    )
+
+
+def test_window_periods_covers_the_window_plus_the_current_period():
+    assert window_periods(30) == 7
+    assert window_periods(32) == 8
+
+
+def test_traffic_window_keeps_a_running_total_and_evicts_as_it_advances():
+    window = TrafficWindow(3, end=100)
+    assert window.total_bytes() is None
+
+    window.set(98, 10)
+    window.set(99, 20)
+    window.set(100, 30)
+    window.set(97, 1000)  # outside the window
+    assert window.total_bytes() == 60
+
+    window.set(99, 5)
+    assert window.total_bytes() == 45
+
+    window.advance(101)
+    assert window.total_bytes() == 35
+    assert window.get(98) is None
+
+    window.advance(110)
+    assert window.total_bytes() is None
+    assert window.settled == 107
+
+
+def test_traffic_window_round_trips_and_adapts_to_a_new_capacity():
+    window = TrafficWindow(3, end=100, settled=98)
+    window.set(99, 20)
+    window.set(100, 30)
+
+    data = window.to_dict()
+    assert data == {"end": 100, "settled": 98, "sums": [None, 20, 30]}
+    assert TrafficWindow.from_dict(data, 3).to_dict() == data
+
+    smaller = TrafficWindow.from_dict(data, 2)
+    assert smaller.total_bytes() == 50
+
+    larger = TrafficWindow.from_dict(data, 5)
+    assert larger.total_bytes() == 50
+    assert larger.settled == larger.start - 1
+
+
+def test_update_fetches_only_unsettled_periods_after_the_first_run(monkeypatch):
+    traffic = {period_of(NOW) - 1: 100, period_of(NOW) + 2: 100}
+    fetches = []
+
+    def fake_fetch(instance_ids, region, start_time, end_time):
+        fetches.append(start_time)
+        return {"i-vpn": {period: value for period, value in traffic.items() if period >= period_of(start_time)}}
+
+    monkeypatch.setattr(idle_tracker, "get_network_bytes_by_period", fake_fetch)
+
+    assert idle_tracker.update_network_bytes(["i-vpn"], "eu-west-1", 30, now=NOW) == {"i-vpn": 100}
+    later = NOW + timedelta(minutes=15)
+    assert idle_tracker.update_network_bytes(["i-vpn"], "eu-west-1", 30, now=later) == {"i-vpn": 200}
+
+    # The first run reads the whole window; the next only what wasn't settled by then.
+    assert fetches == [
+        NOW.replace(minute=0) - timedelta(minutes=30),
+        NOW.replace(minute=0) - timedelta(minutes=10),
+    ]
+
+
+def test_update_evicts_old_traffic_and_prunes_gone_instances(aws):
+    _put_network_in("eu-west-1", "i-vpn", NOW - timedelta(minutes=20), 5000)
+    _put_network_in("eu-west-1", "i-vpn", NOW - timedelta(minutes=5), 7)
+    _put_network_in("eu-west-1", "i-old", NOW - timedelta(minutes=5), 1)
+
+    assert idle_tracker.update_network_bytes(["i-vpn", "i-old"], "eu-west-1", 30, now=NOW) == {
+        "i-vpn": 5007,
+        "i-old": 1,
+    }
+
+    # 25 minutes on, the 5000 bytes have fallen out of the window.
+    later = NOW + timedelta(minutes=25)
+    assert idle_tracker.update_network_bytes(["i-vpn"], "eu-west-1", 30, now=later) == {"i-vpn": 7}
+    assert list(get_ledger().get_traffic("eu-west-1")) == ["i-vpn"]
+
+
+def test_region_traffic_is_dropped_when_scaled_to_zero(aws):
+    get_ledger().record("eu-west-1", 1, "i-vpn")
+    _put_network_in("eu-west-1", "i-vpn", NOW - timedelta(minutes=5), 7)
+    idle_tracker.update_network_bytes(["i-vpn"], "eu-west-1", 30, now=NOW)
+
+    get_ledger().record("eu-west-1", 0)
+
+    assert get_ledger().get_traffic("eu-west-1") == {}
@@ -0,0 +1,97 @@
+import json
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from vpn_toggle import aws_helpers, idle_shutdown, metrics, vpn_toggle
+
+
+def _emf_lines(capsys) -> list[dict]:
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+
+
+def _phases(documents) -> dict[tuple[str, str], object]:
+    return {(d["Phase"], d["Region"]): d["PhaseDuration"] for d in documents if "Phase" in d}
+
+
+def test_timed_phase_records_duration_even_when_block_raises():
+    recorder = metrics.get_recorder()
+
+    try:
+        with metrics.timed_phase("dns_upsert", "eu-west-1"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+
+    assert len(recorder.phase_durations[("dns_upsert", "eu-west-1")]) == 1
+
+
+def test_to_emf_documents_declare_their_metrics():
+    recorder = metrics.MetricsRecorder()
+    recorder.record_phase("wait_for_running", "eu-west-2", 100.0)
+    recorder.record_phase("wait_for_running", "eu-west-2", 300.0)
+    recorder.record_aws_call("ec2", "eu-west-2", retries=2, failed=False)
+    recorder.record_aws_call("ec2", "eu-west-2", retries=0, failed=True)
+
+    phase_doc, calls_doc = recorder.to_emf("vpn_toggle", "Test", timestamp_ms=1)
+
+    assert phase_doc["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "Test"
+    assert ["Function", "Phase", "Region"] in phase_doc["_aws"]["CloudWatchMetrics"][0]["Dimensions"]
+    assert phase_doc["PhaseDuration"] == [100.0, 300.0]
+    assert (calls_doc["Service"], calls_doc["AwsCalls"], calls_doc["AwsRetries"], calls_doc["AwsErrors"]) == (
+        "ec2",
+        2,
+        2,
+        1,
+    )
+
+
+def test_vpn_toggle_handler_emits_phase_and_call_metrics(aws, make_wireguard_asg, hosted_zone, monkeypatch, capsys):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "us-east-1"])
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+    make_wireguard_asg(region="eu-west-1", desired_capacity=0)
+    make_wireguard_asg(region="us-east-1", desired_capacity=1)
+
+    vpn_toggle.handler({"region": "eu-west-1", "whitelist_ip": "1.2.3.4"})
+
+    documents = _emf_lines(capsys)
+    phases = _phases(documents)
+    for phase in ("scale_up", "wait_for_running", "dns_upsert", "security_group_update", "time_to_ready"):
+        assert (phase, "eu-west-1") in phases
+    assert ("scale_down", "us-east-1") in phases
+    assert ("invocation", "global") in phases
+
+    calls = {(d["Service"], d["Region"]): d["AwsCalls"] for d in documents if "Service" in d}
+    assert calls[("autoscaling", "eu-west-1")] >= 2
+    assert calls[("ec2", "eu-west-1")] >= 1
+
+
+def test_idle_shutdown_handler_emits_per_region_check_metrics(aws, make_wireguard_asg, monkeypatch, capsys):
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", ["eu-west-1", "us-east-1"])
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+    make_wireguard_asg(region="eu-west-1", desired_capacity=0)
+    make_wireguard_asg(region="us-east-1", desired_capacity=0)
+
+    with patch("vpn_toggle.idle_shutdown.datetime") as mock_datetime:
+        mock_datetime.now.return_value = datetime.now(UTC) + timedelta(minutes=5)
+        idle_shutdown.handler()
+
+    phases = _phases(_emf_lines(capsys))
+    assert ("region_check", "eu-west-1") in phases
+    assert ("region_check", "us-east-1") in phases
+
+
+def test_aws_call_hook_counts_calls_and_retries(aws):
+    with metrics.invocation("test"):
+        aws_helpers.get_client("autoscaling", "eu-west-1").describe_auto_scaling_groups()
+        metrics._after_call(
+            "after-call.sns.Publish",
+            http_response=SimpleNamespace(status_code=200),
+            parsed={"ResponseMetadata": {"RetryAttempts": 2}},
+            context={"client_region": "eu-west-1"},
+        )
+        recorder = metrics.get_recorder()
+
+    assert recorder.aws_calls[("autoscaling", "eu-west-1")] == {"calls": 1, "retries": 0, "errors": 0}
+    assert recorder.aws_calls[("sns", "eu-west-1")] == {"calls": 1, "retries": 2, "errors": 0}
@@ -0,0 +1,78 @@
+import boto3
+import pytest
+
+from vpn_toggle import prefix_lists, vpn_toggle
+from vpn_toggle.region_state import get_ledger
+
+REGIONS = ["eu-west-1", "us-east-1"]
+
+
+@pytest.fixture
+def whitelist_prefix_lists(aws):
+    """Creates the IPv4 and IPv6 whitelist prefix lists VPNVMDeployStack deploys, in each region."""
+    ids = {}
+    for region in REGIONS:
+        ec2 = boto3.client("ec2", region_name=region)
+        for family, name in prefix_lists.WHITELIST_PREFIX_LIST_NAMES.items():
+            entries = [{"Cidr": "1.2.3.4/32"}] if family == "IPv4" else []
+            ids[(region, family)] = ec2.create_managed_prefix_list(
+                PrefixListName=name, AddressFamily=family, MaxEntries=20, Entries=entries
+            )["PrefixList"]["PrefixListId"]
+    return ids
+
+
+def _entries(region, prefix_list_id):
+    ec2 = boto3.client("ec2", region_name=region)
+    return sorted(e["Cidr"] for e in ec2.get_managed_prefix_list_entries(PrefixListId=prefix_list_id)["Entries"])
+
+
+def test_sync_whitelist_updates_every_region_and_skips_repeats(whitelist_prefix_lists, monkeypatch):
+    results = prefix_lists.sync_whitelist(["9.9.9.9", "2001:db8::1", "1.2.3.4"], REGIONS)
+
+    assert results == {"eu-west-1": "updated", "us-east-1": "updated"}
+    for region in REGIONS:
+        assert _entries(region, whitelist_prefix_lists[(region, "IPv4")]) == ["1.2.3.4/32", "9.9.9.9/32"]
+        assert _entries(region, whitelist_prefix_lists[(region, "IPv6")]) == ["2001:db8::1/128"]
+
+    monkeypatch.setattr(prefix_lists, "update_region", lambda *args: pytest.fail("should not sync again"))
+    assert prefix_lists.sync_whitelist(["1.2.3.4", "2001:db8::1", "9.9.9.9"], REGIONS) == {}
+
+
+def test_sync_whitelist_reports_a_region_without_prefix_lists(whitelist_prefix_lists):
+    results = prefix_lists.sync_whitelist("9.9.9.9", REGIONS + ["eu-west-2"])
+
+    assert results["eu-west-2"] == "error"
+    assert results["us-east-1"] == "updated"
+    # Retried on the next request, since one region missed it.
+    assert not get_ledger().is_whitelist_synced(["9.9.9.9/32"])
+
+
+def test_manage_vpn_syncs_prefix_lists_and_leaves_security_group_alone(
+    whitelist_prefix_lists, make_wireguard_asg, hosted_zone, monkeypatch
+):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", REGIONS)
+    monkeypatch.setenv("WHITELIST_PREFIX_LISTS", "true")
+    monkeypatch.setattr(vpn_toggle, "update_security_group", lambda *args: pytest.fail("should not touch the SG"))
+    make_wireguard_asg(region="eu-west-1", desired_capacity=0)
+    make_wireguard_asg(region="us-east-1", desired_capacity=0)
+
+    results = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "9.9.9.9")
+
+    assert results["us-east-1"] == "enabled"
+    for region in REGIONS:
+        assert _entries(region, whitelist_prefix_lists[(region, "IPv4")]) == ["9.9.9.9/32"]
+
+
+def test_manage_vpn_reports_the_target_as_failed_when_its_prefix_lists_are_not_updated(
+    whitelist_prefix_lists, make_wireguard_asg, hosted_zone, monkeypatch
+):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", REGIONS + ["eu-west-2"])
+    monkeypatch.setenv("WHITELIST_PREFIX_LISTS", "true")
+    for region in REGIONS + ["eu-west-2"]:
+        make_wireguard_asg(region=region, desired_capacity=0)
+
+    # eu-west-2 has no whitelist prefix lists.
+    results = vpn_toggle.manage_vpn("eu-west-2", "vpn.example.com", "example.com", "9.9.9.9")
+
+    assert results == {"eu-west-2": "error", "eu-west-1": "disabled", "us-east-1": "disabled"}
+    assert not get_ledger().is_whitelist_synced(["9.9.9.9/32"])
@@ -0,0 +1,118 @@
+from datetime import UTC, datetime, timedelta
+
+from vpn_toggle import aws_helpers, prewarm, region_state, vpn_toggle
+from vpn_toggle.region_state import get_ledger
+
+# A Wednesday, 07:50 UTC.
+NOW = datetime(2026, 3, 11, 7, 50, tzinfo=UTC)
+
+
+def _starts(ledger, region, times):
+    for when in times:
+        ledger.record_event(region, "start", now=when)
+
+
+def _weekday_mornings(days, hour=8, minute=0):
+    """Start times on the `days` weekdays before NOW."""
+    moments, day = [], NOW.date()
+    while len(moments) < days:
+        day -= timedelta(days=1)
+        if day.weekday() < 5:
+            moments.append(datetime(day.year, day.month, day.day, hour, minute, tzinfo=UTC))
+    return moments
+
+
+def test_predict_region_picks_the_regularly_started_region():
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", _weekday_mornings(5))
+    _starts(ledger, "us-east-1", [NOW - timedelta(days=3, hours=-1)])
+
+    region, confidence = prewarm.predict_region(ledger.get_history(), NOW, lead_minutes=15)
+
+    assert region == "eu-west-2"
+    assert confidence == 1.0
+
+
+def test_predict_region_ignores_starts_outside_the_window_or_on_other_kinds_of_day():
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", _weekday_mornings(5, hour=18))
+    saturday = datetime(2026, 3, 7, 8, 0, tzinfo=UTC)
+    _starts(ledger, "eu-north-1", [saturday - timedelta(days=7 * n) for n in range(4)])
+
+    assert prewarm.predict_region(ledger.get_history(), NOW, lead_minutes=15)[0] is None
+
+
+def test_predict_region_needs_enough_matching_days():
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", _weekday_mornings(2))
+
+    assert prewarm.predict_region(ledger.get_history(), NOW, lead_minutes=15) == (None, 0.0)
+
+
+def test_history_is_capped_per_region():
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", [NOW - timedelta(hours=n) for n in range(50)])
+
+    assert len(ledger.get_history()["eu-west-2"]["start"]) == region_state.HISTORY_MAX_EVENTS
+
+
+def test_prewarm_scales_up_predicted_region_once(aws, make_wireguard_asg):
+    make_wireguard_asg(region="eu-west-2", desired_capacity=0)
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", _weekday_mornings(5))
+
+    assert prewarm.prewarm(NOW, lead_minutes=15) == "eu-west-2"
+    assert aws_helpers.get_asg("eu-west-2").DesiredCapacity == 1
+    assert ledger.get_last_prewarm() == ("eu-west-2", NOW)
+
+    # Stopped again (e.g. by the idle shutdown); the cooldown stops a second pre-warm.
+    aws_helpers.update_asg_capacity(aws_helpers.get_asg("eu-west-2"), "eu-west-2", 0)
+    assert prewarm.prewarm(NOW + timedelta(minutes=15), lead_minutes=15) is None
+
+
+def test_prewarm_leaves_things_alone_when_the_vpn_is_already_on(aws, make_wireguard_asg):
+    make_wireguard_asg(region="eu-west-2", desired_capacity=0)
+    ledger = get_ledger()
+    _starts(ledger, "eu-west-2", _weekday_mornings(5))
+    ledger.record("us-east-1", 1)
+
+    assert prewarm.prewarm(NOW, lead_minutes=15) is None
+    assert aws_helpers.get_asg("eu-west-2").DesiredCapacity == 0
+
+
+def test_handler_caps_lead_time_at_the_idle_grace_period(monkeypatch):
+    monkeypatch.setenv("GRACE_PERIOD_MINUTES", "10")
+    monkeypatch.setenv("PREWARM_LEAD_MINUTES", "60")
+    calls = []
+    monkeypatch.setattr(prewarm, "prewarm", lambda now, lead_minutes, **kwargs: calls.append(lead_minutes))
+
+    prewarm.handler({})
+
+    assert calls == [10]
+
+
+def test_manage_vpn_records_start_and_stop_history(monkeypatch):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "eu-west-2"])
+    monkeypatch.setattr(
+        vpn_toggle,
+        "get_asg",
+        lambda region: aws_helpers.AutoScalingGroup("asg", 1 if region == "eu-west-1" else 0),
+    )
+    monkeypatch.setattr(vpn_toggle, "enable_vpn", lambda *args: aws_helpers.InstanceReadiness.RUNNING)
+    monkeypatch.setattr(vpn_toggle, "disable_vpn", lambda asg, region: None)
+
+    vpn_toggle.manage_vpn("eu-west-2", "vpn.example.com", "example.com", "1.2.3.4")
+
+    history = get_ledger().get_history()
+    assert len(history["eu-west-2"]["start"]) == 1
+    assert len(history["eu-west-1"]["stop"]) == 1
+
+
+def test_manage_vpn_does_not_record_repeats_in_history(monkeypatch):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "eu-west-2"])
+    monkeypatch.setattr(vpn_toggle, "is_repeat", lambda *args: True)
+
+    for _ in range(3):
+        assert vpn_toggle.manage_vpn("eu-west-2", "vpn.example.com", "example.com", "1.2.3.4")["eu-west-2"] == "enabled"
+
+    assert get_ledger().get_history() == {}
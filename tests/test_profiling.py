@@ -0,0 +1,61 @@
+import logging
+import pstats
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+from vpn_toggle import profiling
+
+
+def _busy_worker():
+    return sum(i * i for i in range(1000))
+
+
+@profiling.profiled("test")
+def _handler(event, context):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        return [f.result() for f in [executor.submit(_busy_worker) for _ in range(2)]]
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.delenv("PROFILE_HANDLER", raising=False)
+    monkeypatch.delenv("PROFILE_S3_BUCKET", raising=False)
+    return tmp_path
+
+
+def test_disabled_profiler_writes_nothing_and_imports_nothing(profile_dir, monkeypatch):
+    monkeypatch.delitem(sys.modules, "cProfile", raising=False)
+
+    assert _handler({}, None) == [332833500, 332833500]
+
+    assert list(profile_dir.iterdir()) == []
+    assert "cProfile" not in sys.modules
+
+
+def test_event_flag_profiles_handler_including_worker_threads(profile_dir, caplog):
+    with caplog.at_level(logging.INFO, logger="vpn_toggle.profiling"):
+        _handler({"profile": True}, None)
+
+    (dump,) = profile_dir.iterdir()
+    functions = {name for _, _, name in pstats.Stats(str(dump)).stats}
+    assert "_handler" in functions
+    assert "_busy_worker" in functions
+    assert "cumulative time" in caplog.text
+
+
+def test_env_flag_uploads_profile_to_s3(profile_dir, monkeypatch, aws):
+    boto3.client("s3", region_name="eu-west-1").create_bucket(
+        Bucket="vpn-profiles", CreateBucketConfiguration={"LocationConstraint": "eu-west-1"}
+    )
+    monkeypatch.setenv("PROFILE_HANDLER", "true")
+    monkeypatch.setenv("PROFILE_S3_BUCKET", "vpn-profiles")
+
+    _handler({}, None)
+
+    objects = boto3.client("s3", region_name="eu-west-1").list_objects_v2(Bucket="vpn-profiles")["Contents"]
+    keys = [o["Key"] for o in objects]
+    assert len(keys) == 1 and keys[0].startswith("profiles/test-")
@@ -0,0 +1,241 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock
+
+import boto3
+
+from vpn_toggle import aws_helpers, idle_shutdown, region_state, vpn_toggle
+from vpn_toggle.idle_tracker import TrafficWindow, period_of, window_periods
+
+
+def test_record_only_moves_changed_at_when_capacity_changes():
+    ledger = region_state.RegionStateLedger(region_state.InMemoryBackend())
+    first = datetime(2026, 1, 1, tzinfo=UTC)
+
+    ledger.record("eu-west-1", 1, ["i-123"], now=first)
+    ledger.record("eu-west-1", 1, now=first + timedelta(minutes=5))
+
+    assert ledger.get("eu-west-1") == {
+        "desired_capacity": 1,
+        "changed_at": first.isoformat(),
+        "instance_ids": ["i-123"],
+    }
+
+    ledger.record("eu-west-1", 0, now=first + timedelta(minutes=10))
+
+    assert ledger.get("eu-west-1")["instance_ids"] == []
+    assert ledger.is_known_off("eu-west-1")
+
+
+def test_whitelist_record_is_cleared_by_scale_down_or_instance_change():
+    ledger = region_state.RegionStateLedger(region_state.InMemoryBackend())
+    ledger.record("eu-west-1", 1, ["i-123"])
+    ledger.record_whitelist("eu-west-1", "1.2.3.4")
+
+    ledger.record("eu-west-1", 1, ["i-123"])
+    assert ledger.is_set_up_for("eu-west-1", "1.2.3.4")
+
+    ledger.record("eu-west-1", 1, ["i-456"])
+    assert not ledger.is_set_up_for("eu-west-1", "1.2.3.4")
+
+    # A second instance hasn't been set up for anyone yet either.
+    ledger.record_whitelist("eu-west-1", "1.2.3.4")
+    ledger.record("eu-west-1", 2, ["i-456", "i-789"])
+    assert not ledger.is_set_up_for("eu-west-1", "1.2.3.4")
+
+    ledger.record_whitelist("eu-west-1", "1.2.3.4")
+    ledger.record("eu-west-1", 0)
+    assert not ledger.is_set_up_for("eu-west-1", "1.2.3.4")
+
+
+def test_plan_scan_skips_known_off_regions_until_reconciliation_is_due():
+    ledger = region_state.RegionStateLedger(region_state.InMemoryBackend())
+    now = datetime(2026, 1, 1, tzinfo=UTC)
+    regions = ["eu-west-1", "us-east-1", "eu-west-2"]
+
+    assert ledger.plan_scan(regions, now=now, reconcile_interval_minutes=60) == (regions, True)
+
+    ledger.record("eu-west-1", 0, now=now)
+    ledger.record("us-east-1", 0, now=now)
+    ledger.mark_reconciled(now)
+
+    assert ledger.plan_scan(regions, now=now + timedelta(minutes=30), reconcile_interval_minutes=60) == (
+        ["eu-west-2"],
+        False,
+    )
+    assert ledger.plan_scan(
+        regions, now=now + timedelta(minutes=30), reconcile_interval_minutes=60, always=("us-east-1",)
+    ) == (["us-east-1", "eu-west-2"], False)
+    assert ledger.plan_scan(regions, now=now + timedelta(minutes=60), reconcile_interval_minutes=60) == (
+        regions,
+        True,
+    )
+
+
+def test_flush_persists_and_reloads_from_backend():
+    backend = region_state.InMemoryBackend()
+    ledger = region_state.RegionStateLedger(backend)
+
+    ledger.record("eu-west-1", 1, ["i-123"])
+    ledger.flush()
+    backend.document["regions"]["eu-west-1"]["instance_ids"] = ["i-456"]
+
+    assert ledger.get("eu-west-1")["instance_ids"] == ["i-456"]
+
+
+def test_concurrent_flushes_merge_instead_of_overwriting():
+    backend = region_state.InMemoryBackend()
+    seed = region_state.RegionStateLedger(backend)
+    seed.record("eu-west-1", 0)
+    seed.record("us-east-1", 1, ["i-123"])
+    seed.record_pending("us-east-1", ["1.2.3.4/32"])
+    seed.flush()
+    toggler = region_state.RegionStateLedger(backend)
+    idle_checker = region_state.RegionStateLedger(backend)
+    assert toggler.is_known_off("eu-west-1") and idle_checker.is_known_off("eu-west-1")
+
+    toggler.record("eu-west-1", 1, ["i-456"])
+    toggler.clear_pending("us-east-1")
+    idle_checker.record_traffic("us-east-1", {"i-123": {"end": 1, "settled": 0, "sums": [None]}})
+    idle_checker.mark_reconciled()
+    toggler.flush()
+    idle_checker.flush()
+
+    # The idle checker's stale copy doesn't undo the start (or the cleared pending start).
+    merged = region_state.RegionStateLedger(backend)
+    assert merged.get("eu-west-1")["desired_capacity"] == 1
+    assert merged.get("eu-west-1")["instance_ids"] == ["i-456"]
+    assert merged.get_pending("us-east-1") is None
+    assert merged.get_traffic("us-east-1") == {"i-123": {"end": 1, "settled": 0, "sums": [None]}}
+    assert "reconciled_at" in backend.document
+
+
+def test_ssm_backend_round_trips_document(aws):
+    ssm = boto3.client("ssm", region_name="eu-west-1")
+    backend = region_state.SsmParameterBackend("/vpn-wireguard/REGION_STATE", ssm)
+
+    assert backend.load() == {}
+
+    backend.save({"regions": {"eu-west-1": {"desired_capacity": 0}}})
+
+    assert backend.load() == {"regions": {"eu-west-1": {"desired_capacity": 0}}}
+
+
+def test_worst_case_document_fits_a_standard_ssm_parameter():
+    """
+    Every region with a full history; the requested region running three instances with a
+    pending 20-CIDR IPv6 whitelist and traffic windows; another region pre-warmed alongside it.
+    """
+    backend = region_state.InMemoryBackend()
+    ledger = region_state.RegionStateLedger(backend)
+    now = datetime(2026, 3, 2, 12, 1, 59, 999999, tzinfo=UTC)
+    cidrs = [f"2001:db8:85a3:{n:04x}:5678:8a2e:370:7334/128" for n in range(20)]
+    for region in aws_helpers.VALID_ZONES:
+        for day in range(region_state.HISTORY_MAX_EVENTS + 5):
+            ledger.record_event(region, "start", now=now - timedelta(days=day))
+            ledger.record_event(region, "stop", now=now - timedelta(days=day, hours=-9))
+        ledger.record(region, 0, now=now)
+    for region in aws_helpers.VALID_ZONES[:2]:
+        instance_ids = [f"i-0123456789abcdef{n}" for n in range(3)]
+        ledger.record(region, 3, instance_ids, now=now)
+        ledger.record_whitelist(region, cidrs)
+        traffic = {}
+        for instance_id in instance_ids:
+            window = TrafficWindow(window_periods(30), period_of(now), settled=period_of(now) - 3)
+            for period in range(window.start, window.end + 1):
+                window.set(period, 9_999_999_999)
+            traffic[instance_id] = window.to_dict()
+        ledger.record_traffic(region, traffic)
+    ledger.record_pending(aws_helpers.VALID_ZONES[0], cidrs, "Root=1-67891233-abcdef012345678912345678", now=now)
+    ledger.mark_reconciled(now)
+    ledger.record_prewarm(aws_helpers.VALID_ZONES[1], now)
+    ledger.record_synced_whitelist(cidrs)
+    ledger.flush()
+
+    assert len(region_state.encode_document(backend.document).encode()) < region_state.MAX_DOCUMENT_BYTES
+    assert "history" in backend.document
+
+
+def test_oversized_document_drops_history_rather_than_failing_the_save(aws):
+    ssm = boto3.client("ssm", region_name="eu-west-1")
+    backend = region_state.SsmParameterBackend("/vpn-wireguard/REGION_STATE", ssm)
+    document = {
+        "regions": {"eu-west-1": {"desired_capacity": 1, "pending": {"whitelist_ip": ["1.2.3.4/32"] * 100}}},
+        "history": {"eu-west-1": {"start": "x" * 3000}},
+    }
+
+    backend.save(document)
+
+    assert backend.load() == {"regions": document["regions"]}
+
+
+def test_update_asg_capacity_records_into_ledger(aws, make_wireguard_asg, region_state_ledger):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+
+    aws_helpers.update_asg_capacity(aws_helpers.get_asg("eu-west-1"), "eu-west-1", 0)
+
+    assert region_state_ledger.is_known_off("eu-west-1")
+
+
+def test_manage_vpn_skips_regions_known_to_be_off(monkeypatch, region_state_ledger):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "us-east-1", "eu-west-2"])
+    for region in ("eu-west-1", "us-east-1"):
+        region_state_ledger.record(region, 0)
+    region_state_ledger.mark_reconciled()
+    touched = []
+    monkeypatch.setattr(vpn_toggle, "get_asg", lambda region: touched.append(region) or MagicMock(name=region))
+    monkeypatch.setattr(vpn_toggle, "enable_vpn", lambda *a, **k: None)
+    monkeypatch.setattr(vpn_toggle, "disable_vpn", lambda asg, region: None)
+
+    result = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "1.2.3.4")
+
+    assert sorted(touched) == ["eu-west-2", "us-east-1"]
+    assert result == {"eu-west-1": "skipped", "us-east-1": "enabled", "eu-west-2": "disabled"}
+
+
+def test_manage_vpn_full_scan_is_not_marked_reconciled_when_a_region_fails(monkeypatch, region_state_ledger):
+    regions = ["eu-west-1", "us-east-1", "eu-west-2"]
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", regions)
+
+    def get_asg(region):
+        if region == "eu-west-2":
+            raise RuntimeError("throttled")
+        return MagicMock(name=region)
+
+    monkeypatch.setattr(vpn_toggle, "get_asg", get_asg)
+    monkeypatch.setattr(vpn_toggle, "enable_vpn", lambda *a, **k: None)
+    monkeypatch.setattr(vpn_toggle, "disable_vpn", lambda asg, region: None)
+
+    result = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "1.2.3.4")
+
+    assert result["eu-west-2"] == "error"
+    assert region_state_ledger.plan_scan(regions) == (regions, True)
+
+
+def test_idle_handler_only_checks_regions_not_known_off(monkeypatch, region_state_ledger):
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", ["eu-west-1", "us-east-1"])
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+    region_state_ledger.record("eu-west-1", 0)
+    region_state_ledger.mark_reconciled()
+    checked = []
+    monkeypatch.setattr(idle_shutdown, "get_asg", lambda region: checked.append(region) or MagicMock(DesiredCapacity=0))
+
+    result = idle_shutdown.handler()
+
+    assert result == {"stopped_regions": []}
+    assert checked == ["us-east-1"]
+
+
+def test_idle_handler_full_scan_is_not_marked_reconciled_when_a_region_fails(monkeypatch, region_state_ledger):
+    regions = ["eu-west-1", "us-east-1"]
+    monkeypatch.setattr(idle_shutdown, "VALID_ZONES", regions)
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:eu-west-1:123456789012:vpn-auto-stop-notifications")
+
+    def get_asg(region):
+        if region == "us-east-1":
+            raise RuntimeError("throttled")
+        return MagicMock(DesiredCapacity=0)
+
+    monkeypatch.setattr(idle_shutdown, "get_asg", get_asg)
+
+    assert idle_shutdown.handler() == {"stopped_regions": []}
+    assert region_state_ledger.plan_scan(regions) == (regions, True)
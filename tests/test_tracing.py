@@ -0,0 +1,71 @@
+import json
+import logging
+from datetime import UTC, datetime, timedelta
+
+from vpn_toggle import tracing, vpn_toggle
+
+
+def _sns_event(trace_id=None, requested_at=None):
+    attributes = {"source": {"Type": "String", "Value": "iOS"}}
+    if trace_id:
+        attributes["trace_id"] = {"Type": "String", "Value": trace_id}
+    if requested_at:
+        attributes["requested_at"] = {"Type": "Number", "Value": str(int(requested_at.timestamp() * 1000))}
+    return {
+        "Records": [
+            {
+                "Sns": {
+                    "Message": '{"region": "us-east-1", "whitelist_ip": "5.6.7.8"}',
+                    "MessageAttributes": attributes,
+                }
+            }
+        ]
+    }
+
+
+def test_from_sns_record_reads_trace_attributes():
+    requested_at = datetime(2026, 1, 1, 12, 0, 0, tzinfo=UTC)
+
+    trace_id, parsed_requested_at = tracing.from_sns_record(_sns_event("abc123def456", requested_at)["Records"][0])
+
+    assert trace_id == "abc123def456"
+    assert parsed_requested_at == requested_at
+
+
+def test_from_sns_record_tolerates_missing_attributes():
+    assert tracing.from_sns_record({"Sns": {"Message": "{}"}}) == (None, None)
+
+
+def test_trace_context_generates_an_id_when_none_is_given():
+    with tracing.trace_context() as trace_id:
+        assert tracing.get_trace_id() == trace_id
+        assert len(trace_id) == 32
+    assert tracing.get_trace_id() is None
+
+
+def test_trace_id_filter_prefixes_log_messages_once():
+    record = logging.LogRecord("vpn_toggle", logging.INFO, __file__, 1, "Enabling VPN in %s", ("eu-west-1",), None)
+    log_filter = tracing.TraceIdFilter()
+
+    with tracing.trace_context("abc123def456"):
+        log_filter.filter(record)
+        log_filter.filter(record)
+
+    assert record.trace_id == "abc123def456"
+    assert record.getMessage() == "[trace_id=abc123def456] Enabling VPN in eu-west-1"
+
+
+def test_handler_adopts_the_proxy_trace_id_for_logs_and_metrics(monkeypatch, capsys):
+    seen = []
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: seen.append(tracing.get_trace_id()) or {})
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+
+    vpn_toggle.handler(_sns_event("abc123def456", datetime.now(UTC) - timedelta(seconds=2)))
+
+    assert seen == ["abc123def456"]
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert documents and all(d["TraceId"] == "abc123def456" for d in documents)
+    delivery = next(d for d in documents if d.get("Phase") == "request_to_handler")
+    assert delivery["PhaseDuration"] >= 2000
+    assert any(d.get("Phase") == "request_to_done" and d["Region"] == "us-east-1" for d in documents)
@@ -4,6 +4,7 @@ import boto3
 import pytest
 
 from vpn_toggle import aws_helpers, vpn_toggle
+from vpn_toggle.region_state import get_ledger
 
 
 def test_get_asg_finds_tagged_asg_and_ignores_untagged(aws, make_wireguard_asg):
@@ -39,22 +40,22 @@ def test_update_asg_capacity_changes_capacity(aws, make_wireguard_asg):
     assert updated.DesiredCapacity == 0
 
 
-def test_get_instance_from_asg_returns_launch_time(aws, make_wireguard_asg):
+def test_get_instances_from_asg_returns_launch_time(aws, make_wireguard_asg):
     _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
     asg = aws_helpers.get_asg("eu-west-1")
 
-    instance = aws_helpers.get_instance_from_asg(asg, "eu-west-1")
+    (instance,) = aws_helpers.get_instances_from_asg(asg, "eu-west-1")
 
     assert instance.InstanceId == instance_id
     assert instance.LaunchTime is not None
 
 
-def test_get_instance_from_asg_raises_when_no_instance_attached(aws, make_wireguard_asg):
+def test_get_instances_from_asg_raises_when_no_instance_attached(aws, make_wireguard_asg):
     make_wireguard_asg(region="eu-west-1", desired_capacity=0)
     asg = aws_helpers.get_asg("eu-west-1")
 
     with pytest.raises(ValueError):
-        aws_helpers.get_instance_from_asg(asg, "eu-west-1")
+        aws_helpers.get_instances_from_asg(asg, "eu-west-1")
 
 
 def test_manage_vpn_enables_target_region_and_disables_all_others(monkeypatch):
@@ -65,10 +66,11 @@ def test_manage_vpn_enables_target_region_and_disables_all_others(monkeypatch):
     monkeypatch.setattr(vpn_toggle, "enable_vpn", lambda asg, region, *a, **k: enable_calls.append(region))
     monkeypatch.setattr(vpn_toggle, "disable_vpn", lambda asg, region: disable_calls.append(region))
 
-    vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "1.2.3.4")
+    result = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "1.2.3.4")
 
     assert enable_calls == ["us-east-1"]
-    assert disable_calls == ["eu-west-1", "eu-west-2"]
+    assert sorted(disable_calls) == ["eu-west-1", "eu-west-2"]
+    assert result == {"us-east-1": "enabled", "eu-west-1": "disabled", "eu-west-2": "disabled"}
 
 
 def test_manage_vpn_none_disables_every_region(monkeypatch):
@@ -80,7 +82,26 @@ def test_manage_vpn_none_disables_every_region(monkeypatch):
 
     vpn_toggle.manage_vpn("none", "vpn.example.com", "example.com", "1.2.3.4")
 
-    assert disable_calls == ["eu-west-1", "us-east-1"]
+    assert sorted(disable_calls) == ["eu-west-1", "us-east-1"]
+
+
+def test_manage_vpn_continues_past_a_region_that_errors(monkeypatch):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "us-east-1", "eu-west-2"])
+
+    def broken_get_asg(region):
+        if region == "eu-west-1":
+            raise RuntimeError("transient AWS error")
+        return MagicMock(name=region)
+
+    monkeypatch.setattr(vpn_toggle, "get_asg", broken_get_asg)
+    enable_calls = []
+    monkeypatch.setattr(vpn_toggle, "enable_vpn", lambda asg, region, *a, **k: enable_calls.append(region))
+    monkeypatch.setattr(vpn_toggle, "disable_vpn", lambda asg, region: None)
+
+    result = vpn_toggle.manage_vpn("us-east-1", "vpn.example.com", "example.com", "1.2.3.4")
+
+    assert enable_calls == ["us-east-1"]
+    assert result == {"us-east-1": "enabled", "eu-west-1": "error", "eu-west-2": "disabled"}
 
 
 def test_manage_vpn_raises_on_invalid_region(monkeypatch):
@@ -102,18 +123,42 @@ def test_enable_vpn_sets_capacity_and_updates_dns_and_security_group(
     assert updated.DesiredCapacity == 1
 
 
+def test_enable_vpn_starts_every_instance_and_publishes_a_multi_value_a_record(
+    aws, make_wireguard_asg, hosted_zone, monkeypatch
+):
+    monkeypatch.setenv("VPN_INSTANCE_COUNT", "2")
+    make_wireguard_asg(region="eu-west-1", desired_capacity=0, max_size=2)
+    asg = aws_helpers.get_asg("eu-west-1")
+
+    readiness = vpn_toggle.enable_vpn(asg, "eu-west-1", "vpn.example.com", "example.com", "1.2.3.4")
+
+    assert readiness == aws_helpers.InstanceReadiness.RUNNING
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+    assert snapshot.asg.DesiredCapacity == 2
+    assert len(snapshot.instances) == 2
+    records = boto3.client("route53").list_resource_record_sets(HostedZoneId=hosted_zone)["ResourceRecordSets"]
+    a_record = next(r for r in records if r["Name"] == "vpn.example.com." and r["Type"] == "A")
+    assert sorted(r["Value"] for r in a_record["ResourceRecords"]) == sorted(snapshot.public_ips)
+    entry = get_ledger().get("eu-west-1")
+    assert entry["desired_capacity"] == 2
+    assert entry["instance_ids"] == sorted(instance.InstanceId for instance in snapshot.instances)
+
+    # The same IPs in any order need no change.
+    snapshot.public_ips.reverse()
+    assert aws_helpers.set_dns_alias("vpn.example.com", "example.com", snapshot) is None
+
+
 def test_update_security_group_keeps_world_open_ports_and_clamps_ssh(
     aws, make_wireguard_asg
 ):
     make_wireguard_asg(region="eu-west-1", desired_capacity=1)
-    asg = aws_helpers.get_asg("eu-west-1")
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
 
-    aws_helpers.update_security_group(asg, "9.9.9.9", "eu-west-1")
+    aws_helpers.update_security_group(snapshot, "9.9.9.9")
 
-    instance = aws_helpers.get_instance_from_asg(asg, "eu-west-1")
     ec2 = boto3.client("ec2", region_name="eu-west-1")
     security_group = ec2.describe_security_groups(
-        GroupIds=[instance.SecurityGroups[0]["GroupId"]]
+        GroupIds=[snapshot.security_group_id]
     )["SecurityGroups"][0]
     rules = {
         (p["IpProtocol"], p["FromPort"]): [r["CidrIp"] for r in p["IpRanges"]]
@@ -126,6 +171,92 @@ def test_update_security_group_keeps_world_open_ports_and_clamps_ssh(
     assert rules[("tcp", 22)] == ["9.9.9.9/32"]
 
 
+def test_collapse_whitelist_merges_adjacent_and_covered_ranges():
+    assert aws_helpers.collapse_whitelist("9.9.9.9") == ["9.9.9.9/32"]
+    assert aws_helpers.collapse_whitelist(
+        ["10.0.0.0/25", "10.0.0.128/25", "10.0.0.7", "2001:db8::1", "9.9.9.9", "2001:db8::/64"]
+    ) == ["9.9.9.9/32", "10.0.0.0/24", "2001:db8::/64"]
+    with pytest.raises(ValueError):
+        aws_helpers.collapse_whitelist(["9.9.9.9", "not-an-ip"])
+
+
+@pytest.mark.parametrize("entry", ["1.2.3.4/0", "0.0.0.0/0", "10.0.0.0/15", "::/0", "2001:db8::/47"])
+def test_collapse_whitelist_rejects_overly_wide_entries(entry):
+    with pytest.raises(ValueError, match="too wide"):
+        aws_helpers.collapse_whitelist(["9.9.9.9", entry])
+
+
+def test_collapse_whitelist_accepts_the_widest_allowed_entries():
+    assert aws_helpers.collapse_whitelist(["10.1.2.3/16", "2001:db8::/48"]) == ["10.1.0.0/16", "2001:db8::/48"]
+
+
+def test_update_security_group_applies_a_collapsed_whitelist_in_one_update(aws, make_wireguard_asg):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+
+    aws_helpers.update_security_group(snapshot, ["9.9.9.9", "10.0.0.0/25", "10.0.0.128/25", "2001:db8::1"])
+
+    ec2 = boto3.client("ec2", region_name="eu-west-1")
+    (ssh,) = [
+        p
+        for p in ec2.describe_security_groups(GroupIds=[snapshot.security_group_id])["SecurityGroups"][0][
+            "IpPermissions"
+        ]
+        if p["FromPort"] == 22
+    ]
+    assert sorted(r["CidrIp"] for r in ssh["IpRanges"]) == ["10.0.0.0/24", "9.9.9.9/32"]
+    assert [r["CidrIpv6"] for r in ssh["Ipv6Ranges"]] == ["2001:db8::1/128"]
+
+
+def test_handler_accepts_a_whitelist_list(monkeypatch):
+    calls = []
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args) or {})
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+
+    vpn_toggle.handler({"region": "eu-west-1", "whitelist_ip": ["1.2.3.4", "5.6.7.0/24"]})
+
+    assert calls == [("eu-west-1", "vpn.example.com", "example.com", ["1.2.3.4", "5.6.7.0/24"])]
+
+
+def test_get_region_snapshot_resolves_ip_and_security_group(aws, make_wireguard_asg):
+    _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+
+    ec2 = boto3.client("ec2", region_name="eu-west-1")
+    described = ec2.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+    assert snapshot.asg.AutoScalingGroupName == "wireguard-asg-eu-west-1"
+    assert [instance.InstanceId for instance in snapshot.instances] == [instance_id]
+    assert snapshot.public_ips == [described["PublicIpAddress"]]
+    assert snapshot.security_group_id == described["SecurityGroups"][0]["GroupId"]
+
+
+def test_set_dns_alias_points_record_at_snapshot_ip(aws, make_wireguard_asg, hosted_zone):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+
+    aws_helpers.set_dns_alias("vpn.example.com", "example.com", snapshot)
+
+    route53 = boto3.client("route53")
+    records = route53.list_resource_record_sets(HostedZoneId=hosted_zone)["ResourceRecordSets"]
+    a_record = next(r for r in records if r["Name"] == "vpn.example.com." and r["Type"] == "A")
+    assert a_record["ResourceRecords"] == [{"Value": snapshot.public_ips[0]}]
+
+
+def test_set_dns_alias_skips_change_when_record_already_current(aws, make_wireguard_asg, hosted_zone):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    snapshot = aws_helpers.get_region_snapshot("eu-west-1")
+    assert aws_helpers.set_dns_alias("vpn.example.com", "example.com", snapshot) is not None
+    calls = []
+    aws_helpers.get_client("route53").meta.events.register(
+        "before-call", lambda model, **kwargs: calls.append(model.name)
+    )
+
+    assert aws_helpers.set_dns_alias("vpn.example.com", "example.com", snapshot) is None
+    assert calls == ["ListResourceRecordSets"]
+
+
 def test_disable_vpn_sets_capacity_to_zero(aws, make_wireguard_asg):
     make_wireguard_asg(region="eu-west-1", desired_capacity=1)
     asg = aws_helpers.get_asg("eu-west-1")
@@ -138,7 +269,7 @@ def test_disable_vpn_sets_capacity_to_zero(aws, make_wireguard_asg):
 
 def test_handler_direct_invoke_calls_manage_vpn(monkeypatch):
     calls = []
-    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args))
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args) or {})
     monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
     monkeypatch.setenv("DOMAIN_NAME", "example.com")
 
@@ -149,7 +280,7 @@ def test_handler_direct_invoke_calls_manage_vpn(monkeypatch):
 
 def test_handler_sns_event_unwraps_message_and_calls_manage_vpn(monkeypatch):
     calls = []
-    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args))
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args) or {})
     monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
     monkeypatch.setenv("DOMAIN_NAME", "example.com")
 
@@ -163,6 +294,73 @@ def test_handler_sns_event_unwraps_message_and_calls_manage_vpn(monkeypatch):
     assert calls == [("us-east-1", "vpn.example.com", "example.com", "5.6.7.8")]
 
 
+def test_handler_coalesces_sns_batch_to_latest_request(monkeypatch):
+    calls = []
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args) or {})
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+
+    def record(region, timestamp):
+        return {
+            "Sns": {
+                "Message": f'{{"region": "{region}", "whitelist_ip": "5.6.7.8"}}',
+                "Timestamp": timestamp,
+            }
+        }
+
+    event = {
+        "Records": [
+            record("eu-west-2", "2026-03-11T08:00:02.000Z"),
+            record("none", "2026-03-11T08:00:05.000Z"),
+            record("us-east-1", "2026-03-11T08:00:01.000Z"),
+        ]
+    }
+    vpn_toggle.handler(event)
+
+    assert calls == [("none", "vpn.example.com", "example.com", "5.6.7.8")]
+
+
+def test_handler_drops_a_request_older_than_the_last_applied_one(monkeypatch):
+    calls = []
+    monkeypatch.setattr(vpn_toggle, "manage_vpn", lambda *args: calls.append(args) or {})
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+
+    def event(region, timestamp):
+        message = f'{{"region": "{region}", "whitelist_ip": "5.6.7.8"}}'
+        return {"Records": [{"Sns": {"Message": message, "Timestamp": timestamp}}]}
+
+    vpn_toggle.handler(event("none", "2026-03-11T08:00:05.000Z"))
+    # A throttled retry of an earlier start, delivered after the stop was applied.
+    assert vpn_toggle.handler(event("us-east-1", "2026-03-11T08:00:01.000Z")) == {}
+    # A retry of the applied request itself still goes through.
+    vpn_toggle.handler(event("none", "2026-03-11T08:00:05.000Z"))
+
+    assert [call[0] for call in calls] == ["none", "none"]
+
+
+@pytest.mark.parametrize("outcome", ["error", "timed-out", "launch-failed"])
+def test_handler_raises_after_toggling_every_region_when_the_target_fails(monkeypatch, outcome):
+    monkeypatch.setattr(vpn_toggle, "VALID_ZONES", ["eu-west-1", "us-east-1"])
+    monkeypatch.setenv("A_RECORD_NAME", "vpn.example.com")
+    monkeypatch.setenv("DOMAIN_NAME", "example.com")
+    toggled = []
+
+    def toggle(region, target_region, *args):
+        toggled.append(region)
+        if region != target_region:
+            return "disabled"
+        if outcome == "error":
+            raise RuntimeError("ASG not found")
+        return outcome
+
+    monkeypatch.setattr(vpn_toggle, "_toggle_region", toggle)
+
+    with pytest.raises(RuntimeError, match="us-east-1"):
+        vpn_toggle.handler({"region": "us-east-1", "whitelist_ip": "1.2.3.4"})
+    assert sorted(toggled) == ["eu-west-1", "us-east-1"]
+
+
 def test_handler_raises_when_required_env_vars_missing(monkeypatch):
     monkeypatch.delenv("A_RECORD_NAME", raising=False)
     monkeypatch.delenv("DOMAIN_NAME", raising=False)
@@ -177,3 +375,156 @@ def test_handler_raises_on_event_missing_region_or_ip(monkeypatch):
 
     with pytest.raises(ValueError):
         vpn_toggle.handler({"something": "else"})
+
+
+def test_get_client_reuses_one_client_per_service_and_region(aws):
+    ec2 = aws_helpers.get_client("ec2", "eu-west-1")
+
+    assert aws_helpers.get_client("ec2", "eu-west-1") is ec2
+    assert aws_helpers.get_client("ec2", "us-east-1") is not ec2
+    assert aws_helpers.get_client("autoscaling", "eu-west-1") is not ec2
+    assert ec2.meta.config.tcp_keepalive is True
+
+
+class FakeClock:
+    """Stands in for aws_helpers' time module so the readiness waiter runs without real sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_wait_for_instances_running_returns_immediately_when_running(aws, make_wireguard_asg, monkeypatch):
+    _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    clock = FakeClock()
+    monkeypatch.setattr(aws_helpers, "time", clock)
+
+    readiness, instances = aws_helpers.wait_for_instances_running("eu-west-1", 60)
+
+    assert readiness == aws_helpers.InstanceReadiness.RUNNING
+    assert [instance.InstanceId for instance in instances] == [instance_id]
+    assert clock.sleeps == []
+
+
+def test_wait_for_instances_running_backs_off_until_deadline(aws, make_wireguard_asg, monkeypatch):
+    make_wireguard_asg(region="eu-west-1", desired_capacity=0)
+    clock = FakeClock()
+    monkeypatch.setattr(aws_helpers, "time", clock)
+
+    readiness, instances = aws_helpers.wait_for_instances_running("eu-west-1", 60)
+
+    assert readiness == aws_helpers.InstanceReadiness.TIMED_OUT
+    assert instances == []
+    assert clock.now == pytest.approx(60)
+    assert clock.sleeps[0] <= 1.0
+    assert max(clock.sleeps) <= 8.0
+    assert len(clock.sleeps) < 20
+
+
+def test_wait_for_instances_running_reports_launch_failure(monkeypatch):
+    monkeypatch.setattr(aws_helpers, "time", FakeClock())
+    monkeypatch.setattr(aws_helpers, "get_asg", lambda region: MagicMock(DesiredCapacity=2))
+    running = MagicMock(InstanceId="i-ok", State={"Name": "running"})
+    dead = MagicMock(InstanceId="i-dead", State={"Name": "terminated"})
+    monkeypatch.setattr(aws_helpers, "get_instances_from_asg", lambda asg, region: [running, dead])
+
+    readiness, instances = aws_helpers.wait_for_instances_running("eu-west-1", 60)
+
+    assert readiness == aws_helpers.InstanceReadiness.LAUNCH_FAILED
+    assert instances == [running, dead]
+
+
+def test_wait_for_instances_running_waits_for_every_desired_instance(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws_helpers, "time", clock)
+    monkeypatch.setattr(aws_helpers, "get_asg", lambda region: MagicMock(DesiredCapacity=2))
+    first = MagicMock(InstanceId="i-first", State={"Name": "running"})
+    second = MagicMock(InstanceId="i-second", State={"Name": "running"})
+    attached = iter([[first], [first, MagicMock(InstanceId="i-second", State={"Name": "pending"})], [first, second]])
+    monkeypatch.setattr(aws_helpers, "get_instances_from_asg", lambda asg, region: next(attached))
+
+    readiness, instances = aws_helpers.wait_for_instances_running("eu-west-1", 60)
+
+    assert readiness == aws_helpers.InstanceReadiness.RUNNING
+    assert instances == [first, second]
+    assert len(clock.sleeps) == 2
+
+
+def test_enable_vpn_skips_dns_and_security_group_when_instance_never_runs(monkeypatch):
+    monkeypatch.setattr(vpn_toggle, "update_asg_capacity", lambda asg, region, capacity: capacity)
+    monkeypatch.setattr(
+        vpn_toggle,
+        "wait_for_instances_running",
+        lambda region, timeout: (aws_helpers.InstanceReadiness.TIMED_OUT, []),
+    )
+    monkeypatch.setattr(vpn_toggle, "set_dns_alias", lambda *a: pytest.fail("DNS should not be touched"))
+    monkeypatch.setattr(vpn_toggle, "update_security_group", lambda *a: pytest.fail("SG should not be touched"))
+
+    readiness = vpn_toggle.enable_vpn(MagicMock(), "eu-west-1", "vpn.example.com", "example.com", "1.2.3.4")
+
+    assert readiness == aws_helpers.InstanceReadiness.TIMED_OUT
+
+
+def test_get_instances_from_asg_uses_asg_instance_list_without_scanning(aws, make_wireguard_asg):
+    _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    asg = aws_helpers.get_asg("eu-west-1")
+    calls = []
+    aws_helpers.get_client("autoscaling", "eu-west-1").meta.events.register(
+        "before-call", lambda model, **kwargs: calls.append(model.name)
+    )
+    aws_helpers.get_client("ec2", "eu-west-1").meta.events.register(
+        "before-call", lambda model, **kwargs: calls.append(model.name)
+    )
+
+    (instance,) = aws_helpers.get_instances_from_asg(asg, "eu-west-1")
+
+    assert instance.InstanceId == instance_id
+    assert calls == ["DescribeInstances"]
+
+
+def test_get_asg_reads_warm_pool_configuration(aws, make_wireguard_asg):
+    asg_name, _ = make_wireguard_asg(region="eu-west-1", desired_capacity=0)
+    assert aws_helpers.get_asg("eu-west-1").warm_pool_state is None
+
+    boto3.client("autoscaling", region_name="eu-west-1").put_warm_pool(
+        AutoScalingGroupName=asg_name, PoolState="Stopped", InstanceReusePolicy={"ReuseOnScaleIn": True}
+    )
+
+    assert aws_helpers.get_asg("eu-west-1").warm_pool_state == "Stopped"
+
+
+def test_get_instances_from_asg_ignores_warm_pool_instances(aws, make_wireguard_asg):
+    _, instance_id = make_wireguard_asg(region="eu-west-1", desired_capacity=1)
+    asg = aws_helpers.get_asg("eu-west-1")
+    warmed = {"InstanceId": "i-0123456789abcdef0", "LifecycleState": "Warmed:Stopped"}
+
+    asg.Instances = [warmed, *asg.Instances]
+    assert [i.InstanceId for i in aws_helpers.get_instances_from_asg(asg, "eu-west-1")] == [instance_id]
+
+    # An instance on its way back into the pool is as unusable as one already parked there.
+    asg.Instances = [warmed, {"InstanceId": instance_id, "LifecycleState": "Warmed:Pending"}]
+    with pytest.raises(ValueError):
+        aws_helpers.get_instances_from_asg(asg, "eu-west-1")
+
+
+def test_wait_for_instances_running_waits_out_a_warm_pool_resume(monkeypatch):
+    monkeypatch.setattr(aws_helpers, "time", FakeClock())
+    monkeypatch.setattr(aws_helpers, "get_asg", lambda region: MagicMock(DesiredCapacity=1))
+    states = iter(["stopped", "pending", "running"])
+    monkeypatch.setattr(
+        aws_helpers,
+        "get_instances_from_asg",
+        lambda asg, region: [MagicMock(InstanceId="i-warm", State={"Name": next(states)})],
+    )
+
+    readiness, instances = aws_helpers.wait_for_instances_running("eu-west-1", 60)
+
+    assert readiness == aws_helpers.InstanceReadiness.RUNNING
+    assert [instance.InstanceId for instance in instances] == ["i-warm"]